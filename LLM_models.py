@@ -1,84 +1,421 @@
+import atexit
 import os
-import google.generativeai as genai
 import sqlite3
-from dotenv import load_dotenv
-from sqlite_seed import SCHEMA_SQL
-
-# DATABASE CONNECTION
-conn = sqlite3.connect("/Users/nada/PycharmProjects/AI_AGENTS_PROJECT/AI_AGENT/erp_database.db")
-cursor = conn.cursor()
-
-# LOADING API KEY FROM .env FILE
-load_dotenv()
-api_key = os.getenv("GOOGLE_API_KEY")
-genai.configure(api_key=api_key)
-
-# IMPORTING SCHEMA
-schema = SCHEMA_SQL
-
-# MODEL INTERACTING WITH SQL DATABASE
-retrieval_model = genai.GenerativeModel(
-    model_name="gemini-2.5-flash",
-    system_instruction=f"""
-        You are a helpful AI assistant specialized in databases and backend engineering.
-        Always provide clear, structured explanations. Convert user questions into valid SQLite SQL queries.
-        Return ONLY the SQL query. Generate valid sqlite3 query. Do not alter the tables or columns, do not drop any too.
-        Do not explain anything. Return ONLY raw SQL. Do NOT use markdown. Do NOT wrap the query in backticks. When returning the result rows,
-        only return the related columns to the request.
-        Use this schema:
-        {schema}
-        """
-)
-
-# MODEL EXPLAINING SQL RESULTS FROM RETRIEVAL MODEL
-explanation_model = genai.GenerativeModel(
-    model_name="gemini-2.5-flash",
-    system_instruction=f"""
-        You are a helpful AI assistant specialized in databases and backend engineering, and you're also very good at explaining things.
-        You receive sql results and explain them in human readable friendly format.
-        """
-)
-
-# WELCOME MESSAGE & STARTING THE CONVO
-print("Hello! I'm your assistant. How can I help you today?")
-retrieval_chat = retrieval_model.start_chat()
-
-while True:
-    user_input = input("You: ")
-    # IF USER PRESSES ENTER WITHOUT PROVIDING AN INPUT
-    if not user_input.strip():
-        print("Please enter a valid question.")
-        continue
-    response = retrieval_chat.send_message(user_input)
-    # FORMING THE SQL QUERY, NO ACTIONS TAKEN YET
-    sql_query = response.text.strip()
-    print(f"SQL Query: {sql_query}")
-
-    # EXECUTING THE SQL QUERY ON THE DATABASE
-    try:
-        cursor.execute(sql_query)
-        rows = cursor.fetchall()
-        print("Results:")
-        for row in rows:
-            print(row)
-
-        # IF THERE IS A RESULT, PASS IT TO THE EXPLANATION MODEL WITH THE CONTEXT
-        if rows:
-            explanation_prompt = f"""
-                User question: {user_input}
-                SQL query executed: {sql_query}
-                SQL result rows: {rows}
-                Explain these results clearly in a friendly human-readable way.
-                """
-
-            explanation_response = explanation_model.generate_content(explanation_prompt)
-            explanation_text = explanation_response.text.strip()
-
-            print("\nExplanation:")
-            print(explanation_text)
-        else:
-            print("\nExplanation:")
-            print("No records were found matching your request.")
-
-    except Exception as e:
-        print("SQL Error:", e)
+import time
+from functools import cached_property
+
+from sqlite_seed import DB_PATH, SCHEMA_SQL
+from query_cache import QuestionCache
+from schema_index import SchemaIndex
+from streaming import stream_rows, stream_explanation
+from result_summary import ResultSummary, estimate_tokens
+from db_pool import ReadOnlyPool
+from cost_gate import CostGate, generate_checked_sql
+from index_advisor import QueryLog
+from tracing import Tracer
+from local_render import ExplanationPolicy, render_result, result_shape
+from sql_templates import EntityDictionary, TemplateIndex, cached_pairs
+from example_index import DEFAULT_FEW_SHOT, EXAMPLES_DIR, ExampleIndex, bootstrap
+from result_cache import CachingGuard, ResultCache
+from result_export import EXPORT_DIR, EXPORT_FORMATS, ExportError, export_path, export_query, export_summary, resolve_format
+from conversation_memory import ConversationMemory
+from agent_server import build_backends
+from model_router import DEFAULT_THRESHOLD, FAST_MODEL_NAME, STRONG_MODEL_NAME, ModelRouter, Tier
+from agent_pipeline import NO_RESULTS_TEXT, retrieval_message, explanation_prompt, clean_sql
+
+
+def component(build):
+    # BUILT ON FIRST USE AND KEPT, THE BUILD TIME GOES INTO agent.timings FOR /startup
+    def timed(self):
+        started = time.perf_counter()
+        value = build(self)
+        self.timings[build.__name__] = round(time.perf_counter() - started, 4)
+        return value
+
+    timed.__name__ = build.__name__
+    return cached_property(timed)
+
+
+class Agent:
+    """
+    Everything the REPL needs, configured from environment variables and built
+    on first use: nothing touches the database or the Gemini API at import
+    time. A cached question never builds the models, a template hit never
+    builds the retrieval model. warm() builds everything up front instead.
+    """
+
+    def __init__(self, env=os.environ):
+        # DATABASE PATH, AGENT_DB_PATH OR THE SEEDED erp_database.db
+        self.db_path = env.get("AGENT_DB_PATH", DB_PATH)
+        # AGENT_BACKEND=fake RUNS WITHOUT NETWORK ACCESS, AGENT_FAKE_RESPONSES MAPS QUESTIONS TO SQL
+        self.backend_name = env.get("AGENT_BACKEND", "gemini")
+        self.fake_responses = env.get("AGENT_FAKE_RESPONSES")
+        # MODEL TIERS: SIMPLE QUESTIONS GO TO AGENT_FAST_MODEL, HARD ONES AND SQL THAT FAILS TO COMPILE TO AGENT_STRONG_MODEL
+        # AGENT_ROUTER=fast/strong PINS ONE TIER, AGENT_ROUTER=off USES THE SINGLE DEFAULT MODEL
+        self.router_mode = env.get("AGENT_ROUTER", "auto")
+        self.fast_model = env.get("AGENT_FAST_MODEL", FAST_MODEL_NAME)
+        self.strong_model = env.get("AGENT_STRONG_MODEL", STRONG_MODEL_NAME)
+        self.route_threshold = float(env.get("AGENT_ROUTE_THRESHOLD", str(DEFAULT_THRESHOLD)))
+        self.fake_fast_responses = env.get("AGENT_FAKE_FAST_RESPONSES")
+        self.query_seconds = float(env.get("AGENT_QUERY_SECONDS", "5"))
+        self.query_rows = int(env.get("AGENT_QUERY_ROWS", "100000"))
+        # STREAMING MODE: ROWS PRINTED IN BATCHES AS THEY ARRIVE, EXPLANATION PRINTED TOKEN BY TOKEN
+        # SET AGENT_STREAM=0 TO GO BACK TO FETCHALL + ONE BLOCKING EXPLANATION CALL
+        self.stream_mode = env.get("AGENT_STREAM", "1") != "0"
+        # TOKEN BUDGET FOR THE RESULT SUMMARY SENT TO THE EXPLANATION MODEL
+        self.explanation_token_budget = int(env.get("AGENT_EXPLAIN_TOKENS", "1500"))
+        # SMALL RESULTS ARE EXPLAINED LOCALLY, AGENT_EXPLAIN=llm ALWAYS CALLS THE MODEL, AGENT_EXPLAIN=local NEVER DOES
+        self.explanation_policy = ExplanationPolicy(env.get("AGENT_EXPLAIN", "auto"))
+        self.cost_budget = float(env.get("AGENT_COST_BUDGET", "20000000"))
+        self.max_rows = int(env.get("AGENT_MAX_ROWS", "10000"))
+        self.max_sql_retries = int(env.get("AGENT_SQL_RETRIES", "2"))
+        self.result_cache_bytes = int(float(env.get("AGENT_RESULT_CACHE_MB", "64")) * 1_048_576)
+        # /export WRITES HERE, IN AGENT_EXPORT_FORMAT UNLESS THE COMMAND NAMES ONE
+        self.export_dir = env.get("AGENT_EXPORT_DIR", EXPORT_DIR)
+        self.export_format = env.get("AGENT_EXPORT_FORMAT", "csv")
+        self.export_seconds = float(env.get("AGENT_EXPORT_SECONDS", "600"))
+        # VERIFIED QUESTION/SQL PAIRS, THE AGENT_FEW_SHOT MOST SIMILAR GO INTO EACH SQL REQUEST; AGENT_FEW_SHOT=0 TURNS IT OFF
+        self.examples_dir = env.get("AGENT_EXAMPLES_DIR", EXAMPLES_DIR)
+        self.few_shot = int(env.get("AGENT_FEW_SHOT", str(DEFAULT_FEW_SHOT)))
+        # PER-TURN TRACES AND METRICS, ENABLED BY SETTING AGENT_TRACE_DIR
+        self.tracer = Tracer.from_env()
+        self.timings = {}
+
+    # DATABASE CONNECTION, READ-ONLY: IT ONLY FEEDS THE SCHEMA INDEX, COST GATE AND ENTITY DICTIONARY
+    @component
+    def conn(self):
+        return sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True)
+
+    # READ-ONLY POOL FOR THE GENERATED SQL, QUERIES ARE CANCELLED PAST THEIR TIME/ROW BUDGET
+    @component
+    def db_pool(self):
+        return ReadOnlyPool(self.db_path, size=1, time_budget=self.query_seconds, row_budget=self.query_rows)
+
+    # COST GATE: EXPENSIVE PLANS ARE REJECTED AND THE MODEL IS ASKED AGAIN WITH THE PLAN AS FEEDBACK
+    @component
+    def cost_gate(self):
+        return CostGate.from_connection(self.conn, cost_budget=self.cost_budget, max_rows=self.max_rows)
+
+    # RESULTS OF REPEATED SQL ARE REPLAYED FROM MEMORY UNTIL THE TABLES THEY READ CHANGE
+    @component
+    def result_cache(self):
+        return ResultCache(self.db_path, max_bytes=self.result_cache_bytes)
+
+    # EVERY EXECUTED QUERY IS LOGGED WITH ITS TIMING FOR THE INDEX ADVISOR
+    @component
+    def query_log(self):
+        return QueryLog()
+
+    # SCHEMA INDEX FROM THE LIVE DB, ONLY THE TABLES A QUESTION NEEDS ARE SENT
+    @component
+    def schema_index(self):
+        return SchemaIndex(self.conn)
+
+    # BOTH MODELS, THE GEMINI CLIENT (DOTENV, API KEY) IS ONLY LOADED WHEN A MODEL IS FIRST NEEDED
+    # WITH ROUTING ON THESE ARE THE FAST TIER'S
+    @component
+    def backends(self):
+        if self.router_mode == "off":
+            return build_backends(self.backend_name, self.fake_responses)
+        return build_backends(self.backend_name, self.fake_fast_responses or self.fake_responses, model_name=self.fast_model)
+
+    # ROUTER PICKING THE FAST OR STRONG TIER PER QUESTION, WITH PER-TIER LATENCY AND COST
+    @component
+    def router(self):
+        strong = None
+        if self.router_mode != "off":
+            strong = Tier("strong", *build_backends(self.backend_name, self.fake_responses, model_name=self.strong_model))
+        return ModelRouter(
+            Tier("fast" if strong else "default", *self.backends),
+            strong,
+            schema_index=self.schema_index,
+            entities=self.template_index.entities,
+            threshold=self.route_threshold,
+            mode=self.router_mode if strong else "auto",
+        )
+
+    # MODEL INTERACTING WITH SQL DATABASE
+    @property
+    def retrieval_model(self):
+        return self.backends[0]
+
+    # MODEL EXPLAINING SQL RESULTS FROM RETRIEVAL MODEL
+    @property
+    def explanation_model(self):
+        return self.backends[1]
+
+    # QUESTION -> SQL CACHE, SKIPS THE MODEL ROUND TRIP FOR REPEATED QUESTIONS
+    @component
+    def question_cache(self):
+        return QuestionCache(SCHEMA_SQL)
+
+    # TEMPLATES MINED FROM PAST QUESTIONS: "OPEN BILLS FOR VENDOR X" IS ANSWERED LOCALLY FOR ANY KNOWN VENDOR
+    @component
+    def template_index(self):
+        index = TemplateIndex(EntityDictionary(self.conn))
+        index.mine(cached_pairs())
+        return index
+
+    # FEW-SHOT EXAMPLES, A NEW INDEX STARTS FROM THE QUESTION CACHE; None WHEN TURNED OFF
+    @component
+    def example_index(self):
+        if not self.examples_dir or not self.few_shot:
+            return None
+        index = ExampleIndex(self.examples_dir)
+        bootstrap(index)
+        return index
+
+    def warm(self) -> dict:
+        # BUILDS EVERY COMPONENT NOW INSTEAD OF DURING THE FIRST QUESTIONS
+        for name in ("conn", "db_pool", "cost_gate", "result_cache", "query_log", "schema_index",
+                     "question_cache", "template_index", "example_index", "backends", "router"):
+            getattr(self, name)
+        return self.timings
+
+
+def check_template(agent, turn, question):
+    # RETURNS THE PLAN VERDICT FOR A TEMPLATE MATCH, OR None WHEN THE MODEL IS NEEDED
+    with turn.span("template_match") as span:
+        template_sql = agent.template_index.match(question)
+        span.set(hit=template_sql is not None)
+    if template_sql is None:
+        return None
+    with agent.db_pool.query() as plan_cursor:
+        verdict = agent.cost_gate.check(plan_cursor, template_sql)
+    return verdict if verdict.accepted else None
+
+
+def send_retrieval(retrieval_chat, turn, text):
+    with turn.span("send_message", prompt_tokens=estimate_tokens(text)) as span:
+        sql_text = clean_sql(retrieval_chat.send_message(text))
+        span.set(response_tokens=estimate_tokens(sql_text))
+    return sql_text
+
+
+def escalate_retrieval(agent, route, conversation_memory, turn):
+    # SQL THAT DOESN'T COMPILE IS ASKED AGAIN FROM THE STRONG TIER, IN A FRESH CHAT; None WHEN ALREADY THERE
+    if not agent.router.escalate(route):
+        return None
+    turn.set(escalated=True)
+    strong_chat = route.tier.retrieval.start_chat(history=conversation_memory.history())
+    return lambda text: send_retrieval(strong_chat, turn, text)
+
+
+def learn_sql(agent, question, sql_query):
+    # MODEL-WRITTEN SQL THAT RAN BECOMES A TEMPLATE AND A FEW-SHOT EXAMPLE FOR SIMILAR QUESTIONS
+    agent.template_index.learn(question, sql_query)
+    if agent.example_index is not None:
+        agent.example_index.add(question, sql_query)
+
+
+def parse_export(user_input, default_format):
+    # "/export jsonl all asset transactions" -> ("jsonl", "all asset transactions")
+    words = user_input.strip().split(maxsplit=2)[1:]
+    if words and words[0].lower() in EXPORT_FORMATS:
+        return resolve_format(words[0]), " ".join(words[1:]).strip()
+    return resolve_format(default_format), " ".join(words).strip()
+
+
+def export_rows(agent, question, sql_query, export_format):
+    # FULL DUMPS GET THEIR OWN TIME BUDGET AND NO ROW BUDGET, AND SKIP THE RESULT CACHE
+    with agent.db_pool.query(time_budget=agent.export_seconds, row_budget=0) as guard:
+        return export_query(guard, sql_query, export_path(question, export_format, agent.export_dir), export_format)
+
+
+def main():
+    started = time.perf_counter()
+    agent = Agent()
+    # METRICS ARE ONLY REWRITTEN EVERY FEW TURNS, SO WRITE THEM ON ANY EXIT (EOF, CTRL-C, ERRORS)
+    atexit.register(agent.tracer.flush)
+    # AGENT_WARM=1 PAYS THE WHOLE SETUP BEFORE THE PROMPT INSTEAD OF ON THE FIRST QUESTIONS
+    if os.getenv("AGENT_WARM", "0") != "0":
+        agent.warm()
+    # BOUNDED HISTORY: RECENT TURNS VERBATIM, OLDER ONES COMPACTED, A FRESH CHAT IS BUILT FROM IT EVERY TURN
+    conversation_memory = ConversationMemory(token_budget=int(os.getenv("AGENT_HISTORY_TOKENS", "1200")))
+    startup_seconds = time.perf_counter() - started
+
+    # WELCOME MESSAGE & STARTING THE CONVO
+    print("Hello! I'm your assistant. How can I help you today?")
+
+    while True:
+        try:
+            user_input = input("You: ")
+        except (EOFError, KeyboardInterrupt):
+            # CTRL-D / CTRL-C AT THE PROMPT ENDS THE SESSION
+            print()
+            return
+        # IF USER PRESSES ENTER WITHOUT PROVIDING AN INPUT
+        if not user_input.strip():
+            print("Please enter a valid question.")
+            continue
+        # SHOW CACHE COUNTERS
+        if user_input.strip().lower() == "/cache":
+            print(agent.question_cache.stats())
+            print(agent.template_index.stats())
+            if agent.example_index is not None:
+                print(agent.example_index.stats())
+            print(agent.result_cache.stats())
+            print(agent.explanation_policy.stats)
+            continue
+        # SHOW CONVERSATION MEMORY SIZE
+        if user_input.strip().lower() == "/memory":
+            print(conversation_memory.stats())
+            continue
+        # SHOW WHICH TIER ANSWERED HOW MANY QUESTIONS, ITS LATENCY AND ESTIMATED COST
+        if user_input.strip().lower() == "/models":
+            print(agent.router.stats())
+            continue
+        # SHOW STARTUP TIME AND WHAT EACH COMPONENT TOOK TO BUILD SO FAR
+        if user_input.strip().lower() == "/startup":
+            print({"startup_seconds": round(startup_seconds, 4), "components": agent.timings})
+            continue
+        # /export [csv|jsonl|columnar|parquet|arrow] QUESTION WRITES THE WHOLE RESULT TO A FILE INSTEAD OF PRINTING IT
+        export_format = None
+        if user_input.strip().lower().split()[0] == "/export":
+            try:
+                export_format, user_input = parse_export(user_input, agent.export_format)
+            except ExportError as e:
+                print(e)
+                continue
+            if not user_input:
+                print(f"Usage: /export [{'|'.join(EXPORT_FORMATS)}] QUESTION")
+                continue
+        turn = agent.tracer.start_turn(question=user_input)
+        # ROUTED QUESTIONS REPORT BACK WHETHER THEIR SQL RAN, FOR THE FAILURE RATE OF SIMILAR QUESTIONS
+        route = None
+        route_failed = None
+        try:
+            cached_sql = agent.question_cache.get(user_input)
+            turn.set(cache_hit=cached_sql is not None)
+            template_verdict = check_template(agent, turn, user_input) if cached_sql is None else None
+            turn.set(template_hit=template_verdict is not None)
+            if cached_sql is not None:
+                sql_query = cached_sql
+                print(f"SQL Query (cached): {sql_query}")
+            elif template_verdict is not None:
+                sql_query = template_verdict.sql_query
+                print(f"SQL Query (template): {sql_query}")
+            else:
+                route = agent.router.route(user_input)
+                turn.set(tier=route.tier.name, route_score=round(route.score, 2))
+                retrieval_chat = route.tier.retrieval.start_chat(history=conversation_memory.history())
+                turn.set(**conversation_memory.stats())
+                with turn.span("prompt_build") as span:
+                    schema_digest = agent.schema_index.digest_for(user_input)
+                    examples = agent.example_index.search(user_input, agent.few_shot) if agent.example_index is not None else []
+                    retrieval_request = retrieval_message(schema_digest, user_input, examples)
+                    span.set(bytes=len(retrieval_request), prompt_tokens=estimate_tokens(retrieval_request), examples=len(examples))
+                # FORMING THE SQL QUERY AND CHECKING ITS PLAN, NO ACTIONS TAKEN YET
+                with agent.db_pool.query() as plan_cursor:
+                    verdict, attempts = generate_checked_sql(
+                        lambda text: send_retrieval(retrieval_chat, turn, text),
+                        retrieval_request,
+                        agent.cost_gate,
+                        plan_cursor,
+                        agent.max_sql_retries,
+                        escalate=lambda: escalate_retrieval(agent, route, conversation_memory, turn),
+                    )
+                sql_query = verdict.sql_query
+                turn.set(sql_attempts=attempts, plan_status=verdict.status)
+                if route.escalated:
+                    print(f"(SQL did not compile, asked {route.tier.model_name} instead)")
+                print(f"SQL Query: {agent.cost_gate.without_row_limit(sql_query) if export_format else sql_query}")
+                if not verdict.accepted:
+                    route_failed = True
+                    print(f"Query rejected after {attempts} attempt(s): {'; '.join(verdict.reasons)}")
+                    continue
+                if verdict.status == "rewritten" and export_format is None:
+                    print(f"Note: {verdict.reasons[-1]}")
+            conversation_memory.add_turn(user_input, sql_query)
+
+            # EXPORT MODE: ROWS ARE STREAMED TO THE FILE IN CHUNKS, ONLY THE PATH AND THROUGHPUT ARE PRINTED
+            if export_format is not None:
+                # THE COST GATE'S LIMIT PROTECTS THE TERMINAL, AN EXPORT WANTS EVERY ROW
+                export_sql = agent.cost_gate.without_row_limit(sql_query)
+                try:
+                    with turn.span("export", format=export_format) as span:
+                        report = export_rows(agent, user_input, export_sql, export_format)
+                        span.set(rows=report["rows"], bytes=report["bytes"])
+                except (sqlite3.Error, ExportError, OSError) as e:
+                    turn.set(error=type(e).__name__)
+                    print("Export Error:", e)
+                    continue
+                agent.query_log.record(export_sql, report["seconds"], report["rows"])
+                route_failed = False
+                # THE CACHE KEEPS THE LIMITED SQL, CACHED SQL DOESN'T GO THROUGH THE GATE AGAIN
+                if cached_sql is None:
+                    agent.question_cache.put(user_input, sql_query)
+                if cached_sql is None and template_verdict is None:
+                    learn_sql(agent, user_input, sql_query)
+                print(export_summary(report))
+                continue
+
+            # EXECUTING THE SQL QUERY ON THE DATABASE
+            try:
+                started = time.perf_counter()
+                with agent.db_pool.query() as guard:
+                    cursor = CachingGuard(agent.result_cache, guard)
+                    with turn.span("sql_execute") as span:
+                        cursor.execute(sql_query)
+                        span.set(result_cache_hit=cursor.cache_hit)
+                    print("Results:")
+                    # ONE PASS OVER THE ROWS BUILDS COLUMN STATS AND A SAMPLE FOR THE EXPLANATION
+                    summary = ResultSummary([col[0] for col in cursor.description or []])
+                    if agent.stream_mode:
+                        # ROWS ARE PRINTED AS THEY ARE FETCHED, SO FETCH AND RENDER ARE ONE SPAN
+                        with turn.span("fetch", streamed=True) as span:
+                            row_count, rows = stream_rows(cursor, on_batch=summary.add_rows)
+                            span.set(rows=row_count)
+                    else:
+                        with turn.span("fetch") as span:
+                            rows = cursor.fetchall()
+                            row_count = len(rows)
+                            summary.add_rows(rows)
+                            span.set(rows=row_count)
+                        with turn.span("render", rows=row_count):
+                            for row in rows:
+                                print(row)
+                if not cursor.cache_hit:
+                    agent.query_log.record(sql_query, time.perf_counter() - started, row_count)
+                route_failed = False
+                # ONLY SQL THAT ACTUALLY RAN GETS CACHED
+                if cached_sql is None:
+                    agent.question_cache.put(user_input, sql_query)
+                if cached_sql is None and template_verdict is None:
+                    learn_sql(agent, user_input, sql_query)
+
+                # IF THERE IS A RESULT, PASS IT TO THE EXPLANATION MODEL WITH THE CONTEXT
+                shape = result_shape(sql_query, summary.columns, row_count)
+                if rows and agent.explanation_policy.explain_locally(user_input, shape):
+                    print("\nExplanation:")
+                    with turn.span("explanation", local=True, shape=shape):
+                        print(render_result(shape, summary.columns, rows, row_count))
+                elif rows:
+                    explanation_request = explanation_prompt(user_input, sql_query, summary.render(agent.explanation_token_budget))
+                    # CACHED AND TEMPLATE ANSWERS ARE ROUTED HERE, ONLY FOR THE EXPLANATION
+                    explanation_model = (route or agent.router.route(user_input)).tier.explanation
+
+                    print("\nExplanation:")
+                    with turn.span("explanation", prompt_tokens=estimate_tokens(explanation_request), bytes=len(explanation_request)) as span:
+                        if agent.stream_mode:
+                            explanation_text = stream_explanation(explanation_model, explanation_request)
+                        else:
+                            explanation_text = explanation_model.generate(explanation_request).strip()
+                            print(explanation_text)
+                        span.set(response_tokens=estimate_tokens(explanation_text))
+                else:
+                    print("\nExplanation:")
+                    print(NO_RESULTS_TEXT)
+
+            except Exception as e:
+                turn.set(error=type(e).__name__)
+                route_failed = True if route_failed is None else route_failed
+                print("SQL Error:", e)
+        finally:
+            if route is not None and route_failed is not None:
+                agent.router.record(route, route_failed)
+            turn.finish()
+
+
+if __name__ == "__main__":
+    main()
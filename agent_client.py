@@ -0,0 +1,88 @@
+import argparse
+import json
+import os
+import socket
+import sys
+import time
+
+
+# stdlib only on purpose: this runs once per question, so it has to start fast
+DEFAULT_SOCKET_PATH = os.getenv("AGENT_SOCKET", "/tmp/erp_agent.sock")
+
+
+def request(socket_path: str, payload: dict):
+    """
+    Sends one request to agent_daemon.py and yields the events that come
+    back, ending with the "answer", "stats" or "error" event.
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path)
+        sock.sendall(json.dumps(payload).encode("utf-8") + b"\n")
+        with sock.makefile("r", encoding="utf-8") as lines:
+            for line in lines:
+                event = json.loads(line)
+                yield event
+                if event["type"] in ("answer", "stats", "error"):
+                    return
+
+
+def print_event(event: dict):
+    if event["type"] == "sql":
+        print(f"SQL Query: {event['sql']}")
+    elif event["type"] == "rows":
+        print("Results:")
+        for row in event["rows"]:
+            print(tuple(row))
+        if event["row_count"] > len(event["rows"]):
+            print(f"... {event['row_count']} rows in total")
+    elif event["type"] == "answer":
+        if "error" in event:
+            print(event["error"])
+        elif "export" in event:
+            print(event["explanation"])
+        elif "explanation" in event:
+            print("\nExplanation:")
+            print(event["explanation"])
+    elif event["type"] == "error":
+        print(event["error"], file=sys.stderr)
+    else:
+        print(json.dumps(event, indent=2, default=str))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ask the running agent daemon a question")
+    parser.add_argument("question", nargs="*", help="the question; read from stdin when omitted")
+    parser.add_argument("--socket", default=DEFAULT_SOCKET_PATH, help="daemon socket (default: $AGENT_SOCKET or /tmp/erp_agent.sock)")
+    parser.add_argument("--session", help="continue this session; the id is printed with --json and --timing")
+    parser.add_argument("--export", metavar="FORMAT", help="write the full result to a file on the daemon's side (csv, jsonl, columnar, ...)")
+    parser.add_argument("--stats", action="store_true", help="print the daemon's startup timings and metrics")
+    parser.add_argument("--json", action="store_true", help="print the final event as JSON")
+    parser.add_argument("--timing", action="store_true", help="print the round trip time to stderr")
+    args = parser.parse_args()
+
+    if args.stats:
+        payload = {"command": "stats"}
+    else:
+        question = " ".join(args.question).strip() or sys.stdin.read().strip()
+        payload = {"question": question, "session_id": args.session, "export": args.export}
+
+    started = time.perf_counter()
+    event = None
+    try:
+        for event in request(args.socket, payload):
+            if not args.json:
+                print_event(event)
+    except (FileNotFoundError, ConnectionRefusedError):
+        print(f"No agent daemon on {args.socket}, start one with: python agent_daemon.py", file=sys.stderr)
+        raise SystemExit(2)
+    if args.json and event is not None:
+        print(json.dumps(event, default=str))
+    if args.timing:
+        session = f", session {event['session_id']}" if event and event.get("session_id") else ""
+        print(f"({(time.perf_counter() - started) * 1000:.1f} ms round trip{session})", file=sys.stderr)
+    if event is None or event["type"] == "error" or "error" in event:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
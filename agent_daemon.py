@@ -0,0 +1,267 @@
+import argparse
+import asyncio
+import json
+import os
+import signal
+import time
+from collections import deque
+
+from query_cache import CACHE_DB_PATH
+from model_router import add_router_arguments
+from sqlite_seed import DB_PATH
+
+
+DEFAULT_SOCKET_PATH = os.getenv("AGENT_SOCKET", "/tmp/erp_agent.sock")
+WARM_PROMPT = "Reply with the single word OK."
+
+
+class AgentDaemon:
+    """
+    Long-lived AgentServer behind a Unix socket, so scripted callers don't pay
+    imports, schema indexing, template mining and model setup on every run.
+    Everything slow happens once in start() and is timed per phase; a few
+    sessions are kept open ahead of time and handed out to new clients.
+
+    Protocol: one JSON object per line each way. {"question": ..., "session_id": ...}
+    gets sql and rows events followed by {"type": "answer", ...}, the same events
+    as the server's WebSocket; with "export": "<format>" the rows go to a file
+    and the answer carries its path. {"command": "stats"} returns startup timings and
+    server metrics.
+    """
+
+    def __init__(self, server, spare_sessions: int = 4):
+        self.server = server
+        self.spare_sessions = spare_sessions
+        self.spare = deque()
+        self.startup = {}
+        self.started_at = None
+        self.clients = 0
+
+    def _fill_spare(self):
+        while len(self.spare) < self.spare_sessions:
+            session = self.server.open_session()
+            # kept out of the session table until handed out, so idle expiry doesn't drop it
+            self.server.sessions.pop(session.session_id, None)
+            self.spare.append(session)
+
+    def session_for(self, session_id: str = None):
+        session = self.server.sessions.get(session_id) if session_id else None
+        if session is not None:
+            return session
+        session = self.spare.popleft() if self.spare else self.server.open_session()
+        session.last_used = time.monotonic()
+        self.server.sessions[session.session_id] = session
+        self._fill_spare()
+        return session
+
+    def stats(self) -> dict:
+        return {
+            "startup": self.startup,
+            "uptime_seconds": round(time.monotonic() - self.started_at, 1) if self.started_at else 0.0,
+            "clients": self.clients,
+            "spare_sessions": len(self.spare),
+            **self.server.metrics(),
+        }
+
+    async def handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.clients += 1
+
+        async def send(event: dict):
+            writer.write(json.dumps(event, default=str).encode("utf-8") + b"\n")
+            await writer.drain()
+
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    return
+                try:
+                    request = json.loads(line)
+                except ValueError:
+                    await send({"type": "error", "error": "request must be one JSON object per line"})
+                    continue
+                if request.get("command") == "stats":
+                    await send({"type": "stats", **self.stats()})
+                    continue
+                question = str(request.get("question", "")).strip()
+                if not question:
+                    await send({"type": "error", "error": "Please enter a valid question."})
+                    continue
+                session = self.session_for(request.get("session_id"))
+                try:
+                    reply = await self.server.ask(session, question, on_event=send, export=request.get("export"))
+                    await send({"type": "answer", **reply})
+                except Exception as e:
+                    await send({"type": "error", "session_id": session.session_id, "error": f"{type(e).__name__}: {e}"})
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, socket_path: str):
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        server = await asyncio.start_unix_server(self.handle_client, path=socket_path)
+        # the socket answers questions against the ERP data, only the owner may connect
+        os.chmod(socket_path, 0o600)
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+        print(f"Agent daemon listening on {socket_path}")
+        try:
+            async with server:
+                await stop.wait()
+        finally:
+            # metrics are only rewritten every few turns, write the last ones out
+            self.server.tracer.flush()
+            if os.path.exists(socket_path):
+                os.remove(socket_path)
+
+
+async def warm_queries(server, limit: int) -> int:
+    # replays the most expensive logged query shapes so their pages (and results) are cached
+    if server.query_log is None or not limit:
+        return 0
+    loop = asyncio.get_running_loop()
+
+    def replay(sql_query: str) -> bool:
+        try:
+            with server.connections.query() as guard:
+                cursor = server.result_cache.execute(guard, sql_query) if server.result_cache is not None else guard.execute(sql_query)
+                while cursor.fetchmany(500):
+                    pass
+            return True
+        except Exception:
+            return False
+
+    replayed = 0
+    for sql_query, _, _ in server.query_log.workload(limit):
+        replayed += await loop.run_in_executor(server.db_pool, replay, sql_query)
+    return replayed
+
+
+async def start(args) -> AgentDaemon:
+    """
+    Builds the daemon phase by phase and records seconds per phase in
+    daemon.startup. The agent modules are imported here rather than at the
+    top so their import cost shows up in the report.
+    """
+    startup = {}
+    started = time.perf_counter()
+    phase = started
+
+    def mark(name: str):
+        nonlocal phase
+        now = time.perf_counter()
+        startup[name] = round(now - phase, 4)
+        phase = now
+
+    from agent_server import AgentServer, build_tiers
+    from example_index import bootstrap
+    from sql_templates import cached_pairs
+    from tracing import Tracer
+    mark("imports")
+
+    (retrieval_backend, explanation_backend), strong_backends = build_tiers(args)
+    mark("backends")
+
+    server = AgentServer(
+        retrieval_backend,
+        explanation_backend,
+        db_path=args.db,
+        db_workers=args.db_workers,
+        max_inflight=args.max_inflight,
+        max_queued=args.max_queued,
+        time_budget=args.time_budget,
+        row_budget=args.row_budget,
+        query_log_path=args.query_log or None,
+        tracer=Tracer(args.trace_dir) if args.trace_dir else None,
+        history_tokens=args.history_tokens,
+        explain_mode=args.explain,
+        result_cache_mb=args.result_cache_mb,
+        export_dir=args.export_dir,
+        shards=args.shards,
+        strong_backends=strong_backends,
+        route_mode=args.router if args.router != "off" else "auto",
+        route_threshold=args.route_threshold,
+        examples_dir=args.examples_dir,
+        few_shot=args.few_shot,
+        coalesce_seconds=args.coalesce_seconds,
+    )
+    mark("server")
+
+    server.connections.warm()
+    mark("connections")
+
+    server.templates.mine(cached_pairs(args.cache))
+    mark("templates")
+
+    if server.examples is not None:
+        # a new example index starts from the question cache; an existing one only loads its log
+        imported = bootstrap(server.examples, args.cache)
+        mark("examples")
+        if imported:
+            print(f"Imported {imported} cached question/SQL pairs as few-shot examples.")
+
+    daemon = AgentDaemon(server, spare_sessions=args.spare_sessions)
+    daemon._fill_spare()
+    mark("sessions")
+
+    if args.warm_queries:
+        replayed = await warm_queries(server, args.warm_queries)
+        mark("query_replay")
+        print(f"Replayed {replayed} logged queries.")
+
+    if args.warm_llm:
+        # one tiny call per model opens the client's connection before the first real question
+        await asyncio.gather(*(backend.generate_async(WARM_PROMPT)
+                               for tier in server.router.tiers for backend in (tier.retrieval, tier.explanation)))
+        mark("llm")
+
+    startup["total"] = round(time.perf_counter() - started, 4)
+    daemon.startup = startup
+    daemon.started_at = time.monotonic()
+    return daemon
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Warm-start daemon for the ERP agent, answers agent_client.py over a Unix socket")
+    parser.add_argument("--socket", default=DEFAULT_SOCKET_PATH, help="Unix socket path (default: $AGENT_SOCKET or /tmp/erp_agent.sock)")
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--cache", default=CACHE_DB_PATH, help="question cache whose pairs are mined into templates at start")
+    parser.add_argument("--backend", choices=["gemini", "fake"], default="gemini")
+    parser.add_argument("--fake-responses", help="JSON file mapping questions to SQL for the fake backend")
+    parser.add_argument("--fake-latency", type=float, default=0.0, help="simulated seconds per fake LLM call")
+    parser.add_argument("--db-workers", type=int, default=4, help="pre-opened read-only connections")
+    parser.add_argument("--spare-sessions", type=int, default=4, help="sessions opened ahead of time for new clients")
+    parser.add_argument("--max-inflight", type=int, default=32)
+    parser.add_argument("--max-queued", type=int, default=128)
+    parser.add_argument("--time-budget", type=float, default=5.0, help="seconds a query may run before it is cancelled")
+    parser.add_argument("--row-budget", type=int, default=100000, help="rows a query may return before it is cancelled")
+    parser.add_argument("--query-log", default="query_log.db", help="SQLite file executed queries are logged to, '' to disable")
+    parser.add_argument("--warm-queries", type=int, default=0, help="replay this many of the heaviest logged queries at start")
+    parser.add_argument("--warm-llm", action="store_true", help="send one tiny prompt per model at start to open the API connection")
+    parser.add_argument("--explain", choices=("auto", "llm", "local"), default="auto", help="when to call the explanation model")
+    parser.add_argument("--result-cache-mb", type=float, default=64.0, help="memory for cached query results, 0 disables")
+    parser.add_argument("--history-tokens", type=int, default=1200, help="token budget for each session's chat history")
+    parser.add_argument("--trace-dir", help="write JSONL traces and Prometheus metrics here")
+    parser.add_argument("--export-dir", default="exports", help="where --export answers write their files")
+    parser.add_argument("--shards", help="query the per-site shards in this directory (see sharding.py build) instead of --db")
+    parser.add_argument("--examples-dir", default="examples", help="verified question/SQL pairs for few-shot prompts, '' to disable")
+    parser.add_argument("--few-shot", type=int, default=3, help="similar verified examples added to each SQL request, 0 disables")
+    parser.add_argument("--coalesce-seconds", type=float, default=120.0,
+                        help="identical concurrent questions share one generation/execution/explanation, waiting at most this long; 0 disables")
+    add_router_arguments(parser)
+    args = parser.parse_args()
+
+    async def run():
+        daemon = await start(args)
+        print("Startup: " + ", ".join(f"{name} {seconds:.3f}s" for name, seconds in daemon.startup.items()))
+        await daemon.serve(args.socket)
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+import sqlite3
+
+from result_summary import ResultSummary
+from streaming import iter_row_batches, FETCH_BATCH_SIZE
+
+
+# SYSTEM INSTRUCTIONS SHARED BY THE REPL, THE SERVER AND THE OTHER ENTRY POINTS
+RETRIEVAL_INSTRUCTION = """
+        You are a helpful AI assistant specialized in databases and backend engineering.
+        Always provide clear, structured explanations. Convert user questions into valid SQLite SQL queries.
+        Return ONLY the SQL query. Generate valid sqlite3 query. Do not alter the tables or columns, do not drop any too.
+        Do not explain anything. Return ONLY raw SQL. Do NOT use markdown. Do NOT wrap the query in backticks. When returning the result rows,
+        only return the related columns to the request.
+        Each message starts with the relevant part of the schema as Table(columns) lines, PK marks the primary key
+        and the Joins line lists the foreign keys. Use only those tables and columns.
+        """
+
+EXPLANATION_INSTRUCTION = """
+        You are a helpful AI assistant specialized in databases and backend engineering, and you're also very good at explaining things.
+        You receive sql results and explain them in human readable friendly format.
+        """
+
+NO_RESULTS_TEXT = "No records were found matching your request."
+
+
+def retrieval_message(schema_digest: str, question: str, examples=()) -> str:
+    # examples are (question, sql, similarity) of verified past answers; the question stays last
+    shots = "".join(f"Q: {q}\nSQL: {sql_query}\n\n" for q, sql_query, _ in examples)
+    if shots:
+        shots = f"Examples of verified questions and their SQL:\n\n{shots}"
+    return f"Schema:\n{schema_digest}\n\n{shots}Question: {question}"
+
+
+def explanation_prompt(question: str, sql_query: str, summary_text: str) -> str:
+    return f"""
+                User question: {question}
+                SQL query executed: {sql_query}
+                SQL result summary:
+                {summary_text}
+                Explain these results clearly in a friendly human-readable way.
+                """
+
+
+def clean_sql(text: str) -> str:
+    # models sometimes wrap the query in a markdown fence despite the instructions
+    sql_query = text.strip()
+    if sql_query.startswith("```"):
+        sql_query = sql_query.strip("`")
+        if sql_query.lower().startswith("sql"):
+            sql_query = sql_query[3:]
+    return sql_query.strip()
+
+
+class QueryResult:
+    def __init__(self, sql_query: str, columns: list, row_count: int, preview: list, summary: ResultSummary):
+        self.sql_query = sql_query
+        self.columns = columns
+        self.row_count = row_count
+        self.preview = preview
+        self.summary = summary
+
+    def to_dict(self) -> dict:
+        return {
+            "sql": self.sql_query,
+            "columns": self.columns,
+            "row_count": self.row_count,
+            "rows": [list(row) for row in self.preview],
+        }
+
+
+def execute_query(conn: sqlite3.Connection, sql_query: str, preview_rows: int = 50, batch_size: int = FETCH_BATCH_SIZE) -> QueryResult:
+    """
+    Runs one query and consumes it in fetchmany batches, keeping only a
+    preview of the leading rows plus the single-pass ResultSummary.
+    `conn` may also be a db_pool.QueryGuard, which enforces the query budgets.
+    """
+    cursor = conn.execute(sql_query)
+    columns = [col[0] for col in cursor.description or []]
+    summary = ResultSummary(columns)
+    preview = []
+    for batch in iter_row_batches(cursor, batch_size):
+        summary.add_rows(batch)
+        if len(preview) < preview_rows:
+            preview.extend(batch[: preview_rows - len(preview)])
+    return QueryResult(sql_query, columns, summary.row_count, preview, summary)
@@ -0,0 +1,665 @@
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import signal
+import sqlite3
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+
+from agent_pipeline import (
+    RETRIEVAL_INSTRUCTION,
+    EXPLANATION_INSTRUCTION,
+    NO_RESULTS_TEXT,
+    retrieval_message,
+    explanation_prompt,
+    clean_sql,
+    execute_query,
+)
+from conversation_memory import ConversationMemory
+from local_render import ExplanationPolicy, render_result, result_shape
+from query_cache import normalize_question
+from result_cache import CachingGuard, ResultCache, cache_key
+from result_export import EXPORT_DIR, ExportError, export_path, export_query, export_summary, resolve_format
+from sql_templates import EntityDictionary, TemplateIndex
+from cost_gate import CostGate, unique_indexes
+from example_index import DEFAULT_FEW_SHOT, EXAMPLES_DIR, ExampleIndex
+from db_pool import ReadOnlyPool
+from index_advisor import QueryLog
+from result_summary import estimate_tokens
+from tracing import NullTracer, Tracer
+from llm_backends import GeminiBackend, FakeBackend
+from model_router import DEFAULT_THRESHOLD, ModelRouter, Tier, add_router_arguments
+from schema_index import SchemaIndex
+from sharding import ShardedDatabase
+from single_flight import FlightTimeout, SingleFlight
+from sqlite_seed import DB_PATH
+
+
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+
+class Overloaded(Exception):
+    pass
+
+
+class Session:
+    def __init__(self, session_id: str, memory: ConversationMemory, max_concurrent: int):
+        self.session_id = session_id
+        self.memory = memory
+        self.limit = asyncio.Semaphore(max_concurrent)
+        self.last_used = time.monotonic()
+        self.turns = 0
+
+
+class AgentServer:
+    """
+    Multi-session agent over asyncio. Each session owns its conversation memory;
+    LLM calls are awaited, SQLite work runs on a bounded thread pool over a
+    ReadOnlyPool of the same size. `max_inflight` turns run at once,
+    up to `max_queued` more wait, anything beyond gets an Overloaded error.
+    With `shards` (a directory written by sharding.py build) queries run on the
+    per-site shard files instead of `db_path`, and the result cache is off.
+    With `strong_backends` (a retrieval, explanation pair) the given backends
+    become the fast tier and a ModelRouter picks a tier per question.
+    SQL the model wrote and that ran is kept in an ExampleIndex under
+    `examples_dir` ('' disables it), and the `few_shot` most similar examples
+    go into each retrieval request.
+    Concurrent identical work is coalesced per stage (generate, execute,
+    explain): later turns wait for the one in flight and share its result,
+    for at most `coalesce_seconds` (0 turns coalescing off).
+    """
+
+    def __init__(self, retrieval_backend, explanation_backend, db_path: str = DB_PATH, db_workers: int = 4,
+                 max_inflight: int = 32, max_queued: int = 128, per_session: int = 1, session_idle_seconds: float = 1800,
+                 time_budget: float = 5.0, row_budget: int = 100000, cost_budget: float = 20_000_000, max_sql_retries: int = 2,
+                 query_log_path: str = None, tracer=None, history_tokens: int = 1200,
+                 explain_mode: str = "auto", result_cache_mb: float = 64.0, export_dir: str = EXPORT_DIR,
+                 export_seconds: float = 600.0, shards: str = None, strong_backends: tuple = None,
+                 route_mode: str = "auto", route_threshold: float = DEFAULT_THRESHOLD,
+                 examples_dir: str = EXAMPLES_DIR, few_shot: int = DEFAULT_FEW_SHOT, coalesce_seconds: float = 120.0):
+        self.retrieval_backend = retrieval_backend
+        self.explanation_backend = explanation_backend
+        self.db_path = db_path
+        self.db_pool = ThreadPoolExecutor(max_workers=db_workers, thread_name_prefix="sqlite")
+        if shards:
+            self.connections = ShardedDatabase(shards, size=db_workers, time_budget=time_budget, row_budget=row_budget)
+        else:
+            self.connections = ReadOnlyPool(db_path, size=db_workers, time_budget=time_budget, row_budget=row_budget)
+        self.inflight = asyncio.Semaphore(max_inflight)
+        self.max_queued = max_queued
+        self.waiting = 0
+        self.per_session = per_session
+        self.session_idle_seconds = session_idle_seconds
+        self.sessions = {}
+        self.stats = {"turns": 0, "errors": 0, "rejected": 0}
+        self.max_sql_retries = max_sql_retries
+        self.query_log = QueryLog(query_log_path) if query_log_path else None
+        self.tracer = tracer or NullTracer()
+        self.history_tokens = history_tokens
+        self.explanation_policy = ExplanationPolicy(explain_mode)
+        # cached results are invalidated through the single file's data_version, which shards don't share
+        self.result_cache = ResultCache(db_path, max_bytes=int(result_cache_mb * 1_048_576)) if result_cache_mb and not shards else None
+        self.export_dir = export_dir
+        self.export_seconds = export_seconds
+        self.examples = ExampleIndex(examples_dir) if examples_dir and few_shot else None
+        self.few_shot = few_shot
+        self.flights = {stage: SingleFlight(stage, timeout=coalesce_seconds) for stage in ("generate", "execute", "explain")} if coalesce_seconds else None
+        if shards:
+            # shared.db has every base table; entity values are fanned out over the shards
+            with self.connections.query(time_budget=0, row_budget=0) as conn:
+                self.schema_index = SchemaIndex(conn)
+                counts = self.connections.cardinalities()
+                self.cost_gate = CostGate(counts, cost_budget=cost_budget, unique_indexes=unique_indexes(conn, counts))
+                self.templates = TemplateIndex(EntityDictionary(conn))
+        else:
+            with closing(sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)) as conn:
+                self.schema_index = SchemaIndex(conn)
+                self.cost_gate = CostGate.from_connection(conn, cost_budget=cost_budget)
+                self.templates = TemplateIndex(EntityDictionary(conn))
+        self.router = ModelRouter(
+            Tier("fast" if strong_backends else "default", retrieval_backend, explanation_backend),
+            Tier("strong", *strong_backends) if strong_backends else None,
+            schema_index=self.schema_index,
+            entities=self.templates.entities,
+            threshold=route_threshold,
+            mode=route_mode,
+        )
+
+    # DATABASE WORK, RUNS ON THE THREAD POOL
+    def _execute(self, sql_query: str):
+        started = time.perf_counter()
+        with self.connections.query() as guard:
+            cursor = CachingGuard(self.result_cache, guard) if self.result_cache is not None else guard
+            result = execute_query(cursor, sql_query)
+        # replayed results did no database work, keep them out of the advisor's timings
+        if self.query_log is not None and not getattr(cursor, "cache_hit", False):
+            self.query_log.record(sql_query, time.perf_counter() - started, result.row_count)
+        return result
+
+    def _export(self, sql_query: str, fmt: str, path: str) -> dict:
+        # full dumps get their own time budget and no row budget, and bypass the result cache
+        with self.connections.query(time_budget=self.export_seconds, row_budget=0) as guard:
+            report = export_query(guard, sql_query, path, fmt)
+        if self.query_log is not None:
+            self.query_log.record(sql_query, report["seconds"], report["rows"])
+        return report
+
+    def _check_plan(self, sql_query: str):
+        with self.connections.query() as guard:
+            return self.cost_gate.check(guard, sql_query)
+
+    # SESSIONS
+    def open_session(self) -> Session:
+        self._expire_sessions()
+        session_id = uuid.uuid4().hex
+        session = Session(session_id, ConversationMemory(self.history_tokens), self.per_session)
+        self.sessions[session_id] = session
+        return session
+
+    def get_session(self, session_id: str) -> Session:
+        session = self.sessions.get(session_id) if session_id else None
+        return session or self.open_session()
+
+    def _expire_sessions(self):
+        cutoff = time.monotonic() - self.session_idle_seconds
+        for session_id in [s.session_id for s in self.sessions.values() if s.last_used < cutoff]:
+            del self.sessions[session_id]
+
+    # ONE TURN: GENERATE SQL -> EXECUTE -> EXPLAIN
+    async def ask(self, session: Session, question: str, on_event=None, export: str = None) -> dict:
+        """
+        Answers one question. With `export` (a result_export format) the rows
+        are streamed to a file under export_dir and the reply carries the
+        export report instead of rows and an explanation.
+        """
+        if export is not None:
+            export = resolve_format(export)
+        if self.waiting >= self.max_queued:
+            self.stats["rejected"] += 1
+            raise Overloaded("server is at capacity, retry later")
+        self.waiting += 1
+        try:
+            await session.limit.acquire()
+            try:
+                await self.inflight.acquire()
+            except BaseException:
+                session.limit.release()
+                raise
+        finally:
+            self.waiting -= 1
+        try:
+            session.last_used = time.monotonic()
+            session.turns += 1
+            turn = self.tracer.start_turn(session_id=session.session_id, question=question)
+            try:
+                reply = await self._turn(session, question, on_event, turn, export)
+            except BaseException as e:
+                turn.finish(e)
+                raise
+            if "error" in reply:
+                turn.set(error=reply["error"].split(":", 1)[0])
+            turn.finish()
+            return reply
+        finally:
+            self.inflight.release()
+            session.limit.release()
+
+    async def _match_template(self, question: str, turn):
+        # a mined template answers without the model; its plan still goes through the cost gate
+        with turn.span("template_match") as span:
+            sql_query = self.templates.match(question)
+            span.set(hit=sql_query is not None)
+        if sql_query is None:
+            return None
+        loop = asyncio.get_running_loop()
+        with turn.span("cost_gate") as span:
+            verdict = await loop.run_in_executor(self.db_pool, self._check_plan, sql_query)
+            span.set(status=verdict.status, cost=round(verdict.cost))
+        return verdict if verdict.accepted else None
+
+    async def _generate(self, session: Session, question: str, turn, route):
+        loop = asyncio.get_running_loop()
+        # a fresh chat per turn from the bounded memory keeps turn 200 as cheap as turn 2
+        chat = route.tier.retrieval.start_chat(history=session.memory.history())
+        with turn.span("prompt_build") as span:
+            digest = self.schema_index.digest_for(question)
+            examples = self.examples.search(question, self.few_shot) if self.examples is not None else []
+            request = retrieval_message(digest, question, examples)
+            span.set(bytes=len(request), prompt_tokens=estimate_tokens(request), examples=len(examples))
+        message = request
+        attempt = 0
+        while True:
+            with turn.span("send_message", attempt=attempt, tier=route.tier.name, prompt_tokens=estimate_tokens(message)) as span:
+                sql_query = clean_sql(await chat.send_message_async(message))
+                span.set(response_tokens=estimate_tokens(sql_query))
+            with turn.span("cost_gate") as span:
+                verdict = await loop.run_in_executor(self.db_pool, self._check_plan, sql_query)
+                span.set(status=verdict.status, cost=round(verdict.cost))
+            if verdict.accepted:
+                return verdict
+            if verdict.status == "error" and self.router.escalate(route):
+                # SQL that doesn't compile goes to the strong tier, which starts over from the request
+                turn.set(escalated=True)
+                chat = route.tier.retrieval.start_chat(history=session.memory.history())
+                message = request
+                continue
+            if attempt >= self.max_sql_retries:
+                return verdict
+            attempt += 1
+            message = verdict.feedback()
+
+    async def _shared(self, stage: str, key, factory, turn) -> tuple:
+        # (result, shared): identical work already in flight for this stage is awaited instead of repeated
+        if self.flights is None:
+            return await factory(), False
+        result, shared = await self.flights[stage].run(key, factory)
+        if shared:
+            turn.set(**{f"{stage}_shared": True})
+        return result, shared
+
+    async def _generate_shared(self, session: Session, question: str, turn, route) -> tuple:
+        # the chat history is part of the prompt, so only turns over the same history share a generation
+        async def generate():
+            verdict = await self._generate(session, question, turn, route)
+            return verdict, route.tier, route.escalated
+
+        history = hashlib.sha1(json.dumps(session.memory.history(), sort_keys=True, default=str).encode("utf-8")).hexdigest()
+        key = (route.tier.name, normalize_question(question), history)
+        (verdict, tier, escalated), shared = await self._shared("generate", key, generate, turn)
+        # an escalation in the turn that did the work applies to every turn that shared it
+        route.tier, route.escalated = tier, escalated
+        return verdict, shared
+
+    async def _turn(self, session: Session, question: str, on_event, turn, export: str = None) -> dict:
+        loop = asyncio.get_running_loop()
+        reply = {"session_id": session.session_id, "question": question}
+        timings = {}
+        reply["timings"] = timings
+        started = time.perf_counter()
+        reply["history"] = session.memory.stats()
+        turn.set(**reply["history"])
+        route = self.router.route(question)
+        verdict = await self._match_template(question, turn)
+        reply["source"] = "model" if verdict is None else "template"
+        turn.set(source=reply["source"], tier=route.tier.name, route_score=round(route.score, 2))
+        # the turn that did the generation reports its outcome and learns from it, turns that shared it don't
+        owner = reply["source"] == "model"
+        if verdict is None:
+            try:
+                verdict, shared = await self._generate_shared(session, question, turn, route)
+            except FlightTimeout as e:
+                self.stats["errors"] += 1
+                reply["error"] = f"Timed out: {e}"
+                return reply
+            owner = not shared
+        reply["route"] = route.to_dict()
+        sql_query = verdict.sql_query
+        if export is not None:
+            # the gate's LIMIT protects the terminal, an export wants every row
+            sql_query = self.cost_gate.without_row_limit(sql_query)
+        reply["sql"] = sql_query
+        timings["generate"] = time.perf_counter() - started
+        if not verdict.accepted:
+            self.stats["errors"] += 1
+            if owner:
+                self.router.record(route, failed=True)
+            reply["error"] = f"Query rejected: {'; '.join(verdict.reasons)}"
+            return reply
+        session.memory.add_turn(question, sql_query)
+        if on_event is not None:
+            await on_event({"type": "sql", "sql": sql_query})
+        if export is not None:
+            if owner:
+                self.router.record(route, failed=False)
+            return await self._export_turn(question, sql_query, export, reply, turn, owner)
+        started = time.perf_counter()
+        try:
+            # execute_query fetches as it goes, so this span covers execution and fetch
+            with turn.span("sql_execute") as span:
+                result, shared = await self._shared(
+                    "execute", cache_key(sql_query), lambda: loop.run_in_executor(self.db_pool, self._execute, sql_query), turn
+                )
+                span.set(rows=result.row_count, shared=shared)
+        except sqlite3.Error as e:
+            self.stats["errors"] += 1
+            if owner:
+                self.router.record(route, failed=True)
+            reply["error"] = f"SQL Error: {e}"
+            return reply
+        except FlightTimeout as e:
+            self.stats["errors"] += 1
+            reply["error"] = f"Timed out: {e}"
+            return reply
+        timings["execute"] = time.perf_counter() - started
+        if owner:
+            self.router.record(route, failed=False)
+            self.templates.learn(question, sql_query)
+            await self._remember(question, sql_query)
+        with turn.span("render") as span:
+            rendered = result.to_dict()
+            span.set(rows=len(rendered["rows"]))
+        reply.update(rendered)
+        if on_event is not None:
+            await on_event({"type": "rows", **rendered})
+        started = time.perf_counter()
+        shape = result_shape(sql_query, result.columns, result.row_count)
+        if result.row_count and self.explanation_policy.explain_locally(question, shape):
+            with turn.span("explanation", local=True, shape=shape):
+                reply["explanation"] = render_result(shape, result.columns, result.preview, result.row_count)
+        elif result.row_count:
+            summary_text = result.summary.render()
+            prompt = explanation_prompt(question, sql_query, summary_text)
+            key = (route.tier.name, normalize_question(question), cache_key(sql_query), summary_text)
+            with turn.span("explanation", prompt_tokens=estimate_tokens(prompt), bytes=len(prompt)) as span:
+                try:
+                    text, shared = await self._shared("explain", key, lambda: route.tier.explanation.generate_async(prompt), turn)
+                    reply["explanation"] = text.strip()
+                    span.set(response_tokens=estimate_tokens(reply["explanation"]), shared=shared)
+                except FlightTimeout as e:
+                    # the rows already went out, only the prose is missing
+                    reply["explanation"] = f"No explanation: {e}."
+        else:
+            reply["explanation"] = NO_RESULTS_TEXT
+        timings["explain"] = time.perf_counter() - started
+        self.stats["turns"] += 1
+        return reply
+
+    async def _export_turn(self, question: str, sql_query: str, fmt: str, reply: dict, turn, owner: bool) -> dict:
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        try:
+            with turn.span("export", format=fmt) as span:
+                report = await loop.run_in_executor(self.db_pool, self._export, sql_query, fmt, export_path(question, fmt, self.export_dir))
+                span.set(rows=report["rows"], bytes=report["bytes"])
+        except (sqlite3.Error, ExportError, OSError) as e:
+            self.stats["errors"] += 1
+            reply["error"] = f"Export Error: {e}"
+            return reply
+        reply["timings"]["execute"] = time.perf_counter() - started
+        if owner:
+            self.templates.learn(question, sql_query)
+            await self._remember(question, sql_query)
+        reply["export"] = report
+        reply["explanation"] = export_summary(report)
+        self.stats["turns"] += 1
+        return reply
+
+    async def _remember(self, question: str, sql_query: str):
+        # an add can trigger a compaction, which rewrites the index files, so it runs off the event loop
+        if self.examples is not None:
+            await asyncio.get_running_loop().run_in_executor(self.db_pool, self.examples.add, question, sql_query)
+
+    def metrics(self) -> dict:
+        return {
+            **self.stats,
+            "sessions": len(self.sessions),
+            "waiting": self.waiting,
+            "explanations": self.explanation_policy.stats,
+            "templates": self.templates.stats(),
+            "result_cache": self.result_cache.stats() if self.result_cache is not None else None,
+            "models": self.router.stats(),
+            "examples": self.examples.stats() if self.examples is not None else None,
+            "coalescing": {stage: flight.metrics() for stage, flight in self.flights.items()} if self.flights is not None else None,
+            "db": self.connections.stats(),
+        }
+
+    # HTTP
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request_line = await reader.readline()
+            if not request_line:
+                return
+            try:
+                method, target, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                path, _, query = target.partition("?")
+                params = dict(p.split("=", 1) for p in query.split("&") if "=" in p)
+                length = int(headers.get("content-length", 0))
+            except ValueError:
+                await self.send_json(writer, 400, {"error": "malformed request"})
+                return
+            if path == "/ws" and headers.get("upgrade", "").lower() == "websocket":
+                await self.handle_websocket(reader, writer, headers, params.get("session"))
+                return
+            body = await reader.readexactly(length) if length > 0 else b""
+            try:
+                status, payload = await self.route(method, path, body)
+            except Exception as e:
+                # the LLM backend failing (or a bug) still gets the client an answer, as in agent_daemon
+                self.stats["errors"] += 1
+                status, payload = 500, {"error": f"{type(e).__name__}: {e}"}
+            await self.send_json(writer, status, payload)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def route(self, method: str, path: str, body: bytes):
+        if method == "GET" and path == "/health":
+            return 200, {"status": "ok"}
+        if method == "GET" and path == "/metrics":
+            return 200, self.metrics()
+        if method == "GET" and path == "/metrics.prom" and self.tracer.enabled:
+            return 200, self.tracer.render_metrics()
+        if method == "POST" and path == "/sessions":
+            return 201, {"session_id": self.open_session().session_id}
+        if method == "POST" and path == "/ask":
+            try:
+                data = json.loads(body or b"{}")
+            except ValueError:
+                return 400, {"error": "body must be JSON"}
+            question = str(data.get("question", "")).strip()
+            if not question:
+                return 400, {"error": "Please enter a valid question."}
+            try:
+                return 200, await self.ask(self.get_session(data.get("session_id")), question, export=data.get("export"))
+            except Overloaded as e:
+                return 503, {"error": str(e)}
+            except ExportError as e:
+                return 400, {"error": str(e)}
+        return 404, {"error": f"no route for {method} {path}"}
+
+    async def send_json(self, writer: asyncio.StreamWriter, status: int, payload):
+        if isinstance(payload, str):
+            body = payload.encode("utf-8")
+            content_type = "text/plain; version=0.0.4"
+        else:
+            body = json.dumps(payload, default=str).encode("utf-8")
+            content_type = "application/json"
+        reason = {200: "OK", 201: "Created", 400: "Bad Request", 404: "Not Found", 500: "Internal Server Error",
+                  503: "Service Unavailable"}.get(status, "OK")
+        writer.write(
+            f"HTTP/1.1 {status} {reason}\r\nContent-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("latin-1") + body
+        )
+        await writer.drain()
+
+    # WEBSOCKET: ONE TEXT FRAME PER QUESTION, JSON EVENTS BACK (sql, rows, answer)
+    async def handle_websocket(self, reader, writer, headers: dict, session_id: str):
+        accept = base64.b64encode(hashlib.sha1((headers.get("sec-websocket-key", "") + WS_GUID).encode()).digest()).decode()
+        writer.write(
+            "HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+            f"Sec-WebSocket-Accept: {accept}\r\n\r\n".encode("latin-1")
+        )
+        await writer.drain()
+        session = self.get_session(session_id)
+
+        async def send(event: dict):
+            await ws_send(writer, json.dumps(event, default=str))
+
+        await send({"type": "session", "session_id": session.session_id})
+        while True:
+            opcode, payload = await ws_read(reader)
+            if opcode == 0x8:
+                writer.write(bytes([0x88, 0]))
+                await writer.drain()
+                return
+            if opcode == 0x9:
+                writer.write(bytes([0x8A, len(payload)]) + payload)
+                await writer.drain()
+                continue
+            if opcode != 0x1:
+                continue
+            question = payload.decode("utf-8").strip()
+            if not question:
+                await send({"type": "error", "error": "Please enter a valid question."})
+                continue
+            try:
+                await send({"type": "answer", **await self.ask(session, question, on_event=send)})
+            except Overloaded as e:
+                await send({"type": "error", "error": str(e)})
+            except ConnectionError:
+                raise
+            except Exception as e:
+                # one failed question doesn't end the session
+                self.stats["errors"] += 1
+                await send({"type": "error", "error": f"{type(e).__name__}: {e}"})
+
+    async def serve(self, host: str, port: int):
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+        print(f"Agent server listening on http://{host}:{port}")
+        try:
+            async with server:
+                await stop.wait()
+        finally:
+            # metrics are only rewritten every few turns, write the last ones out
+            self.tracer.flush()
+
+
+async def ws_read(reader: asyncio.StreamReader):
+    # client frames are always masked; fragmented messages are not supported
+    head = await reader.readexactly(2)
+    opcode = head[0] & 0x0F
+    length = head[1] & 0x7F
+    if length == 126:
+        length = int.from_bytes(await reader.readexactly(2), "big")
+    elif length == 127:
+        length = int.from_bytes(await reader.readexactly(8), "big")
+    mask = await reader.readexactly(4) if head[1] & 0x80 else b"\x00\x00\x00\x00"
+    data = await reader.readexactly(length)
+    return opcode, bytes(b ^ mask[i % 4] for i, b in enumerate(data))
+
+
+async def ws_send(writer: asyncio.StreamWriter, text: str):
+    data = text.encode("utf-8")
+    if len(data) < 126:
+        header = bytes([0x81, len(data)])
+    elif len(data) < 65536:
+        header = bytes([0x81, 126]) + len(data).to_bytes(2, "big")
+    else:
+        header = bytes([0x81, 127]) + len(data).to_bytes(8, "big")
+    writer.write(header + data)
+    await writer.drain()
+
+
+def build_backends(name: str, fake_responses: str = None, fake_latency: float = 0.0, model_name: str = None):
+    # a fake given a model name stands in for that model, so its calls are priced like it
+    if name == "fake":
+        responses = {}
+        if fake_responses:
+            with open(fake_responses, "r", encoding="utf-8") as f:
+                responses = json.load(f)
+        return (
+            FakeBackend(responses, latency=fake_latency, model_name=model_name or "fake"),
+            FakeBackend(default="Here is a summary of the results.", latency=fake_latency, model_name=model_name or "fake"),
+        )
+    if model_name:
+        return GeminiBackend(RETRIEVAL_INSTRUCTION, model_name), GeminiBackend(EXPLANATION_INSTRUCTION, model_name)
+    return GeminiBackend(RETRIEVAL_INSTRUCTION), GeminiBackend(EXPLANATION_INSTRUCTION)
+
+
+def build_tiers(args):
+    """
+    (fast, strong) backend pairs from the --router/--fast-model/--strong-model
+    flags shared by the server and the daemon. strong is None with --router off,
+    which keeps the single default model.
+    """
+    if args.router == "off":
+        return build_backends(args.backend, args.fake_responses, args.fake_latency), None
+    fast = build_backends(args.backend, args.fake_fast_responses or args.fake_responses, args.fake_latency, args.fast_model)
+    strong = build_backends(args.backend, args.fake_responses, args.fake_latency, args.strong_model)
+    return fast, strong
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Async multi-session HTTP/WebSocket server for the ERP agent")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--backend", choices=["gemini", "fake"], default="gemini")
+    parser.add_argument("--fake-responses", help="JSON file mapping questions to SQL for the fake backend")
+    parser.add_argument("--fake-latency", type=float, default=0.0, help="simulated seconds per fake LLM call")
+    parser.add_argument("--db-workers", type=int, default=4)
+    parser.add_argument("--max-inflight", type=int, default=32)
+    parser.add_argument("--max-queued", type=int, default=128)
+    parser.add_argument("--per-session", type=int, default=1, help="concurrent turns allowed per session")
+    parser.add_argument("--time-budget", type=float, default=5.0, help="seconds a query may run before it is cancelled")
+    parser.add_argument("--row-budget", type=int, default=100000, help="rows a query may return before it is cancelled")
+    parser.add_argument("--cost-budget", type=float, default=20_000_000, help="estimated plan cost above which SQL is rejected")
+    parser.add_argument("--query-log", default="query_log.db", help="SQLite file executed queries are logged to, '' to disable")
+    parser.add_argument("--explain", choices=("auto", "llm", "local"), default="auto", help="when to call the explanation model")
+    parser.add_argument("--result-cache-mb", type=float, default=64.0, help="memory for cached query results, 0 disables")
+    parser.add_argument("--history-tokens", type=int, default=1200, help="token budget for each session's chat history")
+    parser.add_argument("--trace-dir", help="write JSONL traces and Prometheus metrics here")
+    parser.add_argument("--sql-retries", type=int, default=2, help="re-prompts with plan feedback after a rejected query")
+    parser.add_argument("--export-dir", default=EXPORT_DIR, help="where /ask requests with \"export\" write their files")
+    parser.add_argument("--export-seconds", type=float, default=600.0, help="time budget for one export query")
+    parser.add_argument("--shards", help="query the per-site shards in this directory (see sharding.py build) instead of --db")
+    parser.add_argument("--examples-dir", default=EXAMPLES_DIR, help="verified question/SQL pairs for few-shot prompts, '' to disable")
+    parser.add_argument("--few-shot", type=int, default=DEFAULT_FEW_SHOT, help="similar verified examples added to each SQL request, 0 disables")
+    parser.add_argument("--coalesce-seconds", type=float, default=120.0,
+                        help="identical concurrent questions share one generation/execution/explanation, waiting at most this long; 0 disables")
+    add_router_arguments(parser)
+    args = parser.parse_args()
+
+    (retrieval_backend, explanation_backend), strong_backends = build_tiers(args)
+
+    async def run():
+        server = AgentServer(
+            retrieval_backend,
+            explanation_backend,
+            db_path=args.db,
+            db_workers=args.db_workers,
+            max_inflight=args.max_inflight,
+            max_queued=args.max_queued,
+            per_session=args.per_session,
+            time_budget=args.time_budget,
+            row_budget=args.row_budget,
+            cost_budget=args.cost_budget,
+            max_sql_retries=args.sql_retries,
+            query_log_path=args.query_log,
+            tracer=Tracer(args.trace_dir) if args.trace_dir else None,
+            history_tokens=args.history_tokens,
+            explain_mode=args.explain,
+            result_cache_mb=args.result_cache_mb,
+            export_dir=args.export_dir,
+            export_seconds=args.export_seconds,
+            shards=args.shards,
+            strong_backends=strong_backends,
+            route_mode=args.router if args.router != "off" else "auto",
+            route_threshold=args.route_threshold,
+            examples_dir=args.examples_dir,
+            few_shot=args.few_shot,
+            coalesce_seconds=args.coalesce_seconds,
+        )
+        await server.serve(args.host, args.port)
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+import argparse
+import asyncio
+import csv
+import json
+import os
+import time
+
+from agent_server import AgentServer, build_backends
+from llm_backends import LimitedBackend, RetryPolicy, TokenBucket
+from sqlite_seed import DB_PATH
+
+
+# reply errors worth another try on resume; SQL errors and rejections would just repeat
+TRANSIENT_ERRORS = ("Timed out",)
+
+
+def load_questions(path: str) -> list:
+    """
+    Reads (id, question) pairs from a .jsonl file ({"id": ..., "question": ...}
+    per line) or a .csv file with a question column. Rows without an id get
+    their 1-based line number, so a re-run over the same file lines up.
+    """
+    questions = []
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        if path.lower().endswith(".csv"):
+            rows = csv.DictReader(f)
+        else:
+            rows = (json.loads(line) for line in f if line.strip())
+        for number, row in enumerate(rows, start=1):
+            question = str(row.get("question", "")).strip()
+            if question:
+                questions.append((str(row.get("id") or number), question))
+    return questions
+
+
+def failed_path(output_path: str) -> str:
+    return os.path.splitext(output_path)[0] + ".failed.jsonl"
+
+
+def completed_ids(output_path: str) -> set:
+    # the output file is the checkpoint: every line written is a finished question,
+    # questions that failed on the backend went to the failed file and run again
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                done.add(json.loads(line)["id"])
+            except (ValueError, KeyError):
+                # a line cut short by a crash, that question runs again
+                continue
+    return done
+
+
+def trim_partial_line(output_path: str):
+    # a crash mid-write leaves half a line with no newline; cut it so appends start clean
+    if not os.path.exists(output_path):
+        return
+    with open(output_path, "rb+") as f:
+        data = f.read()
+        if data and not data.endswith(b"\n"):
+            f.truncate(data.rfind(b"\n") + 1)
+
+
+async def run_batch(server: AgentServer, questions: list, output_path: str, workers: int, progress_every: int = 25) -> dict:
+    """
+    Answers `questions` and appends one line per question to `output_path`.
+    Questions whose turn raised (the LLM backend still failing after its
+    retries) or timed out are written to failed_path(output_path) instead,
+    which is rewritten each run, so a resumed run tries them again.
+    """
+    queue = asyncio.Queue()
+    for item in questions:
+        queue.put_nowait(item)
+    counts = {"done": 0, "errors": 0, "failed": 0}
+    started = time.perf_counter()
+
+    with open(output_path, "a", encoding="utf-8") as out, open(failed_path(output_path), "w", encoding="utf-8") as failed:
+
+        async def worker():
+            while True:
+                try:
+                    question_id, question = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                # a fresh session per question, report questions don't follow on from each other
+                session = server.open_session()
+                transient = False
+                try:
+                    reply = await server.ask(session, question)
+                    transient = str(reply.get("error") or "").startswith(TRANSIENT_ERRORS)
+                except Exception as e:
+                    reply = {"question": question, "error": f"{type(e).__name__}: {e}"}
+                    transient = True
+                server.sessions.pop(session.session_id, None)
+                reply.pop("session_id", None)
+                target = failed if transient else out
+                target.write(json.dumps({"id": question_id, **reply}, default=str) + "\n")
+                target.flush()
+                counts["failed" if transient else "done"] += 1
+                counts["errors"] += "error" in reply and not transient
+                finished = counts["done"] + counts["failed"]
+                if progress_every and finished % progress_every == 0:
+                    print(f"{finished}/{len(questions)} done, {counts['errors']} errors, {counts['failed']} to retry, "
+                          f"{time.perf_counter() - started:.1f}s")
+
+        await asyncio.gather(*(worker() for _ in range(workers)))
+    counts["seconds"] = round(time.perf_counter() - started, 3)
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a file of questions through the agent pipeline")
+    parser.add_argument("input", help="questions as .jsonl or .csv")
+    parser.add_argument("--output", help="results JSONL, also the checkpoint (default: <input>.results.jsonl)")
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--backend", choices=["gemini", "fake"], default="gemini")
+    parser.add_argument("--fake-responses", help="JSON file mapping questions to SQL for the fake backend")
+    parser.add_argument("--workers", type=int, default=8, help="questions in flight at once")
+    parser.add_argument("--rpm", type=float, default=60.0, help="LLM calls per minute across all workers")
+    parser.add_argument("--burst", type=float, default=None, help="LLM calls allowed back to back (default: rpm / 60, at least 1)")
+    parser.add_argument("--retries", type=int, default=5, help="retries per LLM call on rate-limit and server errors")
+    parser.add_argument("--backoff", type=float, default=1.0, help="base seconds for exponential backoff")
+    parser.add_argument("--db-workers", type=int, default=4)
+    parser.add_argument("--restart", action="store_true", help="ignore the checkpoint and start over")
+    args = parser.parse_args()
+
+    output_path = args.output or os.path.splitext(args.input)[0] + ".results.jsonl"
+    if args.restart and os.path.exists(output_path):
+        os.remove(output_path)
+    trim_partial_line(output_path)
+    questions = load_questions(args.input)
+    done = completed_ids(output_path)
+    pending = [(qid, q) for qid, q in questions if qid not in done]
+    print(f"{len(questions)} questions, {len(done)} already done, {len(pending)} to run -> {output_path}")
+    if not pending:
+        return
+
+    async def run():
+        # one bucket shared by both models, the quota is per API key
+        bucket = TokenBucket(args.rpm / 60.0, args.burst)
+        retry = RetryPolicy(max_retries=args.retries, base_delay=args.backoff)
+        retrieval, explanation = build_backends(args.backend, args.fake_responses)
+        server = AgentServer(
+            LimitedBackend(retrieval, bucket, retry),
+            LimitedBackend(explanation, bucket, retry),
+            db_path=args.db,
+            db_workers=args.db_workers,
+            max_inflight=args.workers,
+            max_queued=args.workers,
+        )
+        counts = await run_batch(server, pending, output_path, args.workers)
+        counts["llm_retries"] = retry.retries
+        counts["rate_limited_seconds"] = round(bucket.waited, 3)
+        return counts
+
+    counts = asyncio.run(run())
+    print(f"Finished {counts['done']} questions in {counts['seconds']}s: {counts['errors']} errors, "
+          f"{counts['llm_retries']} LLM retries, {counts['rate_limited_seconds']}s waiting on the rate limit")
+    if counts["failed"]:
+        print(f"{counts['failed']} questions failed on the backend or timed out, see {failed_path(output_path)}; "
+              "run the same command again to retry them")
+
+
+if __name__ == "__main__":
+    main()
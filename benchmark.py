@@ -0,0 +1,235 @@
+import argparse
+import asyncio
+import json
+import os
+import resource
+import sys
+import time
+import tracemalloc
+
+from agent_server import AgentServer
+from llm_backends import FakeBackend
+from sqlite_seed import DB_PATH
+
+
+GOLDEN_PATH = os.path.join("benchmarks", "golden_questions.json")
+BASELINE_PATH = os.path.join("benchmarks", "baseline.json")
+STAGES = ("generate", "execute", "explain", "total")
+# what the fake model answers to a prompt without a golden question (a re-prompt after a rejection);
+# it doesn't compile, so the turn ends in an error instead of timing "SELECT 1"
+NO_GOLDEN_SQL = "NO GOLDEN SQL FOR THIS PROMPT"
+
+
+def load_golden(path: str = GOLDEN_PATH) -> list:
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def fake_backends(golden: list, latency: float):
+    """
+    Deterministic stand-ins that replay the recorded SQL and explanation for
+    each golden question, sleeping `latency` seconds per call like a network
+    round trip would.
+    """
+    retrieval = FakeBackend({g["question"]: g["sql"] for g in golden}, default=NO_GOLDEN_SQL, latency=latency)
+    explanation = FakeBackend({g["question"]: g.get("explanation", "") for g in golden}, default="", latency=latency)
+    return retrieval, explanation
+
+
+def same_sql(a: str, b: str) -> bool:
+    return " ".join(a.strip().rstrip(";").split()) == " ".join(b.strip().rstrip(";").split())
+
+
+def percentile(values: list, pct: float) -> float:
+    # nearest-rank percentile, good enough for a few hundred samples
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
+
+
+def summarize(samples: dict) -> dict:
+    return {
+        stage: {
+            "p50": round(percentile(values, 50), 6),
+            "p95": round(percentile(values, 95), 6),
+            "p99": round(percentile(values, 99), 6),
+            "count": len(values),
+        }
+        for stage, values in samples.items()
+    }
+
+
+async def run_level(server: AgentServer, golden: list, sessions: int, rounds: int) -> dict:
+    """
+    Every session asks the whole golden set `rounds` times, all sessions in
+    parallel. A model turn that ran anything but the golden SQL (ignoring the
+    LIMIT the cost gate appends) counts as a mismatch and an error.
+    """
+    samples = {stage: [] for stage in STAGES}
+    errors = 0
+    mismatches = 0
+
+    async def analyst(index: int):
+        nonlocal errors, mismatches
+        session = server.open_session()
+        for r in range(rounds):
+            for offset in range(len(golden)):
+                case = golden[(index + offset + r) % len(golden)]
+                started = time.perf_counter()
+                reply = await server.ask(session, case["question"])
+                samples["total"].append(time.perf_counter() - started)
+                if "error" in reply:
+                    errors += 1
+                elif reply.get("source") == "model" and not same_sql(server.cost_gate.without_row_limit(reply.get("sql", "")), case["sql"]):
+                    mismatches += 1
+                    errors += 1
+                for stage, seconds in reply.get("timings", {}).items():
+                    samples[stage].append(seconds)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(analyst(i) for i in range(sessions)))
+    elapsed = time.perf_counter() - started
+    turns = len(samples["total"])
+    return {
+        "sessions": sessions,
+        "turns": turns,
+        "errors": errors,
+        "mismatches": mismatches,
+        "seconds": round(elapsed, 4),
+        "throughput": round(turns / elapsed, 3) if elapsed else 0.0,
+        "latency": summarize(samples),
+    }
+
+
+async def run_benchmark(db_path: str, golden: list, levels: list, rounds: int, llm_latency: float, db_workers: int,
+                        explain_mode: str = "auto", result_cache_mb: float = 0.0, coalesce_seconds: float = 0.0) -> dict:
+    """
+    Runs every level against one in-process server. Nothing outlives the run:
+    the few-shot example index is off, and the result cache and coalescing
+    only run when given a size / timeout, so by default every turn executes
+    its SQL and repeated rounds measure the same work.
+    """
+    retrieval, explanation = fake_backends(golden, llm_latency)
+    server = AgentServer(
+        retrieval,
+        explanation,
+        db_path=db_path,
+        db_workers=db_workers,
+        max_inflight=max(levels),
+        max_queued=max(levels) * 2,
+        explain_mode=explain_mode,
+        result_cache_mb=result_cache_mb,
+        examples_dir="",
+        coalesce_seconds=coalesce_seconds,
+    )
+    results = []
+    for sessions in levels:
+        results.append(await run_level(server, golden, sessions, rounds))
+    return {
+        "db": db_path,
+        "llm_latency": llm_latency,
+        "explanations": server.explanation_policy.stats,
+        "templates": server.templates.stats(),
+        "result_cache": server.result_cache.stats() if server.result_cache is not None else None,
+        "coalescing": server.metrics()["coalescing"],
+        "levels": results,
+    }
+
+
+def compare(report: dict, baseline: dict, tolerance: float) -> list:
+    """
+    Returns a list of regressions: p95 per stage or throughput per level
+    worse than the baseline by more than `tolerance` (0.2 = 20%).
+    """
+    regressions = []
+    baseline_levels = {level["sessions"]: level for level in baseline.get("levels", [])}
+    for level in report["levels"]:
+        base = baseline_levels.get(level["sessions"])
+        if base is None:
+            continue
+        if level["throughput"] < base["throughput"] * (1 - tolerance):
+            regressions.append(f"{level['sessions']} sessions: throughput {level['throughput']} < baseline {base['throughput']}")
+        for stage in STAGES:
+            now = level["latency"][stage]["p95"]
+            before = base["latency"].get(stage, {}).get("p95")
+            # sub-millisecond stages are all noise
+            if before is not None and now > max(before * (1 + tolerance), before + 0.001):
+                regressions.append(f"{level['sessions']} sessions: {stage} p95 {now:.4f}s > baseline {before:.4f}s")
+    base_memory = baseline.get("memory", {}).get("python_peak_bytes")
+    if base_memory and report["memory"]["python_peak_bytes"] > base_memory * (1 + tolerance):
+        regressions.append(f"python peak memory {report['memory']['python_peak_bytes']} > baseline {base_memory}")
+    return regressions
+
+
+def print_report(report: dict):
+    print(f"db={report['db']} simulated llm latency={report['llm_latency']}s explanations={report['explanations']}")
+    print(f"templates={report['templates']}")
+    print(f"result cache={report['result_cache']}")
+    print(f"coalescing={report['coalescing']}")
+    for level in report["levels"]:
+        print(f"\n{level['sessions']} concurrent session(s): {level['turns']} turns in {level['seconds']}s, "
+              f"{level['throughput']} turns/s, {level['errors']} errors ({level['mismatches']} not the golden SQL)")
+        for stage in STAGES:
+            stats = level["latency"][stage]
+            print(f"  {stage:<9} p50 {stats['p50'] * 1000:9.2f} ms  p95 {stats['p95'] * 1000:9.2f} ms  p99 {stats['p99'] * 1000:9.2f} ms")
+    memory = report["memory"]
+    print(f"\npython peak {memory['python_peak_bytes'] / 1_048_576:.1f} MiB, process max RSS {memory['max_rss_bytes'] / 1_048_576:.1f} MiB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end agent benchmark with a deterministic fake LLM")
+    parser.add_argument("--db", default=DB_PATH, help="database to run against, e.g. one made by data_generator.py")
+    parser.add_argument("--golden", default=GOLDEN_PATH)
+    parser.add_argument("--concurrency", default="1,8,32", help="comma separated session counts")
+    parser.add_argument("--rounds", type=int, default=3, help="passes over the golden set per session")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="simulated seconds per LLM call")
+    parser.add_argument("--db-workers", type=int, default=4)
+    parser.add_argument("--explain", choices=("auto", "llm", "local"), default="auto", help="explanation policy under test")
+    parser.add_argument("--result-cache-mb", type=float, default=0.0, help="result cache size under test, 0 executes every turn's SQL")
+    parser.add_argument("--coalesce-seconds", type=float, default=0.0, help="coalescing of identical concurrent turns under test, 0 disables")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown before failing, 0.2 = 20%%")
+    parser.add_argument("--update-baseline", action="store_true", help="store this run as the new baseline")
+    parser.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args()
+
+    golden = load_golden(args.golden)
+    levels = [int(x) for x in args.concurrency.split(",") if x.strip()]
+    tracemalloc.start()
+    report = asyncio.run(run_benchmark(args.db, golden, levels, args.rounds, args.llm_latency, args.db_workers, args.explain,
+                                       args.result_cache_mb, args.coalesce_seconds))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+    report["memory"] = {"python_peak_bytes": peak, "max_rss_bytes": max_rss}
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    failed = sum(level["errors"] for level in report["levels"])
+    if failed:
+        # timings of turns that errored or ran other SQL aren't comparable to anything
+        print(f"\n{failed} turns failed, not comparing the run or storing it as the baseline")
+        sys.exit(1)
+
+    if args.update_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nBaseline written to {args.baseline}")
+        return
+    if os.path.exists(args.baseline):
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        if regressions:
+            print("\nREGRESSIONS:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print(f"\nNo regressions against {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,422 @@
+import argparse
+import csv
+import json
+import os
+import re
+import sqlite3
+import time
+from collections import Counter
+
+from data_generator import chunked
+from sqlite_seed import DB_PATH
+
+
+CHUNK_SIZE = 10_000
+MODES = ("upsert", "insert")
+# the database stays readable by the agent while a sync runs, so the journal is kept
+INGEST_PRAGMAS = [
+    # references are resolved in memory before the insert, a second check per row would only cost time
+    "PRAGMA foreign_keys = OFF",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -262144",
+    # rows removed by INSERT OR REPLACE only fire the DELETE triggers (rollups, location state) with this on
+    "PRAGMA recursive_triggers = ON",
+]
+# key columns compared against the key maps: a CSV "1" has to match the stored 1
+INTEGER_KEYS = {"LineNumber"}
+
+
+class Rejected(Exception):
+    pass
+
+
+class Reference:
+    # an input column holding another table's natural key, stored as that table's id
+    def __init__(self, source: str, target: str, table: str, required: bool = True, unknown_ok: bool = False):
+        self.source = source
+        self.target = target
+        self.table = table
+        self.required = required
+        self.unknown_ok = unknown_ok
+
+
+class Entity:
+    """
+    How one table is loaded: `key` is its natural key after references are
+    resolved (empty for append-only tables), `columns` what an input record
+    may set, `lines` the line entity nested under a "lines" list in JSONL.
+    """
+
+    def __init__(self, table: str, id_column: str, key: tuple, columns: tuple, references: tuple = (), lines: str = None):
+        self.table = table
+        self.id_column = id_column
+        self.key = key
+        self.columns = columns
+        self.references = references
+        self.lines = lines
+
+
+# in load order: a table's references come before it
+ENTITIES = {
+    entity.table: entity for entity in (
+        Entity("Customers", "CustomerId", ("CustomerCode",),
+               ("CustomerCode", "CustomerName", "Email", "Phone", "BillingAddress1", "BillingCity", "BillingCountry", "IsActive")),
+        Entity("Vendors", "VendorId", ("VendorCode",),
+               ("VendorCode", "VendorName", "Email", "Phone", "AddressLine1", "City", "Country", "IsActive")),
+        Entity("Items", "ItemId", ("ItemCode",), ("ItemCode", "ItemName", "Category", "UnitOfMeasure", "IsActive")),
+        Entity("PurchaseOrders", "POId", ("PONumber",), ("PONumber", "VendorId", "PODate", "Status", "SiteId"),
+               (Reference("VendorCode", "VendorId", "Vendors"), Reference("SiteCode", "SiteId", "Sites", required=False)),
+               lines="PurchaseOrderLines"),
+        Entity("PurchaseOrderLines", "POLineId", ("POId", "LineNumber"),
+               ("POId", "LineNumber", "ItemId", "ItemCode", "Description", "Quantity", "UnitPrice"),
+               (Reference("PONumber", "POId", "PurchaseOrders"), Reference("ItemCode", "ItemId", "Items", unknown_ok=True))),
+        Entity("SalesOrders", "SOId", ("SONumber",), ("SONumber", "CustomerId", "SODate", "Status", "SiteId"),
+               (Reference("CustomerCode", "CustomerId", "Customers"), Reference("SiteCode", "SiteId", "Sites", required=False)),
+               lines="SalesOrderLines"),
+        Entity("SalesOrderLines", "SOLineId", ("SOId", "LineNumber"),
+               ("SOId", "LineNumber", "ItemId", "ItemCode", "Description", "Quantity", "UnitPrice"),
+               (Reference("SONumber", "SOId", "SalesOrders"), Reference("ItemCode", "ItemId", "Items", unknown_ok=True))),
+        Entity("Bills", "BillId", ("VendorId", "BillNumber"),
+               ("VendorId", "BillNumber", "BillDate", "DueDate", "TotalAmount", "Currency", "Status"),
+               (Reference("VendorCode", "VendorId", "Vendors"),)),
+        Entity("AssetTransactions", "AssetTxnId", (),
+               ("AssetId", "FromLocationId", "ToLocationId", "TxnType", "Quantity", "TxnDate", "Note"),
+               (Reference("AssetTag", "AssetId", "Assets"),
+                Reference("FromLocationCode", "FromLocationId", "Locations", required=False),
+                Reference("ToLocationCode", "ToLocationId", "Locations", required=False))),
+    )
+}
+# tables looked up by a natural key without being loaded here: (id column, key column)
+LOOKUPS = {
+    "Sites": ("SiteId", "SiteCode"),
+    "Assets": ("AssetId", "AssetTag"),
+    "Locations": ("LocationId", "LocationCode"),
+}
+# a location code used at two sites can't be resolved without the site
+AMBIGUOUS = object()
+
+
+def read_records(path: str):
+    # CSV rows (empty cells become NULL) or JSONL objects, streamed
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        if path.lower().endswith(".csv"):
+            for row in csv.DictReader(f):
+                yield {name: (value if value != "" else None) for name, value in row.items()}
+        else:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def parse_input(argument: str) -> tuple:
+    # "Bills:upstream/ap.csv" names the table, otherwise the file name does: purchase_orders.jsonl -> PurchaseOrders
+    table, _, path = argument.partition(":")
+    if path and table in ENTITIES:
+        return table, path
+    stem = re.sub(r"[^a-z]", "", os.path.basename(argument).split(".")[0].lower())
+    for table in ENTITIES:
+        if table.lower() == stem:
+            return table, argument
+    raise ValueError(f"can't tell which table {argument} loads, name it like vendors.csv or prefix it: Vendors:{argument}")
+
+
+class BulkLoader:
+    """
+    Loads CSV/JSONL exports into the ERP tables. Natural keys (VendorCode,
+    CustomerCode, ItemCode, SiteCode, PONumber, ...) are resolved through
+    maps read once per table and kept current as rows go in, and ids for new
+    rows are assigned here, so headers and their lines need no lookups.
+    Rows go in `chunk_size` at a time with one executemany per transaction;
+    a chunk that fails is redone row by row so only the bad rows are
+    rejected. mode "upsert" updates existing keys, "insert" skips them.
+    A row only writes the columns its record sets: a CSV cell left empty is
+    NULL, a key left out of a JSONL record keeps the stored value.
+    """
+
+    def __init__(self, conn: sqlite3.Connection, mode: str = "upsert", chunk_size: int = CHUNK_SIZE, rejects_path: str = None):
+        if mode not in MODES:
+            raise ValueError(f"unknown mode {mode!r}, expected one of {', '.join(MODES)}")
+        self.conn = conn
+        self.mode = mode
+        self.chunk_size = chunk_size
+        self.maps = {}
+        self.plans = {}
+        self.next_ids = {}
+        self.report = {}
+        self.reasons = Counter()
+        self.rejects = open(rejects_path, "a", encoding="utf-8") if rejects_path else None
+        for pragma in INGEST_PRAGMAS:
+            conn.execute(pragma)
+
+    # KEY MAPS
+    def key_map(self, table: str) -> dict:
+        if table not in self.maps:
+            if table in ENTITIES:
+                entity = ENTITIES[table]
+                id_column, columns = entity.id_column, entity.key
+            else:
+                id_column, columns = LOOKUPS[table][0], LOOKUPS[table][1:]
+            mapping = {}
+            for row in self.conn.execute(f"SELECT {id_column}, {', '.join(columns)} FROM {table}"):
+                key = row[1:]
+                mapping[key] = AMBIGUOUS if key in mapping else row[0]
+            self.maps[table] = mapping
+        return self.maps[table]
+
+    def new_id(self, entity: Entity) -> int:
+        # AUTOINCREMENT never reuses an id, so the counter starts past sqlite_sequence as well
+        if entity.table not in self.next_ids:
+            highest = self.conn.execute(f"SELECT MAX({entity.id_column}) FROM {entity.table}").fetchone()[0] or 0
+            sequence = self.conn.execute("SELECT seq FROM sqlite_sequence WHERE name = ?", (entity.table,)).fetchone()
+            self.next_ids[entity.table] = max(highest, sequence[0] if sequence else 0) + 1
+        self.next_ids[entity.table] += 1
+        return self.next_ids[entity.table] - 1
+
+    # ROWS
+    def present_columns(self, entity: Entity, record: dict) -> list:
+        # columns a record sets are its keys (every CSV row has the whole header); the rest keep their value or default
+        # a required reference missing from the record still gets its column, so the row is rejected for it
+        sources = set(record)
+        targets = {ref.target for ref in entity.references if ref.source in sources or ref.required}
+        return [c for c in entity.columns if c in sources or c in targets]
+
+    def preparer(self, entity: Entity, columns: list):
+        """
+        Returns record -> (natural key, values in `columns` order), raising
+        Rejected for rows that can't go in. Key maps and column positions are
+        bound once per input rather than looked up per row.
+        """
+        references = {ref.target: (ref, self.key_map(ref.table)) for ref in entity.references}
+        steps = [(column, references.get(column), column in INTEGER_KEYS) for column in columns]
+        positions = [columns.index(column) if column in columns else None for column in entity.key]
+        missing_key = f"missing {', '.join(entity.key)}"
+
+        def prepare(record: dict) -> tuple:
+            values = []
+            for column, reference, integer in steps:
+                if reference is None:
+                    value = record.get(column)
+                    if integer and isinstance(value, str):
+                        try:
+                            value = int(value)
+                        except ValueError:
+                            raise Rejected(f"bad {column}") from None
+                    values.append(value)
+                    continue
+                ref, mapping = reference
+                code = record.get(ref.source)
+                if code is None:
+                    if ref.required:
+                        raise Rejected(f"missing {ref.source}")
+                    values.append(None)
+                    continue
+                ref_id = mapping.get((code,))
+                if ref_id is AMBIGUOUS:
+                    raise Rejected(f"ambiguous {ref.source}")
+                if ref_id is None and not ref.unknown_ok:
+                    raise Rejected(f"unknown {ref.source}")
+                values.append(ref_id)
+            key = tuple(values[i] if i is not None else None for i in positions)
+            if None in key:
+                raise Rejected(missing_key)
+            return key, values
+
+        return prepare
+
+    def plan(self, entity: Entity, record: dict) -> tuple:
+        # (statement, preparer) for the columns `record` sets, built once per distinct set of keys
+        shape = (entity.table, tuple(record))
+        plan = self.plans.get(shape)
+        if plan is None:
+            columns = self.present_columns(entity, record)
+            plan = self.plans[shape] = (self.statement(entity, columns), self.preparer(entity, columns))
+        return plan
+
+    def statement(self, entity: Entity, columns: list) -> str:
+        names = ([entity.id_column] if entity.key else []) + columns
+        sql = f"INSERT INTO {entity.table} ({', '.join(names)}) VALUES ({', '.join('?' for _ in names)})"
+        if self.mode == "upsert" and entity.key:
+            # ids of existing keys come from the key map, so a conflict is always on the primary key
+            updates = [f"{column} = excluded.{column}" for column in columns if column not in entity.key]
+            if "UpdatedAt" in self.table_columns(entity.table):
+                updates.append("UpdatedAt = datetime('now')")
+            sql += f" ON CONFLICT({entity.id_column}) DO " + (f"UPDATE SET {', '.join(updates)}" if updates else "NOTHING")
+        return sql
+
+    def table_columns(self, table: str) -> set:
+        return {row[1] for row in self.conn.execute(f"PRAGMA table_info({table})")}
+
+    def reject(self, entity: Entity, record: dict, reason: str):
+        self.report[entity.table]["rejected"] += 1
+        self.reasons[f"{entity.table}: {reason}"] += 1
+        if self.rejects is not None:
+            self.rejects.write(json.dumps({"table": entity.table, "reason": reason, "record": record}, default=str) + "\n")
+
+    def _stats(self, table: str) -> dict:
+        return self.report.setdefault(table, {"read": 0, "inserted": 0, "updated": 0, "skipped": 0, "rejected": 0, "seconds": 0.0})
+
+    # LOADING
+    def load(self, table: str, records) -> dict:
+        """
+        Loads an iterable of dicts into `table`. Orders may carry their lines
+        in a "lines" list; those are loaded after each chunk of orders, so
+        their order numbers resolve from the map without a query.
+        """
+        entity = ENTITIES[table]
+        stats = self._stats(table)
+        started = time.perf_counter()
+        line_seconds = 0.0
+        line_buffer = []
+        for chunk in chunked(records, self.chunk_size):
+            self._write(entity, chunk)
+            if entity.lines:
+                # lines inherit the order number and default to their position
+                number_column = entity.key[0]
+                for record in chunk:
+                    for number, line in enumerate(record.get("lines") or (), start=1):
+                        line_buffer.append({"LineNumber": number, **line, number_column: record.get(number_column)})
+            if line_buffer:
+                line_started = time.perf_counter()
+                lines = ENTITIES[entity.lines]
+                self._stats(lines.table)
+                self._write(lines, line_buffer)
+                line_buffer = []
+                elapsed = time.perf_counter() - line_started
+                self.report[lines.table]["seconds"] += elapsed
+                line_seconds += elapsed
+        stats["seconds"] += time.perf_counter() - started - line_seconds
+        return stats
+
+    def _write(self, entity: Entity, records: list):
+        stats = self.report[entity.table]
+        stats["read"] += len(records)
+        key_map = self.key_map(entity.table) if entity.key else None
+        rows = []
+        for record in records:
+            sql, prepare = self.plan(entity, record)
+            try:
+                key, values = prepare(record)
+            except Rejected as e:
+                self.reject(entity, record, str(e))
+                continue
+            if key_map is None:
+                # append-only: every row is new and SQLite numbers it
+                rows.append((sql, record, None, True, values))
+                continue
+            row_id = key_map.get(key)
+            if row_id is AMBIGUOUS:
+                self.reject(entity, record, "duplicate key in table")
+                continue
+            if row_id is not None and self.mode == "insert":
+                stats["skipped"] += 1
+                continue
+            new = row_id is None
+            if new:
+                row_id = key_map[key] = self.new_id(entity)
+            rows.append((sql, record, key, new, [row_id] + values))
+        if not rows:
+            return
+        # one executemany per statement; a CSV chunk, or JSONL records that all set the same keys, is one batch
+        batches = {}
+        for sql, _, _, _, values in rows:
+            batches.setdefault(sql, []).append(values)
+        self.conn.execute("BEGIN")
+        try:
+            for sql, batch in batches.items():
+                self.conn.executemany(sql, batch)
+            self.conn.execute("COMMIT")
+        except sqlite3.Error:
+            self.conn.execute("ROLLBACK")
+            # one bad row fails the whole executemany: redo the chunk row by row to reject only that row
+            self.conn.execute("BEGIN")
+            kept = []
+            for row in rows:
+                sql, record, key, new, values = row
+                try:
+                    self.conn.execute(sql, values)
+                    kept.append(row)
+                except sqlite3.Error as e:
+                    if new and key_map is not None:
+                        del key_map[key]
+                    self.reject(entity, record, f"{type(e).__name__}: {e}")
+            self.conn.execute("COMMIT")
+            rows = kept
+        for _, _, _, new, _ in rows:
+            stats["inserted" if new else "updated"] += 1
+
+    def close(self):
+        if self.rejects is not None:
+            self.rejects.close()
+
+
+def defer_indexes(conn: sqlite3.Connection, tables) -> list:
+    """
+    Drops the plain (non-unique) indexes on `tables` and returns their DDL,
+    so a big load doesn't maintain them row by row. Unique indexes stay:
+    they are what keeps natural keys unique.
+    """
+    placeholders = ", ".join("?" for _ in tables)
+    indexes = conn.execute(
+        f"SELECT name, sql FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL AND tbl_name IN ({placeholders})",
+        list(tables),
+    ).fetchall()
+    deferred = [(name, sql) for name, sql in indexes if not sql.lstrip().upper().startswith("CREATE UNIQUE")]
+    with conn:
+        for name, _ in deferred:
+            conn.execute(f'DROP INDEX "{name}"')
+    return deferred
+
+
+def rebuild_indexes(conn: sqlite3.Connection, deferred: list) -> float:
+    started = time.perf_counter()
+    with conn:
+        for _, sql in deferred:
+            conn.execute(sql)
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk load CSV/JSONL exports into the ERP tables")
+    parser.add_argument("inputs", nargs="+", help=f"files named after their table (vendors.csv, purchase_orders.jsonl, ...) or TABLE:PATH; tables: {', '.join(ENTITIES)}")
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--mode", choices=MODES, default="upsert", help="upsert updates rows whose natural key exists, insert skips them")
+    parser.add_argument("--chunk", type=int, default=CHUNK_SIZE, help="rows per executemany transaction")
+    parser.add_argument("--defer-indexes", action="store_true", help="drop non-unique indexes on the loaded tables and rebuild them at the end")
+    parser.add_argument("--rejects", help="append rejected records with their reason to this JSONL file")
+    args = parser.parse_args()
+
+    # referenced tables first, whatever order the files were given in
+    order = list(ENTITIES)
+    inputs = sorted((parse_input(argument) for argument in args.inputs), key=lambda pair: order.index(pair[0]))
+    conn = sqlite3.connect(args.db, isolation_level=None)
+    loader = BulkLoader(conn, args.mode, args.chunk, args.rejects)
+    started = time.perf_counter()
+    deferred = []
+    try:
+        if args.defer_indexes:
+            tables = {table for table, _ in inputs} | {ENTITIES[table].lines for table, _ in inputs if ENTITIES[table].lines}
+            deferred = defer_indexes(conn, tables)
+        for table, path in inputs:
+            loader.load(table, read_records(path))
+    finally:
+        index_seconds = rebuild_indexes(conn, deferred) if deferred else 0.0
+        loader.close()
+    total_seconds = time.perf_counter() - started
+
+    total_rows = 0
+    for table, stats in loader.report.items():
+        rows = stats["inserted"] + stats["updated"]
+        total_rows += rows
+        print(f"{table:<20} {rows:>12,} rows  {rows / max(stats['seconds'], 1e-9):>12,.0f} rows/s  "
+              f"({stats['inserted']:,} new, {stats['updated']:,} updated, {stats['skipped']:,} skipped, {stats['rejected']:,} rejected)")
+    if deferred:
+        print(f"{'Indexes':<20} {len(deferred):>12,} rebuilt in {index_seconds:.1f}s")
+    print(f"{'Total':<20} {total_rows:>12,} rows  {total_rows / total_seconds:>12,.0f} rows/s  ({total_seconds:.1f}s)")
+    for reason, count in loader.reasons.most_common():
+        print(f"  rejected {count:,}: {reason}")
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
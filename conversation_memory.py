@@ -0,0 +1,90 @@
+import re
+from collections import OrderedDict
+
+from cost_gate import alias_map
+from result_summary import estimate_tokens
+
+
+DEFAULT_HISTORY_TOKENS = 1200
+MAX_ENTITIES = 40
+MAX_DIGEST_SQL = 3
+CODE_PATTERN = re.compile(r"\b[A-Z]{2,}-[A-Z0-9-]+\b")
+LITERAL_PATTERN = re.compile(r"'((?:[^']|'')*)'")
+
+
+class ConversationMemory:
+    """
+    Bounded chat history for the retrieval model. The newest turns are kept
+    verbatim (question -> SQL) as long as they fit `token_budget`; turns that
+    fall out of the window are folded into a short digest of the entities they
+    referenced (tables, codes, literals) and their last few SQL statements.
+    Build a fresh chat from history() every turn instead of letting one
+    chat session grow forever.
+    """
+
+    def __init__(self, token_budget: int = DEFAULT_HISTORY_TOKENS, max_window_turns: int = 6):
+        self.token_budget = token_budget
+        self.max_window_turns = max_window_turns
+        self.window = []
+        # insertion-ordered so the oldest entities drop off first
+        self.entities = OrderedDict()
+        self.digest_sql = []
+        self.compacted_turns = 0
+
+    def add_turn(self, question: str, sql_query: str):
+        self.window.append((question, sql_query))
+        self._compact()
+
+    def _turn_tokens(self, question: str, sql_query: str) -> int:
+        return estimate_tokens(question) + estimate_tokens(sql_query) + 8
+
+    def _compact(self):
+        digest_tokens = estimate_tokens(self.digest())
+        while self.window and (
+            len(self.window) > self.max_window_turns
+            or digest_tokens + sum(self._turn_tokens(q, s) for q, s in self.window) > self.token_budget
+        ):
+            question, sql_query = self.window.pop(0)
+            self._remember(question, sql_query)
+            self.compacted_turns += 1
+            digest_tokens = estimate_tokens(self.digest())
+
+    def _remember(self, question: str, sql_query: str):
+        found = list(CODE_PATTERN.findall(question))
+        found.extend(sorted(set(alias_map(sql_query).values())))
+        found.extend(v for v in LITERAL_PATTERN.findall(sql_query) if len(v) <= 40)
+        for entity in found:
+            self.entities.pop(entity, None)
+            self.entities[entity] = True
+        while len(self.entities) > MAX_ENTITIES:
+            self.entities.popitem(last=False)
+        self.digest_sql.append(" ".join(sql_query.split())[:300])
+        self.digest_sql = self.digest_sql[-MAX_DIGEST_SQL:]
+
+    def digest(self) -> str:
+        if not self.compacted_turns:
+            return ""
+        lines = [f"Earlier in this conversation ({self.compacted_turns} turns) the user asked about: {', '.join(self.entities)}."]
+        if self.digest_sql:
+            lines.append("Recent earlier SQL:")
+            lines.extend(self.digest_sql)
+        return "\n".join(lines)
+
+    def history(self) -> list:
+        # in the google.generativeai start_chat(history=...) format
+        history = []
+        digest = self.digest()
+        if digest:
+            history.append({"role": "user", "parts": [digest]})
+            history.append({"role": "model", "parts": ["Understood."]})
+        for question, sql_query in self.window:
+            history.append({"role": "user", "parts": [question]})
+            history.append({"role": "model", "parts": [sql_query]})
+        return history
+
+    def stats(self) -> dict:
+        return {
+            "window_turns": len(self.window),
+            "compacted_turns": self.compacted_turns,
+            "history_tokens": sum(estimate_tokens(p) for m in self.history() for p in m["parts"]),
+        }
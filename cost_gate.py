@@ -0,0 +1,283 @@
+import math
+import re
+import sqlite3
+
+
+# about 1 s of SQLite work: measured plans run at 10-50M estimated rows per second
+DEFAULT_COST_BUDGET = 20_000_000
+DEFAULT_MAX_ROWS = 10_000
+DEFAULT_MAX_RETRIES = 2
+# rows SQLite itself assumes an equality lookup on a non-unique index returns
+EQ_LOOKUP_ROWS = 10
+
+# a FROM list runs until the next clause or the paren closing its subquery
+FROM_PATTERN = re.compile(r"\bFROM\b", re.IGNORECASE)
+FROM_END_PATTERN = re.compile(r"\b(?:WHERE|GROUP|ORDER|LIMIT|HAVING|UNION|EXCEPT|INTERSECT|WINDOW|SELECT)\b|\)", re.IGNORECASE)
+# a table and its alias inside a FROM list; names followed by "." or "(" are columns and functions (ON clauses)
+ALIAS_PATTERN = re.compile(
+    r"(?:^|,|\bJOIN\b)\s*([A-Za-z_][A-Za-z0-9_]*)(?!\s*[.(])(?:\s+(?:AS\s+)?([A-Za-z_][A-Za-z0-9_]*)(?!\s*[.(]))?", re.IGNORECASE
+)
+# the index a SEARCH uses and its constraint list, e.g. "USING COVERING INDEX idx (a=? AND b>?)"
+INDEX_PATTERN = re.compile(r"USING (?:COVERING )?INDEX (\S+) \((.*)\)")
+STRING_PATTERN = re.compile(r"'(?:[^']|'')*'")
+AGGREGATE_PATTERN = re.compile(r"\b(?:COUNT|SUM|AVG|MIN|MAX|TOTAL|GROUP_CONCAT)\s*\(", re.IGNORECASE)
+SQL_KEYWORDS = {
+    "where", "join", "left", "right", "inner", "outer", "cross", "natural", "on", "using", "group", "order",
+    "limit", "having", "union", "except", "intersect", "window", "as", "full", "from", "select",
+}
+
+
+def table_cardinalities(conn: sqlite3.Connection) -> dict:
+    # MAX(rowid) is a B-tree seek, close enough to COUNT(*) for tables that rarely delete
+    counts = {}
+    tables = conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'").fetchall()
+    for (table,) in tables:
+        try:
+            counts[table] = conn.execute(f'SELECT MAX(rowid) FROM "{table}"').fetchone()[0] or 0
+        except sqlite3.OperationalError:
+            counts[table] = conn.execute(f'SELECT COUNT(*) FROM "{table}"').fetchone()[0]
+    return counts
+
+
+def unique_indexes(conn: sqlite3.Connection, tables) -> dict:
+    # unique index name -> number of columns, so a SEARCH with "=?" on all of them is known to hit one row
+    indexes = {}
+    for table in tables:
+        for _, name, unique, *_ in conn.execute(f'PRAGMA index_list("{table}")').fetchall():
+            if unique:
+                indexes[name] = len(conn.execute(f'PRAGMA index_info("{name}")').fetchall())
+    return indexes
+
+
+def alias_map(sql_query: str) -> dict:
+    # alias -> table for every FROM list, subqueries included; each table also maps to itself
+    text = STRING_PATTERN.sub("''", sql_query)
+    aliases = {}
+    for start in FROM_PATTERN.finditer(text):
+        end = FROM_END_PATTERN.search(text, start.end())
+        from_list = text[start.end():end.start() if end else len(text)]
+        for table, alias in ALIAS_PATTERN.findall(from_list):
+            if table.lower() in SQL_KEYWORDS:
+                continue
+            aliases[table] = table
+            if alias and alias.lower() not in SQL_KEYWORDS:
+                aliases[alias] = table
+    return aliases
+
+
+def top_level(sql_query: str) -> str:
+    # the statement with string literals and everything inside parentheses blanked
+    out = []
+    depth = 0
+    for ch in STRING_PATTERN.sub("''", sql_query):
+        if ch == ")":
+            depth -= 1
+        out.append(ch if depth <= 0 else " ")
+        if ch == "(":
+            depth += 1
+    return "".join(out)
+
+
+def single_row(sql_query: str) -> bool:
+    """
+    True for an aggregate without GROUP BY ("SELECT COUNT(*) FROM ..."),
+    which returns one row however many it reads.
+    """
+    text = top_level(sql_query)
+    selects = list(re.finditer(r"\bSELECT\b", text, re.IGNORECASE))
+    if len(selects) != 1 or re.search(r"\b(?:GROUP\s+BY|OVER|UNION|EXCEPT|INTERSECT)\b", text, re.IGNORECASE):
+        return False
+    columns = re.split(r"\bFROM\b", text[selects[0].end():], maxsplit=1, flags=re.IGNORECASE)[0]
+    return AGGREGATE_PATTERN.search(columns) is not None
+
+
+def has_limit(sql_query: str) -> bool:
+    # only a LIMIT on the outermost query counts, i.e. after the last closing paren
+    tail = sql_query.rsplit(")", 1)[-1]
+    return re.search(r"\bLIMIT\s+\d+", tail, re.IGNORECASE) is not None
+
+
+class PlanVerdict:
+    def __init__(self, sql_query: str, status: str, cost: float = 0.0, est_rows: float = 0.0, reasons: list = None, plan: list = None):
+        # status is one of "ok", "rewritten", "rejected", "error"
+        self.sql_query = sql_query
+        self.status = status
+        self.cost = cost
+        self.est_rows = est_rows
+        self.reasons = reasons or []
+        self.plan = plan or []
+
+    @property
+    def accepted(self) -> bool:
+        return self.status in ("ok", "rewritten")
+
+    def feedback(self) -> str:
+        plan_text = "\n".join(self.plan)
+        return (
+            f"The previous SQL was rejected before running: {'; '.join(self.reasons)}.\n"
+            f"Query plan:\n{plan_text}\n"
+            "Rewrite it for the same question so it filters on indexed or primary key columns, "
+            "joins every table on its foreign key and avoids cross joins. Return ONLY raw SQL."
+        )
+
+
+class CostGate:
+    """
+    Pre-execution check on generated SQL. Compiles the query with
+    EXPLAIN QUERY PLAN, estimates cost as the rows visited by the nested
+    loops (full scans, index searches, temp B-trees) using table cardinalities,
+    rejects plans over `cost_budget` and appends a LIMIT to cheap queries
+    that would still return more than `max_rows` rows. `unique_indexes`
+    (name -> column count) lets equality lookups on them count as one row.
+    """
+
+    def __init__(self, cardinalities: dict, cost_budget: float = DEFAULT_COST_BUDGET, max_rows: int = DEFAULT_MAX_ROWS,
+                 unique_indexes: dict = None):
+        self.cardinalities = cardinalities
+        self.cost_budget = cost_budget
+        self.max_rows = max_rows
+        self.unique_indexes = unique_indexes or {}
+
+    @classmethod
+    def from_connection(cls, conn: sqlite3.Connection, **kwargs):
+        counts = table_cardinalities(conn)
+        return cls(counts, unique_indexes=unique_indexes(conn, counts), **kwargs)
+
+    def check(self, conn, sql_query: str) -> PlanVerdict:
+        # conn may be a sqlite3.Connection or a db_pool.QueryGuard
+        sql_query = sql_query.strip().rstrip(";").strip()
+        try:
+            plan = conn.execute(f"EXPLAIN QUERY PLAN {sql_query}").fetchall()
+        except sqlite3.Error as e:
+            return PlanVerdict(sql_query, "error", reasons=[f"SQL does not compile: {e}"])
+        cost, est_rows, reasons = self.estimate(plan, alias_map(sql_query))
+        if single_row(sql_query):
+            est_rows = 1.0
+        plan_lines = [row[3] for row in plan]
+        if cost > self.cost_budget:
+            reasons.insert(0, f"estimated cost {cost:,.0f} exceeds budget {self.cost_budget:,.0f}")
+            return PlanVerdict(sql_query, "rejected", cost, est_rows, reasons, plan_lines)
+        if est_rows > self.max_rows and not has_limit(sql_query) and sql_query.lower().startswith(("select", "with")):
+            rewritten = f"{sql_query}\nLIMIT {self.max_rows}"
+            reasons.append(f"estimated {est_rows:,.0f} rows, added LIMIT {self.max_rows}")
+            return PlanVerdict(rewritten, "rewritten", cost, min(est_rows, self.max_rows), reasons, plan_lines)
+        return PlanVerdict(sql_query, "ok", cost, est_rows, reasons, plan_lines)
+
+    def without_row_limit(self, sql_query: str) -> str:
+        # undoes the LIMIT check() appends, for exports that want every row
+        suffix = f"\nLIMIT {self.max_rows}"
+        return sql_query[:-len(suffix)] if sql_query.endswith(suffix) else sql_query
+
+    def estimate(self, plan: list, aliases: dict):
+        children = {}
+        for node_id, parent, _, detail in plan:
+            children.setdefault(parent, []).append((node_id, detail))
+        derived = {}
+        reasons = []
+        cost, rows = self._loop_nest(children, 0, aliases, derived, reasons)
+        return cost, rows, reasons
+
+    def _rows_for(self, name: str, aliases: dict, derived: dict) -> float:
+        if name in derived:
+            return derived[name]
+        table = aliases.get(name, name)
+        if table in self.cardinalities:
+            return max(self.cardinalities[table], 1)
+        # unknown name (view, virtual table): assume the largest table
+        return max(self.cardinalities.values() or [1])
+
+    def _unique_lookup(self, detail: str) -> bool:
+        # equality on the rowid / primary key, or on every column of a unique index
+        if ">" in detail or "<" in detail:
+            return False
+        if "PRIMARY KEY" in detail:
+            return "=?" in detail
+        match = INDEX_PATTERN.search(detail)
+        if not match or match.group(1) not in self.unique_indexes:
+            return False
+        return match.group(2).count("=?") >= self.unique_indexes[match.group(1)]
+
+    def _loop_nest(self, children: dict, parent: int, aliases: dict, derived: dict, reasons: list):
+        cost = 0.0
+        loop_rows = 1.0
+        scans_in_nest = 0
+        for node_id, detail in children.get(parent, []):
+            words = detail.split()
+            head = words[0] if words else ""
+            if detail.startswith("SCAN CONSTANT ROW"):
+                # SELECT without FROM: one row, no table
+                continue
+            if head == "SCAN" and len(words) > 1:
+                name = words[1]
+                n = self._rows_for(name, aliases, derived)
+                if scans_in_nest and "COVERING INDEX" not in detail:
+                    reasons.append(f"full scan of {aliases.get(name, name)} inside another scan (cartesian product)")
+                elif n > self.max_rows:
+                    reasons.append(f"full scan of {aliases.get(name, name)} (~{n:,.0f} rows)")
+                scans_in_nest += 1
+                loop_rows *= n
+                cost += loop_rows
+            elif head == "SEARCH" and len(words) > 1:
+                name = words[1]
+                n = self._rows_for(name, aliases, derived)
+                if "AUTOMATIC" in detail:
+                    # SQLite builds a throwaway index first: one scan plus a sort
+                    cost += n * math.log2(n + 1)
+                    reasons.append(f"automatic index built on {aliases.get(name, name)} (missing index)")
+                if self._unique_lookup(detail):
+                    # one probe per outer row; the upper B-tree pages stay cached, so no log2 descent
+                    cost += loop_rows
+                    fanout = 1
+                elif ">" in detail or "<" in detail:
+                    cost += loop_rows * (math.log2(n + 1) + 1)
+                    fanout = max(n / 4, 1)
+                else:
+                    cost += loop_rows * (math.log2(n + 1) + 1)
+                    fanout = min(n, EQ_LOOKUP_ROWS)
+                loop_rows *= fanout
+            elif head == "USE" and "TEMP B-TREE" in detail:
+                cost += loop_rows * math.log2(loop_rows + 1)
+                reasons.append(detail.lower())
+            elif head in ("MATERIALIZE", "CO-ROUTINE"):
+                sub_cost, sub_rows = self._loop_nest(children, node_id, aliases, derived, reasons)
+                cost += sub_cost
+                if len(words) > 1:
+                    derived[words[1]] = max(sub_rows, 1)
+            elif head == "CORRELATED":
+                sub_cost, _ = self._loop_nest(children, node_id, aliases, derived, reasons)
+                cost += loop_rows * sub_cost
+            else:
+                # LIST/SCALAR SUBQUERY, COMPOUND, MULTI-INDEX OR, ...: cost of the subtree once
+                sub_cost, sub_rows = self._loop_nest(children, node_id, aliases, derived, reasons)
+                cost += sub_cost
+                if head in ("COMPOUND", "LEFT-MOST", "UNION", "MULTI-INDEX"):
+                    loop_rows = max(loop_rows, sub_rows)
+        return cost, loop_rows
+
+
+def generate_checked_sql(send_message, message: str, gate: CostGate, conn, max_retries: int = DEFAULT_MAX_RETRIES, escalate=None):
+    """
+    Sends `message` through `send_message` (text -> SQL text), gates the SQL
+    and re-prompts with the plan feedback up to `max_retries` times. When SQL
+    doesn't compile and `escalate` is given, escalate() is called once and may
+    return a send_message for a stronger model, which starts over from
+    `message` without using up a retry.
+    Returns the last PlanVerdict and the number of model calls made.
+    """
+    verdict = gate.check(conn, send_message(message))
+    attempts = 1
+    retries = 0
+    while not verdict.accepted:
+        stronger = None
+        if verdict.status == "error" and escalate is not None:
+            stronger, escalate = escalate(), None
+        if stronger is not None:
+            send_message = stronger
+            verdict = gate.check(conn, send_message(message))
+        elif retries < max_retries:
+            retries += 1
+            verdict = gate.check(conn, send_message(verdict.feedback()))
+        else:
+            break
+        attempts += 1
+    return verdict, attempts
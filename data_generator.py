@@ -0,0 +1,304 @@
+import argparse
+import bisect
+import itertools
+import random
+import sqlite3
+import time
+from datetime import date
+
+from sqlite_seed import reset_db, create_schema
+
+
+# rows per unit of scale factor, --scale 1 is roughly 1M rows in total
+ROWS_PER_SCALE = {
+    "Sites": 10,
+    "Customers": 10_000,
+    "Vendors": 1_000,
+    "Items": 2_000,
+    "Assets": 5_000,
+    "Bills": 20_000,
+    "PurchaseOrders": 15_000,
+    "SalesOrders": 150_000,
+    "AssetTransactions": 200_000,
+}
+AISLES_PER_SITE = 20
+CHUNK_SIZE = 50_000
+START_DATE = date(2022, 1, 1).toordinal()
+DAYS = 3 * 365
+
+CITIES = [
+    ("New York", "USA", "America/New_York"), ("San Francisco", "USA", "America/Los_Angeles"),
+    ("London", "UK", "Europe/London"), ("Berlin", "Germany", "Europe/Berlin"), ("Tokyo", "Japan", "Asia/Tokyo"),
+    ("Paris", "France", "Europe/Paris"), ("Amsterdam", "Netherlands", "Europe/Amsterdam"),
+    ("Rome", "Italy", "Europe/Rome"), ("Toronto", "Canada", "America/Toronto"), ("Sydney", "Australia", "Australia/Sydney"),
+]
+ITEM_CATEGORIES = [("Widgets", "EA"), ("Gadgets", "EA"), ("Parts", "EA"), ("Components", "EA"), ("Consumables", "BX"), ("Kits", "KT")]
+ASSET_CATEGORIES = ["Vehicle", "Equipment", "Tool", "IT", "Furniture"]
+# (value, weight) pairs, roughly what a live ERP looks like
+ASSET_STATUSES = [("Active", 80), ("Maintenance", 12), ("Inactive", 8)]
+ORDER_STATUSES = [("Closed", 70), ("Open", 25), ("Cancelled", 5)]
+BILL_STATUSES = [("Closed", 65), ("Open", 30), ("Void", 5)]
+TXN_TYPES = [("Move", 60), ("Adjust", 15), ("Repair", 15), ("Receive", 10)]
+
+BULK_LOAD_PRAGMAS = [
+    "PRAGMA foreign_keys = OFF",
+    "PRAGMA journal_mode = OFF",
+    "PRAGMA synchronous = OFF",
+    "PRAGMA locking_mode = EXCLUSIVE",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -262144",
+]
+
+
+class Picker:
+    # weighted choice via bisect on cumulative weights, O(log n) per draw
+    def __init__(self, rng: random.Random, values: list, weights: list):
+        self.rng = rng
+        self.values = values
+        self.cumulative = list(itertools.accumulate(weights))
+        self.total = self.cumulative[-1]
+
+    def __call__(self):
+        return self.values[bisect.bisect_right(self.cumulative, self.rng.random() * self.total)]
+
+
+def zipf_picker(rng: random.Random, ids: range, s: float = 0.8) -> Picker:
+    # a few customers/vendors/items account for most of the activity
+    return Picker(rng, list(ids), [1.0 / (rank ** s) for rank in range(1, len(ids) + 1)])
+
+
+def status_picker(rng: random.Random, pairs: list) -> Picker:
+    return Picker(rng, [v for v, _ in pairs], [w for _, w in pairs])
+
+
+def random_day(rng: random.Random) -> str:
+    # a mild upward trend: later days are a bit more likely
+    offset = int(DAYS * (rng.random() ** 0.8))
+    return date.fromordinal(START_DATE + offset).isoformat()
+
+
+def chunked(rows, size: int):
+    iterator = iter(rows)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class Loader:
+    def __init__(self, conn: sqlite3.Connection, chunk_size: int = CHUNK_SIZE):
+        self.conn = conn
+        self.chunk_size = chunk_size
+        self.report = []
+
+    def load(self, table: str, columns: list, rows) -> int:
+        placeholders = ", ".join("?" for _ in columns)
+        sql = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders})"
+        started = time.perf_counter()
+        count = 0
+        for chunk in chunked(rows, self.chunk_size):
+            self.conn.executemany(sql, chunk)
+            count += len(chunk)
+        elapsed = time.perf_counter() - started
+        self.report.append((table, count, elapsed))
+        return count
+
+
+def generate(conn: sqlite3.Connection, scale: float = 1.0, seed: int = 42, chunk_size: int = CHUNK_SIZE) -> list:
+    """
+    Fills an empty schema with deterministic synthetic data for the given
+    scale factor. IDs are assigned here (1..n per table), so foreign keys are
+    resolved from in-memory ranges/maps instead of lookups. Returns the
+    (table, rows, seconds) report.
+    """
+    rng = random.Random(seed)
+    n = {table: max(1, int(per_scale * scale)) for table, per_scale in ROWS_PER_SCALE.items()}
+    n["Sites"] = max(5, n["Sites"])
+    loader = Loader(conn, chunk_size)
+    for pragma in BULK_LOAD_PRAGMAS:
+        conn.execute(pragma)
+    conn.execute("BEGIN")
+
+    # Sites and a warehouse -> aisle hierarchy per site
+    site_ids = range(1, n["Sites"] + 1)
+    loader.load(
+        "Sites",
+        ["SiteId", "SiteCode", "SiteName", "AddressLine1", "City", "Country", "TimeZone"],
+        (
+            (sid, f"S{sid:04d}", f"{CITIES[sid % len(CITIES)][0]} Site {sid}", f"{sid} Main St", *CITIES[sid % len(CITIES)])
+            for sid in site_ids
+        ),
+    )
+    locations_by_site = {}
+    location_rows = []
+    next_location = 1
+    for sid in site_ids:
+        warehouse = next_location
+        location_rows.append((warehouse, sid, f"S{sid:04d}-WH", f"Site {sid} Warehouse", None))
+        next_location += 1
+        aisles = []
+        for a in range(1, AISLES_PER_SITE + 1):
+            location_rows.append((next_location, sid, f"S{sid:04d}-WH-A{a:02d}", f"Site {sid} Aisle {a}", warehouse))
+            aisles.append(next_location)
+            next_location += 1
+        locations_by_site[sid] = [warehouse] + aisles
+    loader.load("Locations", ["LocationId", "SiteId", "LocationCode", "LocationName", "ParentLocationId"], location_rows)
+
+    # Parties and items
+    loader.load(
+        "Customers",
+        ["CustomerId", "CustomerCode", "CustomerName", "Email", "Phone", "BillingAddress1", "BillingCity", "BillingCountry"],
+        (
+            (cid, f"CUST-{cid:07d}", f"Customer {cid}", f"ap@cust{cid}.test", f"+1-555-{cid % 10_000_000:07d}", f"{cid} Market Rd",
+             *CITIES[rng.randrange(len(CITIES))][:2])
+            for cid in range(1, n["Customers"] + 1)
+        ),
+    )
+    loader.load(
+        "Vendors",
+        ["VendorId", "VendorCode", "VendorName", "Email", "Phone", "AddressLine1", "City", "Country"],
+        (
+            (vid, f"VEND-{vid:06d}", f"Vendor {vid}", f"sales@vend{vid}.test", f"+1-555-{vid:07d}", f"{vid} Supply Ave",
+             *CITIES[rng.randrange(len(CITIES))][:2])
+            for vid in range(1, n["Vendors"] + 1)
+        ),
+    )
+    item_prices = {}
+    item_rows = []
+    for iid in range(1, n["Items"] + 1):
+        category, uom = ITEM_CATEGORIES[iid % len(ITEM_CATEGORIES)]
+        # log-normal prices: many cheap items, a long tail of expensive ones
+        item_prices[iid] = round(min(rng.lognormvariate(3.5, 1.0), 20_000), 2)
+        item_rows.append((iid, f"ITM-{iid:06d}", f"{category[:-1]} {iid}", category, uom))
+    loader.load("Items", ["ItemId", "ItemCode", "ItemName", "Category", "UnitOfMeasure"], item_rows)
+
+    pick_customer = zipf_picker(rng, range(1, n["Customers"] + 1))
+    pick_vendor = zipf_picker(rng, range(1, n["Vendors"] + 1))
+    pick_item = zipf_picker(rng, range(1, n["Items"] + 1), s=0.7)
+    pick_site = zipf_picker(rng, site_ids, s=0.7)
+
+    # Assets
+    pick_asset_status = status_picker(rng, ASSET_STATUSES)
+    asset_locations = {}
+
+    def asset_rows():
+        for aid in range(1, n["Assets"] + 1):
+            sid = pick_site()
+            loc = rng.choice(locations_by_site[sid])
+            asset_locations[aid] = (sid, loc)
+            yield (
+                aid, f"AST-{aid:07d}", f"{ASSET_CATEGORIES[aid % 5]} {aid}", sid, loc, f"SN-{rng.randrange(10**9):09d}",
+                ASSET_CATEGORIES[aid % 5], pick_asset_status(), round(rng.lognormvariate(7.5, 1.2), 2), random_day(rng), pick_vendor(),
+            )
+
+    loader.load(
+        "Assets",
+        ["AssetId", "AssetTag", "AssetName", "SiteId", "LocationId", "SerialNumber", "Category", "Status", "Cost", "PurchaseDate", "VendorId"],
+        asset_rows(),
+    )
+
+    # Bills, unique per (VendorId, BillNumber) because BillNumber is global
+    pick_bill_status = status_picker(rng, BILL_STATUSES)
+
+    def bill_rows():
+        for bid in range(1, n["Bills"] + 1):
+            bill_day = random_day(rng)
+            due = date.fromisoformat(bill_day).toordinal() + rng.choice((15, 30, 30, 45, 60))
+            yield (bid, pick_vendor(), f"BILL-{bid:08d}", bill_day, date.fromordinal(due).isoformat(),
+                   round(rng.lognormvariate(7.0, 1.1), 2), "USD", pick_bill_status())
+
+    loader.load("Bills", ["BillId", "VendorId", "BillNumber", "BillDate", "DueDate", "TotalAmount", "Currency", "Status"], bill_rows())
+
+    # Orders with lines; line ids are global counters, 1-8 lines per order
+    pick_order_status = status_picker(rng, ORDER_STATUSES)
+    for prefix, header, lines, count_key, party, party_col, id_col, number_col, date_col in (
+        ("PO", "PurchaseOrders", "PurchaseOrderLines", "PurchaseOrders", pick_vendor, "VendorId", "POId", "PONumber", "PODate"),
+        ("SO", "SalesOrders", "SalesOrderLines", "SalesOrders", pick_customer, "CustomerId", "SOId", "SONumber", "SODate"),
+    ):
+        line_buffer = []
+
+        def header_rows():
+            for oid in range(1, n[count_key] + 1):
+                yield (oid, f"{prefix}-{oid:08d}", party(), random_day(rng), pick_order_status(), pick_site())
+                for line_no in range(1, min(1 + int(rng.expovariate(0.35)), 8) + 1):
+                    iid = pick_item()
+                    markup = 1.0 if prefix == "PO" else rng.uniform(1.2, 1.8)
+                    line_buffer.append((oid, line_no, iid, f"ITM-{iid:06d}", None, rng.randint(1, 50), round(item_prices[iid] * markup, 2)))
+
+        # headers and lines are interleaved so the line buffer never holds more than one chunk
+        header_sql_cols = [id_col, number_col, party_col, date_col, "Status", "SiteId"]
+        header_started = time.perf_counter()
+        header_count = 0
+        line_count = 0
+        line_seconds = 0.0
+        line_sql = f"INSERT INTO {lines} ({id_col}, LineNumber, ItemId, ItemCode, Description, Quantity, UnitPrice) VALUES (?, ?, ?, ?, ?, ?, ?)"
+        header_sql = f"INSERT INTO {header} ({', '.join(header_sql_cols)}) VALUES (?, ?, ?, ?, ?, ?)"
+        for chunk in chunked(header_rows(), chunk_size):
+            conn.executemany(header_sql, chunk)
+            header_count += len(chunk)
+            line_started = time.perf_counter()
+            conn.executemany(line_sql, line_buffer)
+            line_seconds += time.perf_counter() - line_started
+            line_count += len(line_buffer)
+            line_buffer.clear()
+        # the last order's lines are only buffered when chunked() resumes the generator to find its end,
+        # after the final chunk when the order count is a multiple of the chunk size
+        line_started = time.perf_counter()
+        conn.executemany(line_sql, line_buffer)
+        line_seconds += time.perf_counter() - line_started
+        line_count += len(line_buffer)
+        line_buffer.clear()
+        loader.report.append((header, header_count, time.perf_counter() - header_started - line_seconds))
+        loader.report.append((lines, line_count, line_seconds))
+
+    # Asset transactions follow each asset from location to location
+    pick_txn_type = status_picker(rng, TXN_TYPES)
+    pick_asset = zipf_picker(rng, range(1, n["Assets"] + 1), s=0.6)
+
+    def txn_rows():
+        for _ in range(n["AssetTransactions"]):
+            aid = pick_asset()
+            sid, current = asset_locations[aid]
+            ttype = pick_txn_type()
+            target = rng.choice(locations_by_site[sid]) if ttype in ("Move", "Receive") else current
+            from_loc = None if ttype == "Receive" else current
+            asset_locations[aid] = (sid, target)
+            yield (aid, from_loc, target, ttype, 1, f"{random_day(rng)} 12:00:00", f"Generated {ttype.lower()}")
+
+    loader.load("AssetTransactions", ["AssetId", "FromLocationId", "ToLocationId", "TxnType", "Quantity", "TxnDate", "Note"], txn_rows())
+
+    conn.commit()
+    conn.execute("PRAGMA foreign_keys = ON")
+    return loader.report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic ERP database at a given scale factor")
+    parser.add_argument("--scale", type=float, default=1.0, help="scale factor, 1 is about 1M rows")
+    parser.add_argument("--db", default=None, help="output path, defaults to erp_scale<N>.db")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--chunk", type=int, default=CHUNK_SIZE, help="rows per executemany call")
+    parser.add_argument("--check", action="store_true", help="run PRAGMA foreign_key_check afterwards")
+    args = parser.parse_args()
+
+    path = args.db or f"erp_scale{args.scale:g}.db"
+    reset_db(path)
+    started = time.perf_counter()
+    conn = sqlite3.connect(path, isolation_level=None)
+    create_schema(conn)
+    report = generate(conn, args.scale, args.seed, args.chunk)
+    total_rows = sum(rows for _, rows, _ in report)
+    total_seconds = time.perf_counter() - started
+    for table, rows, seconds in report:
+        print(f"{table:<20} {rows:>12,} rows  {rows / max(seconds, 1e-9):>12,.0f} rows/s")
+    print(f"{'Total':<20} {total_rows:>12,} rows  {total_rows / total_seconds:>12,.0f} rows/s  ({total_seconds:.1f}s)")
+    if args.check:
+        violations = conn.execute("PRAGMA foreign_key_check").fetchall()
+        print(f"Foreign key violations: {len(violations)}")
+    conn.close()
+    print(f"SQLite database generated at: {path}")
+
+
+if __name__ == "__main__":
+    main()
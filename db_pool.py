@@ -0,0 +1,230 @@
+import os
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import closing, contextmanager
+
+from sqlite_seed import DB_PATH
+
+
+DEFAULT_TIME_BUDGET = 5.0
+DEFAULT_ROW_BUDGET = 100000
+PROGRESS_STEPS = 1000
+
+
+class QueryCancelled(sqlite3.OperationalError):
+    pass
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class QueryGuard:
+    """
+    Cursor-like handle bound to one pooled connection. The progress handler
+    aborts the statement once the time budget is spent (also during fetches),
+    and fetches raise QueryCancelled once more than `row_budget` rows came back.
+    """
+
+    def __init__(self, pool, conn: sqlite3.Connection, time_budget: float, row_budget: int):
+        self.pool = pool
+        self.conn = conn
+        self.time_budget = time_budget
+        self.row_budget = row_budget
+        self.cursor = None
+        self.deadline = None
+        self.rows_fetched = 0
+        self.interrupted = False
+
+    def _progress(self) -> int:
+        if self.interrupted:
+            return 1
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            self.interrupted = True
+            return 1
+        return 0
+
+    def _translate(self, error: sqlite3.OperationalError):
+        if not (self.interrupted and "interrupt" in str(error)):
+            return error
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            self.pool._count("time_cancellations")
+            return QueryCancelled(f"query cancelled after exceeding the {self.time_budget}s time budget")
+        return QueryCancelled("query cancelled")
+
+    @property
+    def description(self):
+        return self.cursor.description if self.cursor is not None else None
+
+    def execute(self, sql_query: str, params=()):
+        self.rows_fetched = 0
+        self.interrupted = False
+        self.deadline = time.monotonic() + self.time_budget if self.time_budget else None
+        try:
+            self.cursor = self.conn.execute(sql_query, params)
+        except sqlite3.OperationalError as e:
+            raise self._translate(e) from e
+        return self
+
+    def _checked(self, rows: list) -> list:
+        self.rows_fetched += len(rows)
+        if self.row_budget and self.rows_fetched > self.row_budget:
+            self.pool._count("row_cancellations")
+            self.cursor.close()
+            raise QueryCancelled(f"query cancelled after returning more than {self.row_budget} rows")
+        return rows
+
+    def fetchmany(self, size: int = 500) -> list:
+        try:
+            return self._checked(self.cursor.fetchmany(size))
+        except sqlite3.OperationalError as e:
+            raise self._translate(e) from e
+
+    def fetchone(self):
+        rows = self.fetchmany(1)
+        return rows[0] if rows else None
+
+    def fetchall(self) -> list:
+        rows = []
+        while True:
+            batch = self.fetchmany(500)
+            if not batch:
+                return rows
+            rows.extend(batch)
+
+    def __iter__(self):
+        while True:
+            batch = self.fetchmany(500)
+            if not batch:
+                return
+            yield from batch
+
+    def cancel(self):
+        # callable from another thread, stops the running statement
+        self.interrupted = True
+        self.conn.interrupt()
+
+
+class ReadOnlyPool:
+    """
+    Fixed-size pool of read-only SQLite connections (mode=ro URI plus
+    PRAGMA query_only). Use `with pool.query() as cur:` and then
+    cur.execute(...) / cur.fetchmany(...) like a regular cursor.
+    """
+
+    def __init__(self, db_path: str = DB_PATH, size: int = 4, time_budget: float = DEFAULT_TIME_BUDGET,
+                 row_budget: int = DEFAULT_ROW_BUDGET, acquire_timeout: float = 30.0, wal: bool = True):
+        self.db_path = db_path
+        self.size = size
+        self.time_budget = time_budget
+        self.row_budget = row_budget
+        self.acquire_timeout = acquire_timeout
+        self.lock = threading.Lock()
+        self.metrics = {
+            "acquired": 0,
+            "wait_seconds_total": 0.0,
+            "wait_seconds_max": 0.0,
+            "pool_timeouts": 0,
+            "time_cancellations": 0,
+            "row_cancellations": 0,
+            "manual_cancellations": 0,
+        }
+        # a writable connect (for WAL below) would create a mistyped path as an empty database
+        if not os.path.exists(db_path):
+            raise FileNotFoundError(f"no database at {db_path}")
+        if wal:
+            self._enable_wal()
+        self.idle = queue.LifoQueue()
+        self.active = set()
+        for _ in range(size):
+            self.idle.put(self._connect())
+
+    def _enable_wal(self):
+        # journal_mode is stored in the file, so one writable connection is enough;
+        # WAL lets these readers run while a writer (seeding, rollups) commits
+        try:
+            # sqlite3's own context manager only commits, closing() releases the connection
+            with closing(sqlite3.connect(self.db_path)) as conn:
+                conn.execute("PRAGMA journal_mode = WAL")
+        except sqlite3.OperationalError:
+            pass
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True, check_same_thread=False)
+        conn.execute("PRAGMA query_only = ON")
+        return conn
+
+    def _count(self, name: str, amount: float = 1):
+        with self.lock:
+            self.metrics[name] += amount
+
+    @contextmanager
+    def query(self, time_budget: float = None, row_budget: int = None):
+        started = time.monotonic()
+        try:
+            conn = self.idle.get(timeout=self.acquire_timeout)
+        except queue.Empty:
+            self._count("pool_timeouts")
+            raise PoolTimeout(f"no database connection free after {self.acquire_timeout}s")
+        waited = time.monotonic() - started
+        with self.lock:
+            self.metrics["acquired"] += 1
+            self.metrics["wait_seconds_total"] += waited
+            self.metrics["wait_seconds_max"] = max(self.metrics["wait_seconds_max"], waited)
+        guard = QueryGuard(
+            self,
+            conn,
+            self.time_budget if time_budget is None else time_budget,
+            self.row_budget if row_budget is None else row_budget,
+        )
+        conn.set_progress_handler(guard._progress, PROGRESS_STEPS)
+        with self.lock:
+            self.active.add(guard)
+        try:
+            yield guard
+        finally:
+            with self.lock:
+                self.active.discard(guard)
+            conn.set_progress_handler(None, 0)
+            if guard.cursor is not None:
+                guard.cursor.close()
+            self.idle.put(conn)
+
+    def warm(self, statements=("SELECT COUNT(*) FROM sqlite_master",)) -> int:
+        # the first statement on a connection parses the schema; pay that now, not in someone's first turn
+        conns = []
+        while True:
+            try:
+                conns.append(self.idle.get_nowait())
+            except queue.Empty:
+                break
+        try:
+            for conn in conns:
+                for statement in statements:
+                    conn.execute(statement).fetchall()
+        finally:
+            for conn in conns:
+                self.idle.put(conn)
+        return len(conns)
+
+    def cancel_all(self) -> int:
+        with self.lock:
+            guards = list(self.active)
+        for guard in guards:
+            guard.cancel()
+        self._count("manual_cancellations", len(guards))
+        return len(guards)
+
+    def stats(self) -> dict:
+        with self.lock:
+            stats = dict(self.metrics)
+            stats["in_use"] = len(self.active)
+        stats["size"] = self.size
+        stats["wait_seconds_avg"] = round(stats["wait_seconds_total"] / stats["acquired"], 6) if stats["acquired"] else 0.0
+        return stats
+
+    def close(self):
+        while not self.idle.empty():
+            self.idle.get_nowait().close()
@@ -0,0 +1,419 @@
+import argparse
+import heapq
+import json
+import math
+import mmap
+import os
+import re
+import threading
+import time
+import zlib
+from array import array
+
+from query_cache import CACHE_DB_PATH, normalize_question
+from schema_index import STOP_WORDS, stem
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+EXAMPLES_DIR = "examples"
+DEFAULT_FEW_SHOT = 3
+MIN_SIMILARITY = 0.25
+# postings read per query, rarest features first; common words past this add little and cost the most
+POSTING_BUDGET = 4096
+# examples kept in the in-memory delta before they are merged into the mapped arrays
+COMPACT_EVERY = 5000
+LOG_FILE = "examples.jsonl"
+META_FILE = "index.json"
+# name, array typecode, numpy dtype
+ARRAYS = {
+    "features": ("q", "int64"),
+    "offsets": ("q", "int64"),
+    "postings": ("i", "int32"),
+    "norms": ("f", "float32"),
+}
+
+
+def question_features(question: str) -> list:
+    """
+    Hashed word unigrams and bigrams of a question, stop words dropped and
+    numbers folded together, so "top 5 vendors by spend" and "top 10 vendors
+    by spend" share every feature. Sorted, no duplicates.
+    """
+    words = [
+        "#" if word.isdigit() else stem(word)
+        for word in re.findall(r"[a-z0-9]+", normalize_question(question))
+        if word not in STOP_WORDS
+    ]
+    grams = {f"u:{w}" for w in words} | {f"b:{a} {b}" for a, b in zip(words, words[1:])}
+    return sorted({zlib.crc32(g.encode("utf-8")) for g in grams})
+
+
+def _map(path: str, typecode: str, dtype: str):
+    # read-only view of a raw array file mapped into memory, as a numpy array or a memoryview without numpy
+    if not os.path.exists(path) or not os.path.getsize(path):
+        return np.zeros(0, dtype=dtype) if np is not None else array(typecode)
+    with open(path, "rb") as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return np.frombuffer(mapped, dtype=dtype) if np is not None else memoryview(mapped).cast(typecode)
+
+
+def _bisect(values, target: int) -> int:
+    low, high = 0, len(values)
+    while low < high:
+        middle = (low + high) // 2
+        if values[middle] < target:
+            low = middle + 1
+        else:
+            high = middle
+    return low
+
+
+class ExampleIndex:
+    """
+    Verified (question, SQL) pairs with a sparse vector index over hashed
+    word n-grams, for few-shot prompts. Layout in `directory`:
+
+    - examples.jsonl: append-only log, line i is example i; a later pair
+      for the same normalized question replaces the earlier one
+    - features/offsets/postings/norms: the compacted index as raw arrays
+      (CSR: sorted feature hashes, their posting ranges, example ids, and
+      1/sqrt(feature count) per example), memory-mapped on open
+    - index.json: how many examples the arrays cover
+
+    add() appends to the log and to an in-memory delta; once the delta holds
+    `compact_every` examples it is merged into new arrays, written aside and
+    swapped in. search() scores examples by shared features weighted by
+    IDF, reading the rarest features' postings first up to `posting_budget`,
+    which bounds the work per query however many examples share common words.
+    """
+
+    def __init__(self, directory: str = EXAMPLES_DIR, compact_every: int = COMPACT_EVERY,
+                 posting_budget: int = POSTING_BUDGET):
+        self.directory = directory
+        self.compact_every = compact_every
+        self.posting_budget = posting_budget
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.log_path = os.path.join(directory, LOG_FILE)
+        self.positions = array("q")
+        self.keys = {}
+        self.dead = set()
+        self.dead_ids = ()
+        self.searches = 0
+        self.search_seconds = 0.0
+        self._load()
+
+    # LOADING AND COMPACTION
+    def _load(self):
+        meta_path = os.path.join(self.directory, META_FILE)
+        meta = {"examples": 0}
+        if os.path.exists(meta_path):
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+        self._open_arrays()
+        self.base_count = meta["examples"]
+        if len(self.norms) != self.base_count:
+            # arrays from an interrupted compaction: ignore them and index the whole log again
+            self._close_arrays()
+            self.base_count = 0
+        self.delta = {}
+        self.delta_norms = {}
+        pending = []
+        position = 0
+        if os.path.exists(self.log_path):
+            with open(self.log_path, "rb") as f:
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break
+                    example = json.loads(line)
+                    self._register(len(self.positions), normalize_question(example["question"]))
+                    self.positions.append(position)
+                    position += len(line)
+                    if len(self.positions) > self.base_count:
+                        pending.append(example["question"])
+            # a torn last line from a crash is cut off so the next append starts clean
+            if position != os.path.getsize(self.log_path):
+                with open(self.log_path, "r+b") as f:
+                    f.truncate(position)
+        for number, question in enumerate(pending, start=self.base_count):
+            self._index_delta(number, question)
+        self.reader = open(self.log_path, "a+b")
+
+    def _open_arrays(self):
+        for name, (typecode, dtype) in ARRAYS.items():
+            setattr(self, name, _map(os.path.join(self.directory, f"{name}.bin"), typecode, dtype))
+
+    def _register(self, number: int, key: str):
+        # examples replaced before the last compaction are already gone from the arrays
+        previous = self.keys.get(key)
+        if previous is not None and number >= self.base_count:
+            self.dead.add(previous)
+        self.keys[key] = number
+
+    def _index_delta(self, number: int, question: str):
+        features = question_features(question)
+        for feature in features:
+            self.delta.setdefault(feature, []).append(number)
+        self.delta_norms[number] = 1.0 / math.sqrt(len(features)) if features else 0.0
+
+    def compact(self):
+        # merges the delta into new arrays: written under .tmp names, then renamed over the old ones
+        with self.lock:
+            if not self.delta_norms:
+                return
+            pairs = {}
+            for i in range(len(self.features)):
+                pairs[int(self.features[i])] = [int(n) for n in self.postings[int(self.offsets[i]):int(self.offsets[i + 1])]]
+            for feature, numbers in self.delta.items():
+                pairs.setdefault(feature, []).extend(numbers)
+            count = len(self.positions)
+            norms = array("f", [float(v) for v in self.norms]) + array("f", [self.delta_norms.get(n, 0.0) for n in range(self.base_count, count)])
+            # examples replaced since drop out of the postings for good
+            features, offsets, postings = array("q"), array("q", [0]), array("i")
+            for feature in sorted(pairs):
+                live = [n for n in pairs[feature] if n not in self.dead]
+                if live:
+                    features.append(feature)
+                    postings.extend(live)
+                    offsets.append(len(postings))
+            written = {"features": features, "offsets": offsets, "postings": postings, "norms": norms}
+            for name, values in written.items():
+                with open(os.path.join(self.directory, f"{name}.bin.tmp"), "wb") as f:
+                    values.tofile(f)
+            # release the old mappings before replacing the files underneath them
+            self._close_arrays()
+            for name in written:
+                os.replace(os.path.join(self.directory, f"{name}.bin.tmp"), os.path.join(self.directory, f"{name}.bin"))
+            with open(os.path.join(self.directory, META_FILE + ".tmp"), "w", encoding="utf-8") as f:
+                json.dump({"examples": count, "features": len(features), "postings": len(postings)}, f)
+            os.replace(os.path.join(self.directory, META_FILE + ".tmp"), os.path.join(self.directory, META_FILE))
+            self._open_arrays()
+            self.base_count = count
+            self.delta = {}
+            self.delta_norms = {}
+            # the numpy copy goes too, or a new dead set of the same size would reuse the stale ids
+            self.dead = set()
+            self.dead_ids = ()
+
+    def _close_arrays(self):
+        for name in ARRAYS:
+            values = getattr(self, name)
+            if isinstance(values, memoryview):
+                values.release()
+            typecode, dtype = ARRAYS[name]
+            setattr(self, name, np.zeros(0, dtype=dtype) if np is not None else array(typecode))
+
+    # ADDING
+    def add(self, question: str, sql_query: str) -> bool:
+        """
+        Records a verified pair. Returns False when the same question with
+        the same SQL is already stored.
+        """
+        key = normalize_question(question)
+        if not key:
+            return False
+        with self.lock:
+            previous = self.keys.get(key)
+            if previous is not None and self.get(previous)[1] == sql_query:
+                return False
+            line = json.dumps({"question": question, "sql": sql_query, "added_at": round(time.time(), 3)}, ensure_ascii=False)
+            self.reader.seek(0, os.SEEK_END)
+            position = self.reader.tell()
+            self.reader.write(line.encode("utf-8") + b"\n")
+            self.reader.flush()
+            number = len(self.positions)
+            self.positions.append(position)
+            self._register(number, key)
+            self._index_delta(number, question)
+            full = len(self.delta_norms) >= self.compact_every
+        if full:
+            self.compact()
+        return True
+
+    def add_many(self, pairs) -> int:
+        return sum(1 for question, sql_query in pairs if self.add(question, sql_query))
+
+    def get(self, number: int) -> tuple:
+        self.reader.seek(self.positions[number])
+        example = json.loads(self.reader.readline())
+        return example["question"], example["sql"]
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    # SEARCHING
+    def _postings(self, features: list) -> list:
+        # (base postings, delta postings) of each feature, base ones found with one binary search per feature
+        if np is not None:
+            where = np.searchsorted(self.features, np.asarray(features, dtype=np.int64)).tolist()
+        else:
+            where = [_bisect(self.features, feature) for feature in features]
+        found = []
+        for feature, i in zip(features, where):
+            base = ()
+            if i < len(self.features) and self.features[i] == feature:
+                base = self.postings[int(self.offsets[i]):int(self.offsets[i + 1])]
+            found.append((base, self.delta.get(feature, ())))
+        return found
+
+    def _norm(self, number: int) -> float:
+        return float(self.norms[number]) if number < self.base_count else self.delta_norms.get(number, 0.0)
+
+    def _best(self, selected: list, scale: float, k: int) -> list:
+        # top `k` (similarity, example number): IDF summed over shared features, times both norms
+        if np is None:
+            totals = {}
+            for base, delta, idf in selected:
+                for number in list(base) + list(delta):
+                    totals[number] = totals.get(number, 0.0) + idf
+            return heapq.nlargest(k, ((total * scale * self._norm(n), n) for n, total in totals.items() if n not in self.dead))
+        numbers = np.concatenate([np.asarray(part, dtype=np.int64) for base, delta, _ in selected for part in (base, delta)])
+        weights = np.concatenate([np.full(len(base) + len(delta), idf) for base, delta, idf in selected])
+        unique, inverse = np.unique(numbers, return_inverse=True)
+        similarity = np.bincount(inverse, weights=weights) * scale
+        indexed = unique < self.base_count
+        similarity[indexed] *= self.norms[unique[indexed]]
+        if not indexed.all():
+            similarity[~indexed] *= [self.delta_norms.get(n, 0.0) for n in unique[~indexed].tolist()]
+        if self.dead:
+            if len(self.dead_ids) != len(self.dead):
+                self.dead_ids = np.fromiter(self.dead, dtype=np.int64, count=len(self.dead))
+            similarity[np.isin(unique, self.dead_ids)] = 0.0
+        top = np.argpartition(-similarity, k)[:k] if len(similarity) > k else np.arange(len(similarity))
+        top = top[np.argsort(-similarity[top])]
+        return list(zip(similarity[top].tolist(), unique[top].tolist()))
+
+    def search(self, question: str, k: int = DEFAULT_FEW_SHOT, min_similarity: float = MIN_SIMILARITY) -> list:
+        """
+        Up to `k` (question, sql, similarity) of the most similar stored
+        examples, best first. Similarity is the IDF-weighted share of the
+        question's n-grams an example has, scaled down for longer examples;
+        1.0 for the same wording.
+        """
+        started = time.perf_counter()
+        features = question_features(question)
+        if not features or not self.keys:
+            return []
+        with self.lock:
+            total = len(self.positions)
+            candidates = []
+            for base, delta in self._postings(features):
+                if len(base) or len(delta):
+                    candidates.append((len(base) + len(delta), base, delta))
+            candidates.sort(key=lambda c: c[0])
+            selected = []
+            budget = self.posting_budget
+            query_weight = 0.0
+            for df, base, delta in candidates:
+                # features past the budget are left out of the match and of the query's weight alike
+                if df > budget and selected:
+                    break
+                idf = math.log(1.0 + total / df)
+                query_weight += idf
+                selected.append((base, delta, idf))
+                budget -= df
+            # unseen features still count in the query's weight, they make a match less exact
+            query_weight += (len(features) - len(candidates)) * math.log(1.0 + total)
+            # share of the query's weight matched, scaled down for examples with more features than the query
+            best = self._best(selected, math.sqrt(len(features)) / query_weight, k)
+            results = []
+            for similarity, number in best:
+                if similarity < max(min_similarity, 1e-9):
+                    break
+                results.append((*self.get(number), round(min(1.0, similarity), 4)))
+        self.searches += 1
+        self.search_seconds += time.perf_counter() - started
+        return results
+
+    def stats(self) -> dict:
+        return {
+            "examples": len(self.keys),
+            "indexed": self.base_count,
+            "pending": len(self.delta_norms),
+            "searches": self.searches,
+            "search_us_avg": round(self.search_seconds / self.searches * 1e6, 1) if self.searches else 0.0,
+            "numpy": np is not None,
+        }
+
+    def close(self):
+        self._close_arrays()
+        self.reader.close()
+
+
+def bootstrap(index: ExampleIndex, cache_path: str = CACHE_DB_PATH) -> int:
+    # an empty index starts from the question cache, which only holds SQL that ran
+    if len(index) or not os.path.exists(cache_path):
+        return 0
+    from sql_templates import cached_pairs
+
+    added = index.add_many(cached_pairs(cache_path))
+    index.compact()
+    return added
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Few-shot example index: verified (question, SQL) pairs")
+    parser.add_argument("action", choices=["add", "import", "search", "compact", "stats", "bench"])
+    parser.add_argument("text", nargs="*", help="add: QUESTION SQL, search: QUESTION, import: a JSONL file of question/sql objects")
+    parser.add_argument("--dir", default=EXAMPLES_DIR)
+    parser.add_argument("--k", type=int, default=DEFAULT_FEW_SHOT)
+    parser.add_argument("--cache", default=CACHE_DB_PATH, help="question cache to import when the index is empty (import without a file)")
+    parser.add_argument("--count", type=int, default=100000, help="bench: synthetic examples to index")
+    args = parser.parse_args()
+
+    if args.action == "bench":
+        return bench(args.dir, args.count, args.k)
+    index = ExampleIndex(args.dir)
+    try:
+        if args.action == "add":
+            print("added" if index.add(args.text[0], " ".join(args.text[1:])) else "already stored")
+        elif args.action == "import":
+            if args.text:
+                with open(args.text[0], "r", encoding="utf-8") as f:
+                    added = index.add_many((row["question"], row["sql"]) for row in map(json.loads, f) if row.get("sql"))
+                index.compact()
+            else:
+                added = bootstrap(index, args.cache)
+            print(f"imported {added} examples")
+        elif args.action == "search":
+            for question, sql_query, similarity in index.search(" ".join(args.text), args.k, min_similarity=0.0):
+                print(f"{similarity:.3f}  {question}\n       {sql_query}")
+        elif args.action == "compact":
+            index.compact()
+        print(index.stats())
+    finally:
+        index.close()
+
+
+def bench(directory: str, count: int, k: int):
+    # synthetic ERP-like questions, then timed searches against the compacted index
+    import random
+
+    rng = random.Random(7)
+    subjects = ["open bills", "purchase orders", "sales orders", "assets", "asset transactions", "items", "customers",
+                "vendors", "locations", "po lines", "invoices", "shipments", "repairs", "transfers"]
+    shapes = ["total {s} for vendor {n}", "how many {s} at site S{n:04d}", "list {s} created in 2024-{m:02d}",
+              "top {n} customers by {s}", "average cost of {s} per category", "{s} moved to location L{n:05d}",
+              "which {s} are overdue for customer {n}", "monthly {s} revenue for item I{n:05d}"]
+    index = ExampleIndex(directory, compact_every=count + 1)
+    started = time.perf_counter()
+    for i in range(count):
+        subject, shape = rng.choice(subjects), rng.choice(shapes)
+        index.add(shape.format(s=subject, n=rng.randint(1, 5000), m=rng.randint(1, 12)), f"SELECT {i}")
+    index.compact()
+    print(f"indexed {len(index)} examples in {time.perf_counter() - started:.1f}s")
+    queries = [rng.choice(shapes).format(s=rng.choice(subjects), n=rng.randint(1, 5000), m=rng.randint(1, 12)) for _ in range(2000)]
+    started = time.perf_counter()
+    for question in queries:
+        index.search(question, k)
+    seconds = time.perf_counter() - started
+    print(f"{len(queries)} searches, {seconds / len(queries) * 1e6:.0f} us each (numpy: {np is not None})")
+    index.close()
+
+
+if __name__ == "__main__":
+    main()
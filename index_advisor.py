@@ -0,0 +1,267 @@
+import argparse
+import os
+import re
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+from contextlib import closing
+
+from cost_gate import alias_map
+from sqlite_seed import DB_PATH
+
+
+QUERY_LOG_PATH = "query_log.db"
+
+QUERY_LOG_SQL = """
+CREATE TABLE IF NOT EXISTS QueryLog (
+    LogId       INTEGER PRIMARY KEY AUTOINCREMENT,
+    SqlQuery    TEXT NOT NULL,
+    SqlKey      TEXT NOT NULL,
+    Seconds     REAL NOT NULL,
+    RowCount    INTEGER NOT NULL,
+    LoggedAt    TEXT NOT NULL DEFAULT (datetime('now'))
+);
+
+CREATE INDEX IF NOT EXISTS IX_QueryLog_SqlKey ON QueryLog (SqlKey);
+"""
+
+PREDICATE_PATTERN = r"(?:\s*(?:=|<|>|<=|>=|<>|!=)|\s+(?:IN|LIKE|BETWEEN|IS|NOT)\b)"
+
+
+def normalize_sql(sql_query: str) -> str:
+    # literals become ? so "Status = 'Open'" and "Status = 'Closed'" count as one shape
+    text = re.sub(r"'(?:[^']|'')*'", "?", sql_query)
+    text = re.sub(r"\b\d+(?:\.\d+)?\b", "?", text)
+    text = re.sub(r"\s+", " ", text)
+    return text.strip().rstrip(";").lower()
+
+
+class QueryLog:
+    """
+    Append-only log of executed queries with their timing, in its own SQLite
+    file so the read-only ERP connection never writes. Safe to call from the
+    server's worker threads.
+    """
+
+    def __init__(self, path: str = QUERY_LOG_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.executescript(QUERY_LOG_SQL)
+
+    def record(self, sql_query: str, seconds: float, row_count: int):
+        with self.lock:
+            self.conn.execute(
+                "INSERT INTO QueryLog (SqlQuery, SqlKey, Seconds, RowCount) VALUES (?, ?, ?, ?)",
+                (sql_query, normalize_sql(sql_query), seconds, row_count),
+            )
+            self.conn.commit()
+
+    def workload(self, limit: int = 200) -> list:
+        # one representative query per shape, weighted by how often the shape ran
+        with self.lock:
+            return self.conn.execute(
+                """
+                SELECT MAX(SqlQuery), COUNT(*), AVG(Seconds)
+                FROM QueryLog
+                GROUP BY SqlKey
+                ORDER BY COUNT(*) * AVG(Seconds) DESC
+                LIMIT ?
+                """,
+                (limit,),
+            ).fetchall()
+
+    def close(self):
+        self.conn.close()
+
+
+def existing_index_leads(conn: sqlite3.Connection, table: str) -> set:
+    leads = set()
+    for index in conn.execute(f'PRAGMA index_list("{table}")').fetchall():
+        cols = conn.execute(f'PRAGMA index_info("{index[1]}")').fetchall()
+        if cols:
+            leads.add(cols[0][2])
+    for col in conn.execute(f'PRAGMA table_info("{table}")').fetchall():
+        if col[5] == 1 and col[2].upper() == "INTEGER":
+            leads.add(col[1])
+    return leads
+
+
+def candidate_indexes(conn: sqlite3.Connection, workload: list) -> list:
+    """
+    Single-column candidates: columns the workload filters, joins, groups or
+    sorts on that no existing index leads with, plus unindexed FK columns of
+    tables the workload touches.
+    """
+    columns = {}
+    for (table,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'"):
+        columns[table] = [col[1] for col in conn.execute(f'PRAGMA table_info("{table}")').fetchall()]
+    candidates = set()
+    for sql_query, _, _ in workload:
+        aliases = alias_map(sql_query)
+        for table in {t for t in aliases.values() if t in columns}:
+            leads = existing_index_leads(conn, table)
+            fk_columns = {fk[3] for fk in conn.execute(f'PRAGMA foreign_key_list("{table}")').fetchall()}
+            for col in columns[table]:
+                if col in leads:
+                    continue
+                used = re.search(rf"\b{col}\b{PREDICATE_PATTERN}", sql_query, re.IGNORECASE) or re.search(
+                    rf"(?:=|\bBY\b[^;]*?)\s*(?:\w+\.)?{col}\b", sql_query, re.IGNORECASE
+                )
+                if used or col in fk_columns and re.search(rf"\b{col}\b", sql_query, re.IGNORECASE):
+                    candidates.add((table, col))
+    return sorted(candidates)
+
+
+def index_name(table: str, column: str) -> str:
+    return f"IX_{table}_{column}"
+
+
+def time_query(conn: sqlite3.Connection, sql_query: str, repeats: int, time_budget: float) -> float:
+    deadline = [0.0]
+    conn.set_progress_handler(lambda: 1 if time.monotonic() > deadline[0] else 0, 1000)
+    runs = []
+    try:
+        for _ in range(repeats):
+            deadline[0] = time.monotonic() + time_budget
+            started = time.perf_counter()
+            try:
+                for _ in conn.execute(sql_query):
+                    pass
+            except sqlite3.OperationalError:
+                # interrupted or invalid: count it as the whole budget
+                runs.append(time_budget)
+                continue
+            runs.append(time.perf_counter() - started)
+    finally:
+        conn.set_progress_handler(None, 0)
+    return statistics.median(runs)
+
+
+def plan_uses(conn: sqlite3.Connection, sql_query: str, name: str) -> bool:
+    try:
+        plan = conn.execute(f"EXPLAIN QUERY PLAN {sql_query}").fetchall()
+    except sqlite3.Error:
+        return False
+    return any(name in row[3] for row in plan)
+
+
+def index_bytes(conn: sqlite3.Connection, name: str, table: str, column: str) -> int:
+    try:
+        size = conn.execute("SELECT SUM(pgsize) FROM dbstat WHERE name = ?", (name,)).fetchone()[0]
+        if size:
+            return size
+    except sqlite3.OperationalError:
+        pass
+    # no dbstat: rows x (average key width + rowid + cell overhead)
+    rows, width = conn.execute(f'SELECT COUNT(*), AVG(LENGTH("{column}")) FROM "{table}"').fetchone()
+    return int(rows * ((width or 8) + 12))
+
+
+def advise(db_path: str, workload: list, repeats: int = 3, time_budget: float = 2.0) -> list:
+    """
+    Replays the workload on a scratch copy of the database, once per candidate
+    index, and returns one dict per candidate with the weighted seconds saved
+    per workload pass, index bytes and the saving per MB, best first.
+    """
+    scratch_dir = tempfile.mkdtemp(prefix="index_advisor_")
+    scratch_path = os.path.join(scratch_dir, "scratch.db")
+    src = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        src.execute("VACUUM INTO ?", (scratch_path,))
+    finally:
+        src.close()
+    conn = sqlite3.connect(scratch_path)
+    try:
+        baseline = {sql: time_query(conn, sql, repeats, time_budget) for sql, _, _ in workload}
+        report = []
+        for table, column in candidate_indexes(conn, workload):
+            name = index_name(table, column)
+            conn.execute(f'CREATE INDEX "{name}" ON "{table}" ("{column}")')
+            saved = 0.0
+            used_by = 0
+            for sql_query, runs, _ in workload:
+                if table not in alias_map(sql_query).values():
+                    continue
+                if not plan_uses(conn, sql_query, name):
+                    continue
+                used_by += runs
+                saved += runs * (baseline[sql_query] - time_query(conn, sql_query, repeats, time_budget))
+            size = index_bytes(conn, name, table, column)
+            conn.execute(f'DROP INDEX "{name}"')
+            report.append({
+                "index": name,
+                "table": table,
+                "column": column,
+                "used_by_runs": used_by,
+                "seconds_saved": round(saved, 6),
+                "bytes": size,
+                "saved_per_mb": round(saved / max(size / 1_048_576, 1e-6), 6),
+            })
+        report.sort(key=lambda r: (-r["saved_per_mb"], r["index"]))
+        return report
+    finally:
+        conn.close()
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(scratch_path + suffix):
+                os.remove(scratch_path + suffix)
+        os.rmdir(scratch_dir)
+
+
+def choose(report: list, max_indexes: int, max_bytes: int) -> list:
+    chosen = []
+    total = 0
+    for entry in report:
+        if entry["seconds_saved"] <= 0 or not entry["used_by_runs"]:
+            continue
+        if len(chosen) >= max_indexes or total + entry["bytes"] > max_bytes:
+            break
+        chosen.append(entry)
+        total += entry["bytes"]
+    return chosen
+
+
+def apply_indexes(db_path: str, chosen: list):
+    # the inner with commits, closing() releases the file
+    with closing(sqlite3.connect(db_path)) as conn, conn:
+        for entry in chosen:
+            conn.execute(f'CREATE INDEX IF NOT EXISTS "{entry["index"]}" ON "{entry["table"]}" ("{entry["column"]}")')
+        conn.execute("ANALYZE")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recommend indexes for the logged agent workload")
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--log", default=QUERY_LOG_PATH)
+    parser.add_argument("--max-indexes", type=int, default=5)
+    parser.add_argument("--max-mb", type=float, default=256.0, help="total size allowed for new indexes")
+    parser.add_argument("--repeats", type=int, default=3, help="timed runs per query, the median is used")
+    parser.add_argument("--apply", action="store_true", help="create the recommended indexes on --db")
+    args = parser.parse_args()
+
+    log = QueryLog(args.log)
+    workload = log.workload()
+    log.close()
+    if not workload:
+        print(f"No queries logged in {args.log} yet.")
+        return
+    report = advise(args.db, workload, repeats=args.repeats)
+    chosen = choose(report, args.max_indexes, int(args.max_mb * 1_048_576))
+    print(f"{len(workload)} query shapes, {len(report)} candidate indexes")
+    for entry in report:
+        mark = "*" if entry in chosen else " "
+        print(
+            f"{mark} {entry['index']:<40} used by {entry['used_by_runs']:>5} runs  "
+            f"saves {entry['seconds_saved']:.4f}s  {entry['bytes'] / 1024:.1f} KiB"
+        )
+    for entry in chosen:
+        print(f'CREATE INDEX {entry["index"]} ON {entry["table"]} ({entry["column"]});')
+    if args.apply and chosen:
+        apply_indexes(args.db, chosen)
+        print(f"Applied {len(chosen)} index(es) to {args.db}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+import asyncio
+import os
+import random
+import time
+
+from query_cache import normalize_question
+
+
+DEFAULT_MODEL_NAME = "gemini-2.5-flash"
+
+_gemini_configured = False
+
+
+def configure_gemini():
+    # loads GOOGLE_API_KEY from .env once per process
+    global _gemini_configured
+    if _gemini_configured:
+        return
+    import google.generativeai as genai
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
+    _gemini_configured = True
+
+
+class GeminiChat:
+    def __init__(self, chat):
+        self.chat = chat
+
+    @property
+    def history(self):
+        return self.chat.history
+
+    def send_message(self, text: str) -> str:
+        return self.chat.send_message(text).text
+
+    async def send_message_async(self, text: str) -> str:
+        response = await self.chat.send_message_async(text)
+        return response.text
+
+
+class GeminiBackend:
+    """
+    Backend on top of google.generativeai. All backends expose the same
+    methods (start_chat, generate, generate_stream, generate_async) so the
+    pipeline can run against FakeBackend without network access.
+    """
+
+    def __init__(self, system_instruction: str, model_name: str = DEFAULT_MODEL_NAME):
+        configure_gemini()
+        import google.generativeai as genai
+
+        self.model_name = model_name
+        self.model = genai.GenerativeModel(model_name=model_name, system_instruction=system_instruction)
+
+    def start_chat(self, history=None) -> GeminiChat:
+        return GeminiChat(self.model.start_chat(history=history or []))
+
+    def generate(self, prompt: str) -> str:
+        return self.model.generate_content(prompt).text
+
+    def generate_stream(self, prompt: str):
+        for chunk in self.model.generate_content(prompt, stream=True):
+            if chunk.text:
+                yield chunk.text
+
+    async def generate_async(self, prompt: str) -> str:
+        response = await self.model.generate_content_async(prompt)
+        return response.text
+
+
+def extract_question(prompt: str) -> str:
+    # retrieval messages end with "Question: ...", explanation prompts carry "User question: ..."
+    for marker in ("\nQuestion:", "User question:"):
+        if marker in prompt:
+            return prompt.rsplit(marker, 1)[1].strip().splitlines()[0]
+    return prompt
+
+
+class FakeChat:
+    def __init__(self, backend, history=None):
+        self.backend = backend
+        self.history = list(history or [])
+
+    def send_message(self, text: str) -> str:
+        reply = self.backend.generate(text)
+        self.history.append({"role": "user", "parts": [text]})
+        self.history.append({"role": "model", "parts": [reply]})
+        return reply
+
+    async def send_message_async(self, text: str) -> str:
+        reply = await self.backend.generate_async(text)
+        self.history.append({"role": "user", "parts": [text]})
+        self.history.append({"role": "model", "parts": [reply]})
+        return reply
+
+
+class FakeBackend:
+    """
+    Deterministic local stand-in for GeminiBackend. `responses` maps questions
+    (normalized on lookup) to canned replies; anything else gets `default`,
+    which may also be a callable taking the prompt. `latency` seconds are
+    slept per call to simulate the network round trip.
+    """
+
+    def __init__(self, responses: dict = None, default="SELECT 1", latency: float = 0.0, model_name: str = "fake"):
+        self.responses = {normalize_question(q): r for q, r in (responses or {}).items()}
+        self.default = default
+        self.latency = latency
+        self.model_name = model_name
+        self.calls = 0
+
+    def reply_for(self, prompt: str) -> str:
+        self.calls += 1
+        reply = self.responses.get(normalize_question(extract_question(prompt)))
+        if reply is not None:
+            return reply
+        return self.default(prompt) if callable(self.default) else self.default
+
+    def start_chat(self, history=None) -> FakeChat:
+        return FakeChat(self, history)
+
+    def generate(self, prompt: str) -> str:
+        if self.latency:
+            time.sleep(self.latency)
+        return self.reply_for(prompt)
+
+    def generate_stream(self, prompt: str):
+        reply = self.generate(prompt)
+        for start in range(0, len(reply), 16):
+            yield reply[start:start + 16]
+
+    async def generate_async(self, prompt: str) -> str:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self.reply_for(prompt)
+
+
+# names of google.api_core exceptions worth retrying, matched by name so this module doesn't need google installed
+RETRYABLE_ERRORS = {"ResourceExhausted", "TooManyRequests", "ServiceUnavailable", "DeadlineExceeded", "InternalServerError"}
+
+
+def is_retryable(error: BaseException) -> bool:
+    return isinstance(error, (ConnectionError, asyncio.TimeoutError)) or type(error).__name__ in RETRYABLE_ERRORS
+
+
+class TokenBucket:
+    """
+    Async token bucket: `rate` calls per second on average, bursts of up to
+    `capacity`. acquire() waits until a token is available.
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.waited = 0.0
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                delay = (1 - self.tokens) / self.rate
+                self.waited += delay
+                await asyncio.sleep(delay)
+
+
+class RetryPolicy:
+    def __init__(self, max_retries: int = 5, base_delay: float = 1.0, max_delay: float = 60.0):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retries = 0
+
+    def delay(self, attempt: int) -> float:
+        # full jitter: uniform in [0, base * 2^attempt], capped
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    async def run(self, call):
+        attempt = 0
+        while True:
+            try:
+                return await call()
+            except Exception as e:
+                if attempt >= self.max_retries or not is_retryable(e):
+                    raise
+                self.retries += 1
+                await asyncio.sleep(self.delay(attempt))
+                attempt += 1
+
+
+class LimitedChat:
+    def __init__(self, chat, backend):
+        self.chat = chat
+        self.backend = backend
+
+    @property
+    def history(self):
+        return self.chat.history
+
+    async def send_message_async(self, text: str) -> str:
+        return await self.backend.call(lambda: self.chat.send_message_async(text))
+
+
+class LimitedBackend:
+    """
+    Wraps a backend's async calls with a shared TokenBucket (the API quota)
+    and a RetryPolicy for rate-limit and transient server errors.
+    """
+
+    def __init__(self, backend, bucket: TokenBucket, retry: RetryPolicy = None):
+        self.backend = backend
+        self.bucket = bucket
+        self.retry = retry or RetryPolicy()
+        self.model_name = backend.model_name
+
+    async def call(self, make_call):
+        async def attempt():
+            await self.bucket.acquire()
+            return await make_call()
+
+        return await self.retry.run(attempt)
+
+    def start_chat(self, history=None) -> LimitedChat:
+        return LimitedChat(self.backend.start_chat(history), self)
+
+    async def generate_async(self, prompt: str) -> str:
+        return await self.call(lambda: self.backend.generate_async(prompt))
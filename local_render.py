@@ -0,0 +1,101 @@
+import re
+
+
+MAX_LOCAL_ROWS = 20
+MAX_ROW_COLUMNS = 8
+# questions asking for reasoning rather than a lookup still go to the model
+ANALYSIS_WORDS = re.compile(
+    r"\b(why|explain|compare|comparison|trend|trends|insight|insights|analy[sz]e|analysis|summari[sz]e|recommend|should|pattern|patterns)\b",
+    re.IGNORECASE,
+)
+AGGREGATE_PATTERN = re.compile(r"\b(count|sum|avg|min|max|total)\s*\(", re.IGNORECASE)
+
+
+def column_label(name: str) -> str:
+    # "TotalAmount" -> "total amount", "OpenPOs" -> "open POs", "COUNT(*)" -> "count"
+    if "(" in name:
+        return name.split("(", 1)[0].strip().lower() or "result"
+    words = re.findall(r"[A-Z]{2,}s?(?![a-z])|[A-Z]?[a-z]+|\d+", name)
+    if not words or not any(w.isalpha() for w in words):
+        return "result"
+    return " ".join(w if w[:2].isupper() else w.lower() for w in words)
+
+
+def format_value(value) -> str:
+    if value is None:
+        return "-"
+    if isinstance(value, bool):
+        return str(value)
+    if isinstance(value, int):
+        return f"{value:,}"
+    if isinstance(value, float):
+        return f"{value:,.0f}" if value.is_integer() else f"{value:,.2f}"
+    if isinstance(value, bytes):
+        return f"<{len(value)} bytes>"
+    return str(value)
+
+
+def result_shape(sql_query: str, columns: list, row_count: int) -> str:
+    """
+    Classifies a result by what it looks like: "empty", "scalar" (1x1),
+    "row" (one record), "grouped" (a small label -> aggregate table), "list"
+    (a few short rows) or "large" when nothing local would read well.
+    """
+    if not row_count:
+        return "empty"
+    if row_count == 1 and len(columns) == 1:
+        return "scalar"
+    if row_count == 1 and len(columns) <= MAX_ROW_COLUMNS:
+        return "row"
+    if row_count > MAX_LOCAL_ROWS:
+        return "large"
+    if len(columns) == 2 and re.search(r"\bGROUP\s+BY\b", sql_query, re.IGNORECASE) and AGGREGATE_PATTERN.search(sql_query):
+        return "grouped"
+    if len(columns) <= 4:
+        return "list"
+    return "large"
+
+
+def render_result(shape: str, columns: list, rows: list, row_count: int) -> str:
+    # `rows` must hold every row for the shapes rendered here (at most MAX_LOCAL_ROWS)
+    if shape == "scalar":
+        return f"The {column_label(columns[0])} is {format_value(rows[0][0])}."
+    if shape == "row":
+        return "Found one record:\n" + "\n".join(
+            f"- {column_label(col)}: {format_value(value)}" for col, value in zip(columns, rows[0])
+        )
+    if shape == "grouped":
+        label = column_label(columns[1])
+        lines = [f"{label.capitalize()} by {column_label(columns[0])} ({row_count} groups):"]
+        lines.extend(f"- {format_value(key)}: {format_value(value)}" for key, value in rows)
+        return "\n".join(lines)
+    if shape == "list":
+        lines = [f"Found {row_count} records:"]
+        if len(columns) == 1:
+            lines.extend(f"- {format_value(row[0])}" for row in rows)
+        else:
+            lines.extend("- " + ", ".join(f"{column_label(c)} {format_value(v)}" for c, v in zip(columns, row)) for row in rows)
+        return "\n".join(lines)
+    raise ValueError(f"no local rendering for shape {shape!r}")
+
+
+class ExplanationPolicy:
+    """
+    Decides per turn whether the explanation model is worth a round trip.
+    mode "auto" renders scalars, single rows, small grouped aggregates and
+    short lists locally unless the question asks for analysis; "llm" always
+    calls the model; "local" never does, unless the result has no local shape.
+    """
+
+    def __init__(self, mode: str = "auto"):
+        if mode not in ("auto", "llm", "local"):
+            raise ValueError(f"unknown explanation mode {mode!r}")
+        self.mode = mode
+        self.stats = {"local": 0, "llm": 0}
+
+    def explain_locally(self, question: str, shape: str) -> bool:
+        local = shape not in ("empty", "large") and (
+            self.mode == "local" or self.mode == "auto" and not ANALYSIS_WORDS.search(question)
+        )
+        self.stats["local" if local else "llm"] += 1
+        return local
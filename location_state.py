@@ -0,0 +1,235 @@
+import argparse
+import re
+import sqlite3
+import time
+
+from sqlite_seed import DB_PATH
+
+
+CLOSURE_TABLE = "LocationClosure"
+SNAPSHOT_TABLE = "AssetCurrentLocation"
+
+LOCATION_STATE_SQL = """
+CREATE TABLE IF NOT EXISTS LocationClosure (
+    AncestorId    INTEGER NOT NULL,
+    DescendantId  INTEGER NOT NULL,
+    Depth         INTEGER NOT NULL,
+    PRIMARY KEY (AncestorId, DescendantId)
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS IX_LocationClosure_DescendantId ON LocationClosure (DescendantId, Depth);
+
+CREATE TABLE IF NOT EXISTS AssetCurrentLocation (
+    AssetId     INTEGER PRIMARY KEY,
+    LocationId  INTEGER NOT NULL,
+    AssetTxnId  INTEGER NOT NULL,
+    TxnDate     TEXT NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS IX_AssetCurrentLocation_LocationId ON AssetCurrentLocation (LocationId);
+
+-- recomputing one asset after a delete or update needs its transactions by asset
+CREATE INDEX IF NOT EXISTS IX_AssetTransactions_AssetId ON AssetTransactions (AssetId);
+"""
+
+# the subtree of a location, used by the move and delete triggers below
+SUBTREE = "SELECT DescendantId FROM LocationClosure WHERE AncestorId = {row}.LocationId"
+
+LOCATION_STATE_TRIGGERS = f"""
+CREATE TRIGGER IF NOT EXISTS TR_LocationClosure_Insert AFTER INSERT ON Locations BEGIN
+    INSERT INTO LocationClosure (AncestorId, DescendantId, Depth) VALUES (NEW.LocationId, NEW.LocationId, 0);
+    INSERT INTO LocationClosure (AncestorId, DescendantId, Depth)
+        SELECT AncestorId, NEW.LocationId, Depth + 1 FROM LocationClosure WHERE DescendantId = NEW.ParentLocationId;
+END;
+
+CREATE TRIGGER IF NOT EXISTS TR_LocationClosure_NoCycle BEFORE UPDATE OF ParentLocationId ON Locations
+WHEN NEW.ParentLocationId IN ({SUBTREE.format(row="NEW")})
+BEGIN
+    SELECT RAISE(ABORT, 'a location cannot be moved under itself');
+END;
+
+CREATE TRIGGER IF NOT EXISTS TR_LocationClosure_Move AFTER UPDATE OF ParentLocationId ON Locations
+WHEN NEW.ParentLocationId IS NOT OLD.ParentLocationId
+BEGIN
+    DELETE FROM LocationClosure
+        WHERE DescendantId IN ({SUBTREE.format(row="NEW")})
+          AND AncestorId NOT IN ({SUBTREE.format(row="NEW")});
+    INSERT INTO LocationClosure (AncestorId, DescendantId, Depth)
+        SELECT above.AncestorId, below.DescendantId, above.Depth + below.Depth + 1
+        FROM LocationClosure above, LocationClosure below
+        WHERE above.DescendantId = NEW.ParentLocationId AND below.AncestorId = NEW.LocationId;
+END;
+
+CREATE TRIGGER IF NOT EXISTS TR_LocationClosure_Delete AFTER DELETE ON Locations BEGIN
+    DELETE FROM LocationClosure
+        WHERE DescendantId IN ({SUBTREE.format(row="OLD")})
+          AND AncestorId NOT IN ({SUBTREE.format(row="OLD")});
+    DELETE FROM LocationClosure WHERE AncestorId = OLD.LocationId OR DescendantId = OLD.LocationId;
+END;
+
+CREATE TRIGGER IF NOT EXISTS TR_AssetCurrentLocation_Insert AFTER INSERT ON AssetTransactions
+WHEN NEW.ToLocationId IS NOT NULL
+BEGIN
+    INSERT INTO AssetCurrentLocation (AssetId, LocationId, AssetTxnId, TxnDate)
+        VALUES (NEW.AssetId, NEW.ToLocationId, NEW.AssetTxnId, NEW.TxnDate)
+        ON CONFLICT (AssetId) DO UPDATE SET
+            LocationId = excluded.LocationId, AssetTxnId = excluded.AssetTxnId, TxnDate = excluded.TxnDate
+        -- back-dated transactions don't replace a later one
+        WHERE (excluded.TxnDate, excluded.AssetTxnId) > (TxnDate, AssetTxnId);
+END;
+
+CREATE TRIGGER IF NOT EXISTS TR_AssetCurrentLocation_Delete AFTER DELETE ON AssetTransactions BEGIN
+    DELETE FROM AssetCurrentLocation WHERE AssetId = OLD.AssetId;
+    INSERT INTO AssetCurrentLocation (AssetId, LocationId, AssetTxnId, TxnDate)
+        SELECT AssetId, ToLocationId, AssetTxnId, TxnDate FROM AssetTransactions
+        WHERE AssetId = OLD.AssetId AND ToLocationId IS NOT NULL
+        ORDER BY TxnDate DESC, AssetTxnId DESC LIMIT 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS TR_AssetCurrentLocation_Update AFTER UPDATE OF AssetId, ToLocationId, TxnDate ON AssetTransactions BEGIN
+    DELETE FROM AssetCurrentLocation WHERE AssetId IN (OLD.AssetId, NEW.AssetId);
+    INSERT INTO AssetCurrentLocation (AssetId, LocationId, AssetTxnId, TxnDate)
+        SELECT AssetId, ToLocationId, AssetTxnId, TxnDate FROM (
+            SELECT AssetId, ToLocationId, AssetTxnId, TxnDate,
+                   ROW_NUMBER() OVER (PARTITION BY AssetId ORDER BY TxnDate DESC, AssetTxnId DESC) AS Rank
+            FROM AssetTransactions
+            WHERE AssetId IN (OLD.AssetId, NEW.AssetId) AND ToLocationId IS NOT NULL
+        ) WHERE Rank = 1;
+END;
+"""
+
+CLOSURE_QUERY = """
+WITH RECURSIVE closure(AncestorId, DescendantId, Depth) AS (
+    SELECT LocationId, LocationId, 0 FROM Locations
+    UNION ALL
+    SELECT c.AncestorId, l.LocationId, c.Depth + 1
+    FROM closure c JOIN Locations l ON l.ParentLocationId = c.DescendantId
+)
+SELECT AncestorId, DescendantId, Depth FROM closure
+"""
+
+SNAPSHOT_QUERY = """
+SELECT AssetId, ToLocationId, AssetTxnId, TxnDate FROM (
+    SELECT AssetId, ToLocationId, AssetTxnId, TxnDate,
+           ROW_NUMBER() OVER (PARTITION BY AssetId ORDER BY TxnDate DESC, AssetTxnId DESC) AS Rank
+    FROM AssetTransactions
+    WHERE ToLocationId IS NOT NULL
+) WHERE Rank = 1
+"""
+
+
+def installed(conn: sqlite3.Connection) -> bool:
+    names = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    return CLOSURE_TABLE in names and SNAPSHOT_TABLE in names
+
+
+def install(conn: sqlite3.Connection) -> dict:
+    """
+    Creates the closure table and the current-location snapshot, backfills
+    both from the base tables and adds the triggers that keep them current.
+    Returns seconds per step.
+    """
+    timings = {}
+    with conn:
+        started = time.perf_counter()
+        conn.executescript(LOCATION_STATE_SQL)
+        timings["indexes"] = round(time.perf_counter() - started, 4)
+        started = time.perf_counter()
+        conn.execute(f"DELETE FROM {CLOSURE_TABLE}")
+        conn.execute(f"INSERT INTO {CLOSURE_TABLE} (AncestorId, DescendantId, Depth) {CLOSURE_QUERY}")
+        timings[CLOSURE_TABLE] = round(time.perf_counter() - started, 4)
+        started = time.perf_counter()
+        conn.execute(f"DELETE FROM {SNAPSHOT_TABLE}")
+        conn.execute(f"INSERT INTO {SNAPSHOT_TABLE} (AssetId, LocationId, AssetTxnId, TxnDate) {SNAPSHOT_QUERY}")
+        timings[SNAPSHOT_TABLE] = round(time.perf_counter() - started, 4)
+        conn.executescript(LOCATION_STATE_TRIGGERS)
+    return timings
+
+
+def drop(conn: sqlite3.Connection):
+    with conn:
+        for (trigger,) in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'trigger' AND (name LIKE 'TR_LocationClosure_%' OR name LIKE 'TR_AssetCurrentLocation_%')"
+        ).fetchall():
+            conn.execute(f'DROP TRIGGER "{trigger}"')
+        conn.execute(f"DROP TABLE IF EXISTS {CLOSURE_TABLE}")
+        conn.execute(f"DROP TABLE IF EXISTS {SNAPSHOT_TABLE}")
+
+
+def check(conn: sqlite3.Connection) -> dict:
+    """
+    Recomputes both structures from Locations and AssetTransactions and
+    returns {table: number of rows that differ}, all zeros when in sync.
+    """
+    report = {}
+    for table, columns, query in (
+        (CLOSURE_TABLE, "AncestorId, DescendantId, Depth", CLOSURE_QUERY),
+        (SNAPSHOT_TABLE, "AssetId, LocationId, AssetTxnId, TxnDate", SNAPSHOT_QUERY),
+    ):
+        report[table] = conn.execute(
+            f"""
+            WITH fresh AS ({query})
+            SELECT (SELECT COUNT(*) FROM (SELECT * FROM fresh EXCEPT SELECT {columns} FROM {table}))
+                 + (SELECT COUNT(*) FROM (SELECT {columns} FROM {table} EXCEPT SELECT * FROM fresh))
+            """
+        ).fetchone()[0]
+    return report
+
+
+def location_digest(conn: sqlite3.Connection) -> str:
+    # compact description for the retrieval prompt, "" when not installed
+    if not installed(conn):
+        return ""
+    return "\n".join([
+        "Maintained location structures, prefer them over recursive CTEs and scanning AssetTransactions:",
+        "LocationClosure(AncestorId, DescendantId, Depth) -- every ancestor/descendant pair of Locations, "
+        "each location is its own ancestor at Depth 0. Everything under X: "
+        "JOIN LocationClosure c ON c.DescendantId = l.LocationId WHERE c.AncestorId = X.",
+        "AssetCurrentLocation(AssetId PK, LocationId, AssetTxnId, TxnDate) -- where each asset is now "
+        "(its latest transaction with a ToLocationId). Assets never moved are not listed, use Assets.LocationId.",
+    ])
+
+
+LOCATION_WORDS = re.compile(
+    r"\b(where|now|current|currently|under|inside|within|beneath|below|contain\w*|hierarchy|location\w*|warehouse\w*|aisle\w*|bins?|moved?)\b",
+    re.IGNORECASE,
+)
+
+
+def wants_location_state(question: str) -> bool:
+    return bool(LOCATION_WORDS.search(question))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Install, check or drop the location closure table and asset snapshot")
+    parser.add_argument("action", choices=["install", "check", "drop", "show"])
+    parser.add_argument("--db", default=DB_PATH)
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    try:
+        if args.action == "install":
+            for step, seconds in install(conn).items():
+                print(f"{step:<22} {seconds:.3f}s")
+            for table in (CLOSURE_TABLE, SNAPSHOT_TABLE):
+                print(f"{table:<22} {conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]} rows")
+        elif args.action == "check":
+            if not installed(conn):
+                print("Location state not installed.")
+                return
+            report = check(conn)
+            for table, differ in report.items():
+                print(f"{table:<22} {'OK' if not differ else f'{differ} rows differ'}")
+            if any(report.values()):
+                raise SystemExit(1)
+        elif args.action == "drop":
+            drop(conn)
+            print("Location state dropped.")
+        else:
+            print(location_digest(conn) or "Location state not installed.")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
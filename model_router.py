@@ -0,0 +1,302 @@
+import argparse
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+
+from query_cache import normalize_question
+from result_summary import estimate_tokens
+
+
+FAST_MODEL_NAME = "gemini-2.5-flash-lite"
+STRONG_MODEL_NAME = "gemini-2.5-pro"
+# USD per million (input, output) tokens, list prices; unknown models count as free
+MODEL_PRICES = {
+    "gemini-2.5-flash-lite": (0.10, 0.40),
+    "gemini-2.5-flash": (0.30, 2.50),
+    "gemini-2.5-pro": (1.25, 10.00),
+}
+DEFAULT_THRESHOLD = 4.0
+ROUTE_MODES = ("auto", "fast", "strong")
+AGGREGATION_WORDS = re.compile(
+    r"\b(total|sum|average|avg|mean|count|how many|number of|per|each|top|most|least|highest|lowest|"
+    r"max|maximum|min|minimum|rank|monthly|weekly|yearly|quarterly)\b"
+)
+# negation, comparison and set questions usually need subqueries or self joins
+HARD_WORDS = re.compile(
+    r"\b(not|never|without|no|except|both|either|compared?|versus|vs|than|ratio|percent|percentage|share|"
+    r"growth|trend|difference|between|previous|last year|year over year|cumulative|running)\b"
+)
+MAX_JOIN_POINTS = 4
+# a question naming no table gets an ordinary join count; escalation and the failure rate catch the hard ones
+UNMAPPED_JOIN_POINTS = 1
+FAILURE_WEIGHT = 4.0
+HISTORY_KEYS = 2000
+
+
+class TierStats:
+    # latency, tokens and estimated cost of the calls made on one tier
+    def __init__(self, prices: tuple, window: int = 1000):
+        self.prices = prices
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.errors = 0
+        self.seconds = 0.0
+        self.latencies = deque(maxlen=window)
+        self.input_tokens = 0
+        self.output_tokens = 0
+
+    def record(self, seconds: float, input_tokens: int, output_tokens: int, failed: bool = False):
+        with self.lock:
+            self.calls += 1
+            self.errors += failed
+            self.seconds += seconds
+            self.latencies.append(seconds)
+            self.input_tokens += input_tokens
+            self.output_tokens += output_tokens
+
+    @property
+    def cost(self) -> float:
+        return (self.input_tokens * self.prices[0] + self.output_tokens * self.prices[1]) / 1_000_000
+
+    def stats(self) -> dict:
+        with self.lock:
+            latencies = sorted(self.latencies)
+            stats = {
+                "calls": self.calls,
+                "errors": self.errors,
+                "input_tokens": self.input_tokens,
+                "output_tokens": self.output_tokens,
+                "cost_usd": round(self.cost, 6),
+                "latency_avg": round(self.seconds / self.calls, 4) if self.calls else 0.0,
+            }
+        stats["latency_p50"] = round(latencies[len(latencies) // 2], 4) if latencies else 0.0
+        stats["latency_p95"] = round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 4) if latencies else 0.0
+        return stats
+
+
+def history_tokens(history) -> int:
+    # chat history is resent with every message, so it counts as input
+    return sum(estimate_tokens(part) for turn in history or [] for part in turn.get("parts", []) if isinstance(part, str))
+
+
+class MeteredChat:
+    def __init__(self, chat, stats: TierStats, history_size: int):
+        self.chat = chat
+        self.stats = stats
+        self.context_tokens = history_size
+
+    @property
+    def history(self):
+        return self.chat.history
+
+    def _record(self, started: float, text: str, reply, failed: bool):
+        reply_tokens = estimate_tokens(reply) if isinstance(reply, str) else 0
+        self.stats.record(time.perf_counter() - started, self.context_tokens + estimate_tokens(text), reply_tokens, failed)
+        self.context_tokens += estimate_tokens(text) + reply_tokens
+
+    def send_message(self, text: str) -> str:
+        started = time.perf_counter()
+        reply = None
+        try:
+            reply = self.chat.send_message(text)
+            return reply
+        finally:
+            self._record(started, text, reply, reply is None)
+
+    async def send_message_async(self, text: str) -> str:
+        started = time.perf_counter()
+        reply = None
+        try:
+            reply = await self.chat.send_message_async(text)
+            return reply
+        finally:
+            self._record(started, text, reply, reply is None)
+
+
+class MeteredBackend:
+    """
+    Wraps any backend (GeminiBackend, FakeBackend, LimitedBackend, ...) and
+    records the latency and estimated tokens of every call into a TierStats.
+    Streams are recorded when they finish.
+    """
+
+    def __init__(self, backend, stats: TierStats):
+        self.backend = backend
+        self.stats = stats
+        self.model_name = backend.model_name
+
+    def start_chat(self, history=None) -> MeteredChat:
+        return MeteredChat(self.backend.start_chat(history), self.stats, history_tokens(history))
+
+    def _timed(self, prompt: str, call):
+        started = time.perf_counter()
+        reply = None
+        try:
+            reply = call()
+            return reply
+        finally:
+            self.stats.record(time.perf_counter() - started, estimate_tokens(prompt), estimate_tokens(reply or ""), reply is None)
+
+    def generate(self, prompt: str) -> str:
+        return self._timed(prompt, lambda: self.backend.generate(prompt))
+
+    def generate_stream(self, prompt: str):
+        started = time.perf_counter()
+        chunks = []
+        failed = True
+        try:
+            for chunk in self.backend.generate_stream(prompt):
+                chunks.append(chunk)
+                yield chunk
+            failed = False
+        finally:
+            self.stats.record(time.perf_counter() - started, estimate_tokens(prompt), estimate_tokens("".join(chunks)), failed)
+
+    async def generate_async(self, prompt: str) -> str:
+        started = time.perf_counter()
+        reply = None
+        try:
+            reply = await self.backend.generate_async(prompt)
+            return reply
+        finally:
+            self.stats.record(time.perf_counter() - started, estimate_tokens(prompt), estimate_tokens(reply or ""), reply is None)
+
+
+class Tier:
+    """
+    One model tier: a retrieval and an explanation backend sharing one
+    TierStats. `prices` is USD per million (input, output) tokens, taken from
+    MODEL_PRICES by the retrieval model's name when not given.
+    """
+
+    def __init__(self, name: str, retrieval, explanation, prices: tuple = None):
+        self.name = name
+        self.model_name = retrieval.model_name
+        self.stats = TierStats(prices or MODEL_PRICES.get(self.model_name, (0.0, 0.0)))
+        self.retrieval = MeteredBackend(retrieval, self.stats)
+        self.explanation = MeteredBackend(explanation, self.stats)
+        self.questions = 0
+
+
+class Route:
+    # where one question went and why; `key` groups similar questions for the failure history
+    def __init__(self, score: float, features: dict, key: str):
+        self.score = score
+        self.features = features
+        self.key = key
+        self.tier = None
+        self.escalated = False
+
+    def to_dict(self) -> dict:
+        return {"tier": self.tier.name, "score": round(self.score, 2), "escalated": self.escalated, **self.features}
+
+
+class ModelRouter:
+    """
+    Sends each question to the fast or the strong tier. The score adds up:
+    - joins the schema index implies for it (tables picked minus one, capped;
+      one when it names no table),
+    - entity values named in it (0.5 each),
+    - aggregation words ("total", "per", "top", ...),
+    - negation, comparison and trend words (1.5 each),
+    - the past failure rate of similar questions (same tables, same kind).
+    At `threshold` or above the question goes to the strong tier. SQL from the
+    fast tier that doesn't compile escalates to the strong tier (escalate()).
+    Without a strong tier every question stays on the fast one.
+    """
+
+    def __init__(self, fast: Tier, strong: Tier = None, schema_index=None, entities=None,
+                 threshold: float = DEFAULT_THRESHOLD, mode: str = "auto"):
+        if mode not in ROUTE_MODES:
+            raise ValueError(f"unknown routing mode {mode!r}, expected one of {', '.join(ROUTE_MODES)}")
+        self.fast = fast
+        self.strong = strong
+        self.schema_index = schema_index
+        self.entities = entities
+        self.threshold = threshold
+        self.mode = mode
+        self.lock = threading.Lock()
+        # similarity key -> [questions, failures], least recently used dropped first
+        self.history = OrderedDict()
+        self.escalations = 0
+
+    @property
+    def tiers(self) -> list:
+        return [self.fast] + ([self.strong] if self.strong is not None else [])
+
+    def failure_rate(self, key: str) -> float:
+        with self.lock:
+            seen, failed = self.history.get(key, (0, 0))
+        # one failure out of one question is a hint, not a certainty
+        return failed / (seen + 1)
+
+    def score(self, question: str) -> Route:
+        text = normalize_question(question)
+        features = {}
+        tables = []
+        if self.schema_index is not None:
+            named = self.schema_index.score_tables(question)
+            tables = sorted(named)
+            features["joins"] = min(MAX_JOIN_POINTS, len(self.schema_index.select_tables(question)) - 1) if named else UNMAPPED_JOIN_POINTS
+        if self.entities is not None:
+            _, spans = self.entities.find(text)
+            features["entities"] = sum(1 for _, _, candidates in spans if candidates[0][0] != "NUMBER")
+        features["aggregations"] = min(3, len(AGGREGATION_WORDS.findall(text)))
+        features["hard_words"] = len(HARD_WORDS.findall(text))
+        key = ",".join(tables) + ("|agg" if features["aggregations"] else "") + ("|hard" if features["hard_words"] else "")
+        features["failure_rate"] = round(self.failure_rate(key), 3)
+        score = (
+            features.get("joins", 0)
+            + 0.5 * features.get("entities", 0)
+            + features["aggregations"]
+            + 1.5 * features["hard_words"]
+            + FAILURE_WEIGHT * features["failure_rate"]
+        )
+        return Route(score, features, key)
+
+    def route(self, question: str) -> Route:
+        route = self.score(question)
+        if self.strong is None or self.mode == "fast":
+            route.tier = self.fast
+        elif self.mode == "strong":
+            route.tier = self.strong
+        else:
+            route.tier = self.strong if route.score >= self.threshold else self.fast
+        route.tier.questions += 1
+        return route
+
+    def escalate(self, route: Route) -> bool:
+        # moves the question to the strong tier; False when it is already there
+        if self.strong is None or route.tier is self.strong:
+            return False
+        route.tier = self.strong
+        route.escalated = True
+        self.strong.questions += 1
+        with self.lock:
+            self.escalations += 1
+        return True
+
+    def record(self, route: Route, failed: bool):
+        # outcome of a routed question; an escalation counts as a failure of the question's kind
+        with self.lock:
+            seen, failures = self.history.pop(route.key, (0, 0))
+            self.history[route.key] = (seen + 1, failures + (failed or route.escalated))
+            while len(self.history) > HISTORY_KEYS:
+                self.history.popitem(last=False)
+
+    def stats(self) -> dict:
+        stats = {"mode": self.mode, "threshold": self.threshold, "escalations": self.escalations, "tiers": {}}
+        for tier in self.tiers:
+            stats["tiers"][tier.name] = {"model": tier.model_name, "questions": tier.questions, **tier.stats.stats()}
+        stats["cost_usd"] = round(sum(tier.stats.cost for tier in self.tiers), 6)
+        return stats
+
+
+def add_router_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--router", choices=("auto", "fast", "strong", "off"), default="auto",
+                        help="pick a model tier per question; fast/strong pin one tier, off uses the single default model")
+    parser.add_argument("--fast-model", default=FAST_MODEL_NAME, help="model for simple questions")
+    parser.add_argument("--strong-model", default=STRONG_MODEL_NAME, help="model for hard questions and SQL that failed to compile")
+    parser.add_argument("--route-threshold", type=float, default=DEFAULT_THRESHOLD, help="question score from which the strong tier is used")
+    parser.add_argument("--fake-fast-responses", help="JSON file for the fake fast tier (default: --fake-responses)")
@@ -0,0 +1,141 @@
+import hashlib
+import re
+import sqlite3
+import time
+
+
+CACHE_DB_PATH = "query_cache.db"
+
+
+CACHE_SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS QuestionCache (
+    QuestionKey   TEXT NOT NULL,
+    SchemaHash    TEXT NOT NULL,
+    Question      TEXT NOT NULL,
+    SqlQuery      TEXT NOT NULL,
+    CreatedAt     REAL NOT NULL,
+    LastUsedAt    REAL NOT NULL,
+    HitCount      INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (QuestionKey, SchemaHash)
+);
+
+CREATE INDEX IF NOT EXISTS IX_QuestionCache_LastUsedAt ON QuestionCache (LastUsedAt);
+"""
+
+
+def normalize_question(question: str) -> str:
+    # lowercase, drop punctuation and collapse whitespace so that
+    # "Open bills?" and "  open   bills" share one cache entry
+    text = question.lower()
+    text = re.sub(r"[^\w\s%.-]", " ", text)
+    text = re.sub(r"\s+", " ", text)
+    return text.strip(" .")
+
+
+def schema_fingerprint(schema_sql: str) -> str:
+    return hashlib.sha256(schema_sql.encode("utf-8")).hexdigest()[:16]
+
+
+class QuestionCache:
+    """
+    Persistent question -> SQL cache stored in its own SQLite file.
+    Entries are keyed on the normalized question and the schema fingerprint,
+    expire after `ttl_seconds` and the least recently used ones are evicted
+    once the cache holds more than `max_entries` rows.
+    """
+
+    def __init__(self, schema_sql: str, path: str = CACHE_DB_PATH, max_entries: int = 1000, ttl_seconds: float = 7 * 24 * 3600):
+        self.schema_hash = schema_fingerprint(schema_sql)
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.executescript(CACHE_SCHEMA_SQL)
+
+    def get(self, question: str):
+        key = normalize_question(question)
+        now = time.time()
+        row = self.conn.execute(
+            "SELECT SqlQuery, CreatedAt FROM QuestionCache WHERE QuestionKey = ? AND SchemaHash = ?",
+            (key, self.schema_hash),
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        sql_query, created_at = row
+        if self.ttl_seconds is not None and now - created_at > self.ttl_seconds:
+            self.conn.execute(
+                "DELETE FROM QuestionCache WHERE QuestionKey = ? AND SchemaHash = ?",
+                (key, self.schema_hash),
+            )
+            self.conn.commit()
+            self.evictions += 1
+            self.misses += 1
+            return None
+        self.conn.execute(
+            "UPDATE QuestionCache SET LastUsedAt = ?, HitCount = HitCount + 1 WHERE QuestionKey = ? AND SchemaHash = ?",
+            (now, key, self.schema_hash),
+        )
+        self.conn.commit()
+        self.hits += 1
+        return sql_query
+
+    def put(self, question: str, sql_query: str):
+        now = time.time()
+        self.conn.execute(
+            """
+            INSERT INTO QuestionCache (QuestionKey, SchemaHash, Question, SqlQuery, CreatedAt, LastUsedAt)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (QuestionKey, SchemaHash) DO UPDATE SET
+                SqlQuery = excluded.SqlQuery,
+                CreatedAt = excluded.CreatedAt,
+                LastUsedAt = excluded.LastUsedAt
+            """,
+            (normalize_question(question), self.schema_hash, question, sql_query, now, now),
+        )
+        self._evict(now)
+        self.conn.commit()
+
+    def invalidate(self, question: str):
+        self.conn.execute(
+            "DELETE FROM QuestionCache WHERE QuestionKey = ? AND SchemaHash = ?",
+            (normalize_question(question), self.schema_hash),
+        )
+        self.conn.commit()
+
+    def _evict(self, now: float):
+        # expired rows and rows left over from older schema versions go first
+        cur = self.conn.execute(
+            "DELETE FROM QuestionCache WHERE SchemaHash <> ? OR CreatedAt < ?",
+            (self.schema_hash, now - self.ttl_seconds if self.ttl_seconds is not None else float("-inf")),
+        )
+        self.evictions += max(cur.rowcount, 0)
+        # then trim down to max_entries, least recently used first
+        count = self.conn.execute("SELECT COUNT(*) FROM QuestionCache").fetchone()[0]
+        overflow = count - self.max_entries
+        if overflow > 0:
+            cur = self.conn.execute(
+                """
+                DELETE FROM QuestionCache WHERE rowid IN (
+                    SELECT rowid FROM QuestionCache ORDER BY LastUsedAt ASC LIMIT ?
+                )
+                """,
+                (overflow,),
+            )
+            self.evictions += max(cur.rowcount, 0)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        size = self.conn.execute("SELECT COUNT(*) FROM QuestionCache").fetchone()[0]
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": size,
+            "hit_ratio": round(self.hits / lookups, 3) if lookups else 0.0,
+        }
+
+    def close(self):
+        self.conn.close()
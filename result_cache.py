@@ -0,0 +1,334 @@
+import argparse
+import marshal
+import re
+import sqlite3
+import threading
+import zlib
+from collections import OrderedDict
+
+from cost_gate import alias_map
+from sqlite_seed import DB_PATH
+
+
+DEFAULT_CACHE_BYTES = 64 * 1024 * 1024
+DEFAULT_ENTRY_BYTES = 8 * 1024 * 1024
+COMPRESS_OVER_BYTES = 64 * 1024
+VERSIONS_TABLE = "TableVersions"
+LITERAL_PATTERN = re.compile(r"'(?:[^']|'')*'")
+# results that change without a write ("overdue bills", "orders this month") are never cached:
+# 'now', date()/strftime('%s') without a time value (both mean now), 'localtime', random()
+VOLATILE_PATTERN = re.compile(
+    r"'now'|'localtime'|\bcurrent_(?:date|time|timestamp)\b|\brandom(?:blob)?\s*\("
+    r"|\b(?:date|time|datetime|julianday|unixepoch)\s*\(\s*\)|\bstrftime\s*\(\s*'(?:[^']|'')*'\s*\)",
+    re.IGNORECASE,
+)
+
+
+def cache_key(sql_query: str) -> str:
+    # whitespace and case only matter inside string literals
+    parts = LITERAL_PATTERN.split(sql_query)
+    literals = LITERAL_PATTERN.findall(sql_query)
+    out = [re.sub(r"\s+", " ", parts[0]).lower()]
+    for literal, part in zip(literals, parts[1:]):
+        out.extend([literal, re.sub(r"\s+", " ", part).lower()])
+    return "".join(out).strip().rstrip(";").strip()
+
+
+def install_versions(conn: sqlite3.Connection) -> list:
+    """
+    Adds TableVersions plus insert/update/delete triggers that bump a table's
+    counter on every write, so the cache only drops results of tables that
+    actually changed. Without it any write drops the whole cache.
+    """
+    tables = [
+        row[0]
+        for row in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' AND name <> ?",
+            (VERSIONS_TABLE,),
+        ).fetchall()
+    ]
+    with conn:
+        conn.execute(f"CREATE TABLE IF NOT EXISTS {VERSIONS_TABLE} (TableName TEXT PRIMARY KEY, Version INTEGER NOT NULL DEFAULT 0)")
+        for table in tables:
+            conn.execute(f"INSERT OR IGNORE INTO {VERSIONS_TABLE} (TableName) VALUES (?)", (table,))
+            for event in ("INSERT", "UPDATE", "DELETE"):
+                conn.execute(
+                    f'CREATE TRIGGER IF NOT EXISTS "TR_{VERSIONS_TABLE}_{table}_{event.title()}" AFTER {event} ON "{table}" BEGIN\n'
+                    f"    UPDATE {VERSIONS_TABLE} SET Version = Version + 1 WHERE TableName = '{table}';\nEND;"
+                )
+    return tables
+
+
+def drop_versions(conn: sqlite3.Connection):
+    with conn:
+        for (trigger,) in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'trigger' AND name LIKE ?", (f"TR_{VERSIONS_TABLE}_%",)
+        ).fetchall():
+            conn.execute(f'DROP TRIGGER "{trigger}"')
+        conn.execute(f"DROP TABLE IF EXISTS {VERSIONS_TABLE}")
+
+
+class CachedResult:
+    def __init__(self, description, rows: list, versions: dict):
+        self.description = description
+        self.row_count = len(rows)
+        self.versions = versions
+        data = marshal.dumps(rows)
+        # large results are kept compressed, small ones as plain tuples for cheap replay
+        self.compressed = len(data) > COMPRESS_OVER_BYTES
+        self.payload = zlib.compress(data, 1) if self.compressed else rows
+        self.size = len(self.payload) if self.compressed else len(data)
+
+    def rows(self) -> list:
+        return marshal.loads(zlib.decompress(self.payload)) if self.compressed else self.payload
+
+
+class ReplayCursor:
+    def __init__(self, entry: CachedResult):
+        self.description = entry.description
+        self.rows = entry.rows()
+        self.position = 0
+
+    def fetchmany(self, size: int = 500) -> list:
+        batch = self.rows[self.position:self.position + size]
+        self.position += len(batch)
+        return batch
+
+
+class RecordingCursor:
+    # passes batches through and stores the whole result once it has been read to the end
+    def __init__(self, cache, key: str, cursor, versions: dict, data_version: int):
+        self.cache = cache
+        self.key = key
+        self.cursor = cursor
+        self.versions = versions
+        self.data_version = data_version
+        self.description = cursor.description
+        self.rows = []
+        self.size = 0
+        self.recording = True
+
+    def fetchmany(self, size: int = 500) -> list:
+        batch = self.cursor.fetchmany(size)
+        if not self.recording:
+            return batch
+        if not batch:
+            self.recording = False
+            self.cache.store(self.key, CachedResult(self.description, self.rows, self.versions), self.data_version)
+            self.rows = []
+            return batch
+        self.rows.extend(batch)
+        # rough byte count, the exact size is taken once when the entry is stored
+        self.size += sum(len(str(row)) for row in batch)
+        if self.size > self.cache.max_entry_bytes:
+            self.recording = False
+            self.rows = []
+        return batch
+
+
+class ResultCache:
+    """
+    In-memory cache of query results keyed on normalized SQL text, bounded by
+    result bytes with LRU eviction. Entries are checked against the database
+    before use: an unchanged PRAGMA data_version means nothing was written;
+    otherwise TableVersions (see install_versions) tells which tables changed,
+    and only results reading those tables are dropped.
+    """
+
+    def __init__(self, db_path: str = DB_PATH, max_bytes: int = DEFAULT_CACHE_BYTES, max_entry_bytes: int = DEFAULT_ENTRY_BYTES):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = min(max_entry_bytes, max_bytes)
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.stats_counts = {"hits": 0, "misses": 0, "stored": 0, "compressed": 0, "evictions": 0, "invalidations": 0, "volatile": 0}
+        # data_version only moves for commits made by other connections, so this one never writes
+        self.tracker = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, check_same_thread=False)
+        self.tables = {
+            row[0].lower(): row[0]
+            for row in self.tracker.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'view')").fetchall()
+        }
+        self.data_version = self._data_version()
+        self.versions = self._table_versions()
+
+    def _data_version(self) -> int:
+        return self.tracker.execute("PRAGMA data_version").fetchone()[0]
+
+    def _table_versions(self):
+        try:
+            return dict(self.tracker.execute(f"SELECT TableName, Version FROM {VERSIONS_TABLE}").fetchall())
+        except sqlite3.OperationalError:
+            return None
+
+    def _refresh(self):
+        # caller holds the lock
+        data_version = self._data_version()
+        if data_version == self.data_version:
+            return
+        self.data_version = data_version
+        versions = self._table_versions()
+        if versions is None or self.versions is None:
+            stale = list(self.entries)
+        else:
+            changed = {t for t, v in versions.items() if self.versions.get(t) != v}
+            stale = [key for key, entry in self.entries.items() if self._reads_changed(entry, changed)]
+        self.versions = versions
+        for key in stale:
+            self.bytes -= self.entries.pop(key).size
+        self.stats_counts["invalidations"] += len(stale)
+
+    def _reads_changed(self, entry: CachedResult, changed: set) -> bool:
+        # entries whose tables couldn't be worked out depend on everything
+        return entry.versions is None or any(t in changed for t in entry.versions)
+
+    def _dependencies(self, sql_query: str):
+        if self.versions is None:
+            return None
+        # alias_map also picks up CTE names and the odd function name, only real tables count
+        found = {self.tables[name.lower()] for name in alias_map(sql_query).values() if name.lower() in self.tables}
+        if not found or any(t not in self.versions for t in found):
+            return None
+        return {t: self.versions[t] for t in found}
+
+    def execute(self, cursor, sql_query: str):
+        """
+        Returns a cursor-like object (description, fetchmany) for `sql_query`:
+        a replay of the cached rows on a hit, otherwise `cursor.execute(...)`
+        wrapped so the rows are cached once fully read. Statements reading the
+        clock or random() run uncached.
+        """
+        key = cache_key(sql_query)
+        if VOLATILE_PATTERN.search(key):
+            with self.lock:
+                self.stats_counts["volatile"] += 1
+            result = cursor.execute(sql_query)
+            return result if result is not None else cursor
+        with self.lock:
+            self._refresh()
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.stats_counts["hits"] += 1
+                return ReplayCursor(entry)
+            self.stats_counts["misses"] += 1
+            versions = self._dependencies(sql_query)
+            data_version = self.data_version
+        result = cursor.execute(sql_query)
+        return RecordingCursor(self, key, result if result is not None else cursor, versions, data_version)
+
+    def store(self, key: str, entry: CachedResult, data_version: int):
+        if entry.size > self.max_entry_bytes:
+            return
+        with self.lock:
+            self._refresh()
+            # something was committed while the query ran, the rows may predate it
+            if self.data_version != data_version:
+                return
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.bytes -= old.size
+            self.entries[key] = entry
+            self.bytes += entry.size
+            self.stats_counts["stored"] += 1
+            self.stats_counts["compressed"] += entry.compressed
+            while self.bytes > self.max_bytes and self.entries:
+                _, evicted = self.entries.popitem(last=False)
+                self.bytes -= evicted.size
+                self.stats_counts["evictions"] += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def stats(self) -> dict:
+        with self.lock:
+            lookups = self.stats_counts["hits"] + self.stats_counts["misses"]
+            return {
+                **self.stats_counts,
+                "entries": len(self.entries),
+                "bytes": self.bytes,
+                "hit_ratio": round(self.stats_counts["hits"] / lookups, 3) if lookups else 0.0,
+                "table_versions": self.versions is not None,
+            }
+
+    def close(self):
+        self.tracker.close()
+
+
+class CachingGuard:
+    """
+    Drop-in for a db_pool.QueryGuard whose execute() goes through a
+    ResultCache: `with pool.query() as guard: cur = CachingGuard(cache, guard)`
+    and then use cur like the guard (execute, description, fetchmany, ...).
+    """
+
+    def __init__(self, cache: ResultCache, guard):
+        self.cache = cache
+        self.guard = guard
+        self.source = None
+
+    @property
+    def cache_hit(self) -> bool:
+        return isinstance(self.source, ReplayCursor)
+
+    @property
+    def description(self):
+        return self.source.description if self.source is not None else None
+
+    def execute(self, sql_query: str, params=()):
+        if params:
+            # parameterized statements aren't cached
+            self.source = self.guard.execute(sql_query, params)
+        else:
+            self.source = self.cache.execute(self.guard, sql_query)
+        return self
+
+    def fetchmany(self, size: int = 500) -> list:
+        return self.source.fetchmany(size)
+
+    def fetchone(self):
+        rows = self.fetchmany(1)
+        return rows[0] if rows else None
+
+    def fetchall(self) -> list:
+        rows = []
+        while True:
+            batch = self.fetchmany(500)
+            if not batch:
+                return rows
+            rows.extend(batch)
+
+    def __iter__(self):
+        while True:
+            batch = self.fetchmany(500)
+            if not batch:
+                return
+            yield from batch
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Install or drop the per-table write counters used by the result cache")
+    parser.add_argument("action", choices=["install", "drop", "show"])
+    parser.add_argument("--db", default=DB_PATH)
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    try:
+        if args.action == "install":
+            print(f"Write counters on {len(install_versions(conn))} tables.")
+        elif args.action == "drop":
+            drop_versions(conn)
+            print("Write counters dropped.")
+        else:
+            try:
+                for table, version in conn.execute(f"SELECT TableName, Version FROM {VERSIONS_TABLE} ORDER BY TableName"):
+                    print(f"{table:<26} {version}")
+            except sqlite3.OperationalError:
+                print("Write counters not installed.")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,283 @@
+import argparse
+import csv
+import json
+import marshal
+import os
+import re
+import sqlite3
+import struct
+import time
+import zlib
+
+from query_cache import normalize_question
+from sqlite_seed import DB_PATH
+
+
+EXPORT_BATCH_SIZE = 10000
+EXPORT_DIR = "exports"
+EXTENSIONS = {"csv": ".csv", "jsonl": ".jsonl", "parquet": ".parquet", "arrow": ".arrow", "colz": ".colz"}
+# "columnar" picks Parquet when pyarrow is installed and the built-in format otherwise
+EXPORT_FORMATS = ("csv", "jsonl", "columnar", "parquet", "arrow", "colz")
+COLZ_MAGIC = b"COLZ1\n"
+
+
+class ExportError(Exception):
+    pass
+
+
+def have_pyarrow() -> bool:
+    try:
+        import pyarrow  # noqa: F401
+        import pyarrow.parquet  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def resolve_format(fmt: str = None, path: str = None) -> str:
+    # format asked for (or implied by the path's extension) -> format actually written
+    if fmt is None and path:
+        ext = os.path.splitext(path)[1].lower()
+        fmt = next((name for name, e in EXTENSIONS.items() if e == ext), None)
+    fmt = (fmt or "csv").lower()
+    if fmt not in EXPORT_FORMATS:
+        raise ExportError(f"unknown export format {fmt!r}, expected one of {', '.join(EXPORT_FORMATS)}")
+    if fmt in ("columnar", "parquet", "arrow"):
+        if not have_pyarrow():
+            return "colz"
+        return "parquet" if fmt == "columnar" else fmt
+    return fmt
+
+
+def export_path(question: str, fmt: str, directory: str = EXPORT_DIR) -> str:
+    # exports/20240315-142501_all_asset_transactions.csv
+    slug = "_".join(re.sub(r"[^a-z0-9 ]", "", normalize_question(question)).split()[:6]) or "export"
+    return os.path.join(directory, f"{time.strftime('%Y%m%d-%H%M%S')}_{slug}{EXTENSIONS[fmt]}")
+
+
+def _json_value(value):
+    # the only SQLite type json can't take as is
+    if isinstance(value, bytes):
+        return value.hex()
+    raise TypeError(f"cannot export {type(value).__name__}")
+
+
+class CsvWriter:
+    def __init__(self, path: str, columns: list):
+        self.file = open(path, "w", encoding="utf-8", newline="")
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(columns)
+
+    def write_batch(self, rows: list):
+        self.writer.writerows(rows)
+
+    def close(self):
+        self.file.close()
+
+
+class JsonlWriter:
+    def __init__(self, path: str, columns: list):
+        self.file = open(path, "w", encoding="utf-8")
+        self.columns = columns
+
+    def write_batch(self, rows: list):
+        columns = self.columns
+        self.file.write("".join(
+            json.dumps(dict(zip(columns, row)), ensure_ascii=False, default=_json_value) + "\n" for row in rows
+        ))
+
+    def close(self):
+        self.file.close()
+
+
+class ColzWriter:
+    """
+    Built-in columnar format for when pyarrow isn't installed: a magic line,
+    a JSON header line with the column names, then one block per batch, each
+    a 4-byte big-endian length and the zlib-compressed marshal of the batch's
+    column lists. Read it back with read_colz().
+    """
+
+    def __init__(self, path: str, columns: list):
+        self.file = open(path, "wb")
+        self.columns = columns
+        self.file.write(COLZ_MAGIC + json.dumps({"columns": columns}).encode("utf-8") + b"\n")
+
+    def write_batch(self, rows: list):
+        block = zlib.compress(marshal.dumps([list(col) for col in zip(*rows)]), 6)
+        self.file.write(struct.pack(">I", len(block)) + block)
+
+    def close(self):
+        self.file.close()
+
+
+class ArrowWriter:
+    """
+    Parquet (one row group per batch) or Arrow IPC file through pyarrow. Column
+    types come from the first batch; a column that is all NULL or mixes types
+    there is written as strings.
+    """
+
+    def __init__(self, path: str, columns: list, fmt: str):
+        import pyarrow as pa
+
+        self.pa = pa
+        self.path = path
+        self.columns = columns
+        self.fmt = fmt
+        self.schema = None
+        self.writer = None
+
+    def _infer(self, name: str, values: list):
+        pa = self.pa
+        try:
+            array = pa.array(values)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            array = None
+        if array is None or pa.types.is_null(array.type):
+            return pa.field(name, pa.string())
+        return pa.field(name, array.type)
+
+    def _array(self, field, values: list):
+        pa = self.pa
+        if pa.types.is_string(field.type):
+            values = [v if v is None or isinstance(v, str) else (v.hex() if isinstance(v, bytes) else str(v)) for v in values]
+        try:
+            return pa.array(values, type=field.type)
+        except (pa.ArrowInvalid, pa.ArrowTypeError) as e:
+            raise ExportError(f"column {field.name} changed type mid-result ({e}), export it as csv or jsonl") from e
+
+    def _open(self, schema):
+        self.schema = schema
+        if self.fmt == "parquet":
+            import pyarrow.parquet as pq
+
+            self.writer = pq.ParquetWriter(self.path, schema, compression="snappy")
+        else:
+            self.writer = self.pa.ipc.new_file(self.path, schema)
+
+    def write_batch(self, rows: list):
+        columns = [list(col) for col in zip(*rows)]
+        if self.schema is None:
+            self._open(self.pa.schema([self._infer(name, values) for name, values in zip(self.columns, columns)]))
+        arrays = [self._array(field, values) for field, values in zip(self.schema, columns)]
+        self.writer.write_table(self.pa.Table.from_arrays(arrays, schema=self.schema))
+
+    def close(self):
+        if self.writer is None:
+            # no rows: still write a valid file with every column as string
+            self._open(self.pa.schema([self.pa.field(name, self.pa.string()) for name in self.columns]))
+        self.writer.close()
+
+
+def open_writer(fmt: str, path: str, columns: list):
+    if fmt == "csv":
+        return CsvWriter(path, columns)
+    if fmt == "jsonl":
+        return JsonlWriter(path, columns)
+    if fmt == "colz":
+        return ColzWriter(path, columns)
+    return ArrowWriter(path, columns, fmt)
+
+
+def export_query(conn, sql_query: str, path: str, fmt: str = None, batch_size: int = EXPORT_BATCH_SIZE) -> dict:
+    """
+    Runs `sql_query` and streams the rows to `path` in `batch_size` chunks,
+    so memory holds one chunk whatever the result size. `conn` may be a
+    connection, cursor or db_pool.QueryGuard. The file is written under a
+    .part name and renamed once complete. Parquet and Arrow fall back to the
+    built-in colz format (and extension) without pyarrow. Returns the path,
+    format, row count, bytes, seconds and rows per second.
+    """
+    written = resolve_format(fmt, path)
+    root, ext = os.path.splitext(path)
+    if ext.lower() != EXTENSIONS[written]:
+        path = root + EXTENSIONS[written]
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    started = time.perf_counter()
+    cursor = conn.execute(sql_query)
+    columns = [col[0] for col in cursor.description or []]
+    partial = path + ".part"
+    writer = open_writer(written, partial, columns)
+    row_count = 0
+    try:
+        while True:
+            batch = cursor.fetchmany(batch_size)
+            if not batch:
+                break
+            writer.write_batch(batch)
+            row_count += len(batch)
+        writer.close()
+    except BaseException:
+        try:
+            writer.close()
+        except Exception:
+            pass
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise
+    os.replace(partial, path)
+    seconds = time.perf_counter() - started
+    return {
+        "path": path,
+        "format": written,
+        "columns": columns,
+        "rows": row_count,
+        "bytes": os.path.getsize(path),
+        "seconds": round(seconds, 3),
+        "rows_per_second": round(row_count / seconds) if seconds > 0 else row_count,
+    }
+
+
+def read_colz(path: str):
+    """
+    Yields (columns, rows) per block of a colz file, rows as tuples, so a
+    colz export can be read back one chunk at a time.
+    """
+    with open(path, "rb") as f:
+        if f.readline() != COLZ_MAGIC:
+            raise ExportError(f"{path} is not a colz file")
+        columns = json.loads(f.readline())["columns"]
+        while True:
+            head = f.read(4)
+            if len(head) < 4:
+                return
+            block = marshal.loads(zlib.decompress(f.read(struct.unpack(">I", head)[0])))
+            yield columns, list(zip(*block))
+
+
+def export_summary(report: dict) -> str:
+    # shown instead of the rows and the explanation
+    size = report["bytes"]
+    size_text = f"{size / 1_048_576:.1f} MB" if size >= 1_048_576 else f"{size / 1024:.1f} KB"
+    return (f"Exported {report['rows']:,} rows ({len(report['columns'])} columns, {size_text}) to {report['path']} "
+            f"as {report['format']} in {report['seconds']}s, {report['rows_per_second']:,} rows/s.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stream the result of a SQL query to a CSV, JSONL or columnar file")
+    parser.add_argument("sql", nargs="?", help="query to export (read from stdin when omitted)")
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--output", help="file to write (default: exports/<timestamp>_export.<ext>)")
+    parser.add_argument("--format", choices=EXPORT_FORMATS, help="default: from the output extension, else csv")
+    parser.add_argument("--batch-size", type=int, default=EXPORT_BATCH_SIZE)
+    parser.add_argument("--read", help="print the rows of a colz file instead of exporting")
+    args = parser.parse_args()
+
+    if args.read:
+        for number, (columns, rows) in enumerate(read_colz(args.read)):
+            if not number:
+                print(tuple(columns))
+            for row in rows:
+                print(row)
+        return
+    sql_query = args.sql or input()
+    path = args.output or export_path("", resolve_format(args.format))
+    with sqlite3.connect(f"file:{args.db}?mode=ro", uri=True) as conn:
+        print(export_summary(export_query(conn, sql_query, path, args.format, args.batch_size)))
+
+
+if __name__ == "__main__":
+    main()
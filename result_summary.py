@@ -0,0 +1,137 @@
+import random
+
+
+DEFAULT_TOKEN_BUDGET = 1500
+DISTINCT_CAP = 10000
+TOP_K = 5
+
+
+def estimate_tokens(text: str) -> int:
+    # ~4 characters per token is close enough for budgeting prompts
+    return (len(text) + 3) // 4
+
+
+class ColumnStats:
+    def __init__(self, name: str, top_capacity: int = 64):
+        self.name = name
+        self.count = 0
+        self.nulls = 0
+        self.min = None
+        self.max = None
+        self.sum = 0
+        self.numeric = True
+        self.distinct = set()
+        self.distinct_overflow = False
+        # space-saving counters: bounded memory, exact for the heavy hitters
+        self.top_capacity = top_capacity
+        self.counters = {}
+
+    def add(self, value):
+        if value is None:
+            self.nulls += 1
+            return
+        self.count += 1
+        if isinstance(value, bytes):
+            value = f"<{len(value)} bytes>"
+        try:
+            if self.min is None or value < self.min:
+                self.min = value
+            if self.max is None or value > self.max:
+                self.max = value
+        except TypeError:
+            # mixed types in one SQLite column, compare as text
+            self.min = min(str(self.min), str(value))
+            self.max = max(str(self.max), str(value))
+        if self.numeric and isinstance(value, (int, float)) and not isinstance(value, bool):
+            self.sum += value
+        else:
+            self.numeric = False
+        if not self.distinct_overflow:
+            self.distinct.add(value)
+            if len(self.distinct) > DISTINCT_CAP:
+                self.distinct = set()
+                self.distinct_overflow = True
+        if value in self.counters:
+            self.counters[value] += 1
+        elif len(self.counters) < self.top_capacity:
+            self.counters[value] = 1
+        else:
+            smallest = min(self.counters, key=self.counters.get)
+            self.counters[value] = self.counters.pop(smallest) + 1
+
+    def top(self, k: int = TOP_K) -> list:
+        return sorted(self.counters.items(), key=lambda kv: -kv[1])[:k]
+
+    def describe(self, k: int = TOP_K) -> dict:
+        info = {"count": self.count, "nulls": self.nulls, "min": self.min, "max": self.max}
+        if self.numeric and self.count:
+            info["sum"] = round(self.sum, 4) if isinstance(self.sum, float) else self.sum
+        info["distinct"] = f">{DISTINCT_CAP}" if self.distinct_overflow else len(self.distinct)
+        # top values only say something when values repeat
+        if k and not self.distinct_overflow and len(self.distinct) < self.count:
+            info["top"] = self.top(k)
+        return info
+
+
+class ResultSummary:
+    """
+    Single-pass summary of a query result: per-column stats plus a reservoir
+    sample of rows, rendered for the explanation prompt within a token budget.
+    Feed it with add_rows() as batches come off the cursor.
+    """
+
+    def __init__(self, columns: list, sample_size: int = 200, seed: int = 0):
+        self.columns = list(columns)
+        self.stats = [ColumnStats(name) for name in self.columns]
+        self.row_count = 0
+        self.head = []
+        self.sample_size = sample_size
+        self.sample = []
+        self.rng = random.Random(seed)
+
+    def add_rows(self, rows):
+        for row in rows:
+            self.row_count += 1
+            for stat, value in zip(self.stats, row):
+                stat.add(value)
+            if len(self.head) < 10:
+                self.head.append(row)
+            # reservoir sampling keeps a uniform sample over the whole result
+            if len(self.sample) < self.sample_size:
+                self.sample.append(row)
+            else:
+                slot = self.rng.randrange(self.row_count)
+                if slot < self.sample_size:
+                    self.sample[slot] = row
+
+    def sample_rows(self) -> list:
+        if self.row_count <= self.sample_size:
+            return list(self.sample)
+        # leading rows matter for ORDER BY results, the reservoir covers the rest
+        rows = list(self.head)
+        rows.extend(row for row in self.sample if row not in self.head)
+        return rows
+
+    def render(self, token_budget: int = DEFAULT_TOKEN_BUDGET) -> str:
+        lines = [f"Columns: {self.columns}", f"Total rows: {self.row_count}"]
+        # small results go in whole, larger ones get column stats first
+        all_rows_text = f"Rows: {self.sample}"
+        if self.row_count <= self.sample_size and estimate_tokens("\n".join(lines) + all_rows_text) <= token_budget:
+            lines.append(all_rows_text)
+            return "\n".join(lines)
+        lines.append("Column stats:")
+        stat_lines = [f"  {stat.name}: {stat.describe()}" for stat in self.stats]
+        if estimate_tokens("\n".join(lines + stat_lines)) > token_budget:
+            # wide results: drop the top-k lists before dropping sample rows
+            stat_lines = [f"  {stat.name}: {stat.describe(k=0)}" for stat in self.stats]
+        lines.extend(stat_lines)
+        used = estimate_tokens("\n".join(lines))
+        shown = []
+        for row in self.sample_rows():
+            cost = estimate_tokens(f"{row}, ")
+            if used + cost > token_budget:
+                break
+            shown.append(row)
+            used += cost
+        lines.append(f"Sample rows ({len(shown)} of {self.row_count}): {shown}")
+        return "\n".join(lines)
@@ -0,0 +1,288 @@
+import argparse
+import re
+import sqlite3
+import time
+
+from sqlite_seed import DB_PATH
+
+
+ROLLUP_PREFIX = "Rollup"
+
+# {h} is the header row, {l} the line row. Triggers substitute NEW/OLD or a table alias.
+SALES = {"lines": "SalesOrderLines", "header": "SalesOrders", "key": "SOId", "date": "{h}.SODate"}
+PURCHASES = {"lines": "PurchaseOrderLines", "header": "PurchaseOrders", "key": "POId", "date": "{h}.PODate"}
+LINE_MEASURES = (("Lines", "1"), ("Quantity", "{l}.Quantity"), ("Amount", "{l}.Quantity * {l}.UnitPrice"))
+BILL_MEASURES = (("Bills", "1"), ("Amount", "{h}.TotalAmount"))
+
+
+class Rollup:
+    """
+    One rollup table: GROUP BY `dims` over a source, SUM of each measure.
+    Line rollups aggregate order lines joined to their header (`source` has
+    lines/header/key); header-only rollups (`source` has just "header")
+    aggregate one table, like Bills.
+    """
+
+    def __init__(self, name: str, source: dict, dims: tuple, measures: tuple, description: str):
+        self.name = name
+        self.source = source
+        self.dims = dims
+        self.measures = measures
+        self.description = description
+
+    @property
+    def is_line_rollup(self) -> bool:
+        return "lines" in self.source
+
+    def dim_exprs(self, h: str, l: str = "l") -> list:
+        return [expr.format(h=h, l=l, date=self.source.get("date", "").format(h=h)) for _, expr in self.dims]
+
+    def measure_exprs(self, h: str, l: str = "l") -> list:
+        return [expr.format(h=h, l=l) for _, expr in self.measures]
+
+    def ddl(self) -> str:
+        dims = ",\n    ".join(f"{col} {'TEXT' if col in ('Day', 'Month', 'ItemCode', 'Status') else 'INTEGER'} NOT NULL" for col, _ in self.dims)
+        measures = ",\n    ".join(f"{col} NUMERIC NOT NULL DEFAULT 0" for col, _ in self.measures)
+        keys = ", ".join(col for col, _ in self.dims)
+        count_col = self.measures[0][0]
+        return (
+            f"CREATE TABLE IF NOT EXISTS {self.name} (\n    {dims},\n    {measures},\n    PRIMARY KEY ({keys})\n);\n"
+            # groups whose rows all went away are deleted through this (normally empty) index
+            f"CREATE INDEX IF NOT EXISTS IX_{self.name}_Empty ON {self.name} ({count_col}) WHERE {count_col} = 0;\n"
+        )
+
+    def _upsert(self, select_cols: list, source_sql: str) -> str:
+        dims = ", ".join(col for col, _ in self.dims)
+        measures = [col for col, _ in self.measures]
+        updates = ", ".join(f"{col} = {col} + excluded.{col}" for col in measures)
+        return (
+            f"INSERT INTO {self.name} ({dims}, {', '.join(measures)})\n"
+            f"    SELECT {', '.join(select_cols)} {source_sql}\n"
+            f"    ON CONFLICT ({dims}) DO UPDATE SET {updates};"
+        )
+
+    def _cleanup(self) -> str:
+        count_col = self.measures[0][0]
+        return f"DELETE FROM {self.name} WHERE {count_col} = 0;"
+
+    def apply_row(self, row: str, sign: str) -> str:
+        # add (sign "") or remove (sign "-") one source row given as NEW or OLD
+        if self.is_line_rollup:
+            src = self.source
+            cols = self.dim_exprs("h", row) + [f"{sign}({m})" for m in self.measure_exprs("h", row)]
+            return self._upsert(cols, f"FROM {src['header']} h WHERE h.{src['key']} = {row}.{src['key']}")
+        cols = self.dim_exprs(row) + [f"{sign}({m})" for m in self.measure_exprs(row)]
+        # the WHERE keeps SQLite from reading ON CONFLICT as a join constraint
+        return self._upsert(cols, "WHERE true")
+
+    def apply_header(self, row: str, sign: str) -> str:
+        # add or remove every line of the header `row` (NEW or OLD)
+        src = self.source
+        dims = self.dim_exprs(row)
+        cols = dims + [f"{sign}TOTAL({m})" if m != "1" else f"{sign}COUNT(*)" for m in self.measure_exprs(row)]
+        return self._upsert(cols, f"FROM {src['lines']} l WHERE l.{src['key']} = {row}.{src['key']} GROUP BY {', '.join(dims)}")
+
+    def header_columns(self) -> str:
+        # header updates that don't touch these (a status change on an order) leave the rollup alone
+        exprs = [expr for _, expr in self.dims + self.measures] + [self.source.get("date", "")]
+        columns = set(re.findall(r"\{h\}\.(\w+)", " ".join(exprs)))
+        if "key" in self.source:
+            columns.add(self.source["key"])
+        return ", ".join(sorted(columns))
+
+    def triggers(self) -> list:
+        name = self.name
+        if not self.is_line_rollup:
+            table = self.source["header"]
+            return [
+                f"CREATE TRIGGER IF NOT EXISTS TR_{name}_Insert AFTER INSERT ON {table} BEGIN\n"
+                f"    {self.apply_row('NEW', '')}\nEND;",
+                f"CREATE TRIGGER IF NOT EXISTS TR_{name}_Delete AFTER DELETE ON {table} BEGIN\n"
+                f"    {self.apply_row('OLD', '-')}\n    {self._cleanup()}\nEND;",
+                f"CREATE TRIGGER IF NOT EXISTS TR_{name}_Update AFTER UPDATE OF {self.header_columns()} ON {table} BEGIN\n"
+                f"    {self.apply_row('OLD', '-')}\n    {self.apply_row('NEW', '')}\n    {self._cleanup()}\nEND;",
+            ]
+        lines, header = self.source["lines"], self.source["header"]
+        return [
+            f"CREATE TRIGGER IF NOT EXISTS TR_{name}_LineInsert AFTER INSERT ON {lines} BEGIN\n"
+            f"    {self.apply_row('NEW', '')}\nEND;",
+            f"CREATE TRIGGER IF NOT EXISTS TR_{name}_LineDelete AFTER DELETE ON {lines} BEGIN\n"
+            f"    {self.apply_row('OLD', '-')}\n    {self._cleanup()}\nEND;",
+            f"CREATE TRIGGER IF NOT EXISTS TR_{name}_LineUpdate AFTER UPDATE ON {lines} BEGIN\n"
+            f"    {self.apply_row('OLD', '-')}\n    {self.apply_row('NEW', '')}\n    {self._cleanup()}\nEND;",
+            # lines written before their header, or a header whose date/customer/site changes
+            f"CREATE TRIGGER IF NOT EXISTS TR_{name}_HeaderInsert AFTER INSERT ON {header} BEGIN\n"
+            f"    {self.apply_header('NEW', '')}\nEND;",
+            f"CREATE TRIGGER IF NOT EXISTS TR_{name}_HeaderDelete AFTER DELETE ON {header} BEGIN\n"
+            f"    {self.apply_header('OLD', '-')}\n    {self._cleanup()}\nEND;",
+            f"CREATE TRIGGER IF NOT EXISTS TR_{name}_HeaderUpdate AFTER UPDATE OF {self.header_columns()} ON {header} BEGIN\n"
+            f"    {self.apply_header('OLD', '-')}\n    {self.apply_header('NEW', '')}\n    {self._cleanup()}\nEND;",
+        ]
+
+    def base_query(self) -> str:
+        # the rollup computed from scratch, used to backfill and to check it
+        dims = self.dim_exprs("h")
+        if self.is_line_rollup:
+            src = self.source
+            measures = [f"TOTAL({m})" if m != "1" else "COUNT(*)" for m in self.measure_exprs("h")]
+            return (
+                f"SELECT {', '.join(dims + measures)} FROM {src['lines']} l "
+                f"JOIN {src['header']} h ON h.{src['key']} = l.{src['key']} GROUP BY {', '.join(dims)}"
+            )
+        measures = [f"TOTAL({m})" if m != "1" else "COUNT(*)" for m in self.measure_exprs("h")]
+        return f"SELECT {', '.join(dims + measures)} FROM {self.source['header']} h GROUP BY {', '.join(dims)}"
+
+
+# date() and strftime() give NULL for text that isn't an ISO date, which the base tables accept;
+# such rows are grouped under 'unknown' so the triggers never reject a write
+UNKNOWN_DATE = "unknown"
+DAY = ("Day", f"COALESCE(date({{date}}), '{UNKNOWN_DATE}')")
+MONTH = ("Month", f"COALESCE(strftime('%Y-%m', {{date}}), '{UNKNOWN_DATE}')")
+BILL_DAY = ("Day", f"COALESCE(date({{h}}.BillDate), '{UNKNOWN_DATE}')")
+BILL_MONTH = ("Month", f"COALESCE(strftime('%Y-%m', {{h}}.BillDate), '{UNKNOWN_DATE}')")
+
+ROLLUPS = (
+    Rollup("RollupSalesDaily", SALES, (DAY,), LINE_MEASURES, "sales per day"),
+    Rollup("RollupSalesByCustomer", SALES, (MONTH, ("CustomerId", "{h}.CustomerId")), LINE_MEASURES, "sales per month and customer"),
+    Rollup("RollupSalesBySite", SALES, (MONTH, ("SiteId", "COALESCE({h}.SiteId, 0)")), LINE_MEASURES, "sales per month and site"),
+    Rollup("RollupSalesByItem", SALES, (MONTH, ("ItemCode", "{l}.ItemCode")), LINE_MEASURES, "sales per month and item"),
+    Rollup("RollupPurchasesDaily", PURCHASES, (DAY,), LINE_MEASURES, "purchasing per day"),
+    Rollup("RollupPurchasesByVendor", PURCHASES, (MONTH, ("VendorId", "{h}.VendorId")), LINE_MEASURES, "purchasing per month and vendor"),
+    Rollup("RollupPurchasesBySite", PURCHASES, (MONTH, ("SiteId", "COALESCE({h}.SiteId, 0)")), LINE_MEASURES, "purchasing per month and site"),
+    Rollup("RollupPurchasesByItem", PURCHASES, (MONTH, ("ItemCode", "{l}.ItemCode")), LINE_MEASURES, "purchasing per month and item"),
+    Rollup("RollupBillsDaily", {"header": "Bills"}, (BILL_DAY, ("Status", "{h}.Status")), BILL_MEASURES, "bills per day and status"),
+    Rollup("RollupBillsByVendor", {"header": "Bills"}, (BILL_MONTH, ("VendorId", "{h}.VendorId"), ("Status", "{h}.Status")), BILL_MEASURES, "bills per month, vendor and status"),
+)
+
+
+def installed(conn: sqlite3.Connection) -> list:
+    names = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE ?", (ROLLUP_PREFIX + "%",))}
+    return [rollup for rollup in ROLLUPS if rollup.name in names]
+
+
+def install(conn: sqlite3.Connection, rollups=ROLLUPS) -> dict:
+    """
+    Creates the rollup tables, backfills them with one GROUP BY each and then
+    adds the triggers that keep them current, replacing older versions of
+    them. Writers that use INSERT OR REPLACE need PRAGMA recursive_triggers
+    on, otherwise the replaced row is never subtracted. Returns seconds per
+    rollup.
+    """
+    timings = {}
+    with conn:
+        for rollup in rollups:
+            started = time.perf_counter()
+            _drop_triggers(conn, rollup)
+            conn.executescript(rollup.ddl())
+            conn.execute(f"DELETE FROM {rollup.name}")
+            conn.execute(f"INSERT INTO {rollup.name} {rollup.base_query()}")
+            for trigger in rollup.triggers():
+                conn.execute(trigger)
+            timings[rollup.name] = round(time.perf_counter() - started, 4)
+    return timings
+
+
+def _drop_triggers(conn: sqlite3.Connection, rollup: Rollup):
+    for (trigger,) in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'trigger' AND name LIKE ?", (f"TR_{rollup.name}_%",)
+    ).fetchall():
+        conn.execute(f'DROP TRIGGER "{trigger}"')
+
+
+def drop(conn: sqlite3.Connection):
+    with conn:
+        for rollup in ROLLUPS:
+            _drop_triggers(conn, rollup)
+            conn.execute(f"DROP TABLE IF EXISTS {rollup.name}")
+
+
+def check(conn: sqlite3.Connection, rollups=None, tolerance: float = 1e-9) -> dict:
+    """
+    Recomputes every installed rollup from the base tables and compares.
+    Returns {rollup name: number of groups that differ}, all zeros when the
+    triggers have kept up.
+    """
+    report = {}
+    for rollup in rollups or installed(conn):
+        dims = [col for col, _ in rollup.dims]
+        measures = [col for col, _ in rollup.measures]
+        base = f"SELECT * FROM ({rollup.base_query()})"
+        columns = ", ".join(f"b{i}" for i in range(len(dims) + len(measures)))
+        join_on = " AND ".join(f"b.b{i} = r.{col}" for i, col in enumerate(dims))
+        # relative tolerance: sums of REAL prices drift in the last bits when built up one row at a time
+        differs = " OR ".join(
+            f"ABS(b.b{len(dims) + i} - r.{col}) > {tolerance} * MAX(1.0, ABS(r.{col}))" for i, col in enumerate(measures)
+        )
+        mismatched = conn.execute(
+            f"""
+            WITH b({columns}) AS ({base})
+            SELECT
+                (SELECT COUNT(*) FROM b JOIN {rollup.name} r ON {join_on} WHERE {differs})
+              + (SELECT COUNT(*) FROM b WHERE NOT EXISTS (SELECT 1 FROM {rollup.name} r WHERE {join_on}))
+              + (SELECT COUNT(*) FROM {rollup.name} r WHERE NOT EXISTS (SELECT 1 FROM b WHERE {join_on}))
+            """
+        ).fetchone()[0]
+        report[rollup.name] = mismatched
+    return report
+
+
+def rollup_digest(conn: sqlite3.Connection) -> str:
+    """
+    Compact description of the installed rollups for the retrieval prompt, or
+    "" when none are installed.
+    """
+    rollups = installed(conn)
+    if not rollups:
+        return ""
+    lines = [
+        "Precomputed rollups, prefer them over order lines for totals by day, month, customer, vendor, site or item.",
+        "Amount = SUM(Quantity * UnitPrice) (TotalAmount for bills), Lines/Bills = row count, SiteId 0 = no site, "
+        f"Day is YYYY-MM-DD, Month is YYYY-MM ('{UNKNOWN_DATE}' for unparseable dates). Join Customers/Vendors/Sites by id for names.",
+    ]
+    for rollup in rollups:
+        columns = ", ".join(col for col, _ in rollup.dims + rollup.measures)
+        lines.append(f"{rollup.name}({columns}) -- {rollup.description}")
+    return "\n".join(lines)
+
+
+AGGREGATE_WORDS = re.compile(
+    r"\b(total|totals|sum|revenue|spend|spent|sales|sold|purchas\w*|bills?|amount|monthly|daily|per|by|month|year|trend)\b",
+    re.IGNORECASE,
+)
+
+
+def wants_rollups(question: str) -> bool:
+    return bool(AGGREGATE_WORDS.search(question))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Install, check or drop the trigger-maintained rollup tables")
+    parser.add_argument("action", choices=["install", "check", "drop", "show"])
+    parser.add_argument("--db", default=DB_PATH)
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    try:
+        if args.action == "install":
+            for name, seconds in install(conn).items():
+                rows = conn.execute(f"SELECT COUNT(*) FROM {name}").fetchone()[0]
+                print(f"{name:<26} {rows:>8} rows  {seconds:.3f}s")
+        elif args.action == "check":
+            report = check(conn)
+            if not report:
+                print("No rollups installed.")
+            for name, mismatched in report.items():
+                print(f"{name:<26} {'OK' if not mismatched else f'{mismatched} groups differ'}")
+            if any(report.values()):
+                raise SystemExit(1)
+        elif args.action == "drop":
+            drop(conn)
+            print("Rollups dropped.")
+        else:
+            print(rollup_digest(conn) or "No rollups installed.")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+import re
+import sqlite3
+from collections import deque
+
+from location_state import CLOSURE_TABLE, SNAPSHOT_TABLE, location_digest, wants_location_state
+from rollups import ROLLUP_PREFIX, rollup_digest, wants_rollups
+
+
+# words that show up in almost every question and say nothing about tables
+STOP_WORDS = {
+    "a", "an", "the", "of", "for", "in", "on", "at", "to", "by", "with", "and", "or", "is", "are",
+    "me", "show", "list", "give", "get", "find", "what", "which", "how", "many", "much", "all",
+    "each", "per", "from", "that", "have", "has", "there", "their", "this", "these", "those",
+    "id", "ids", "name", "names", "code", "codes",
+}
+
+# derived tables described to the model by their own digest, not table by table
+DERIVED_PREFIXES = (ROLLUP_PREFIX, CLOSURE_TABLE, SNAPSHOT_TABLE)
+
+# extra vocabulary for tables whose names don't appear in common phrasing
+TABLE_SYNONYMS = {
+    "Customers": {"client", "clients", "buyer", "buyers"},
+    "Vendors": {"supplier", "suppliers"},
+    "Sites": {"office", "offices", "branch", "branches", "hq"},
+    "Locations": {"warehouse", "aisle", "aisles", "bin", "where"},
+    "Items": {"product", "products", "sku", "skus", "part", "parts", "widget", "gadget"},
+    "Assets": {"equipment", "forklift", "vehicle", "maintenance", "tool", "tools"},
+    "Bills": {"invoice", "invoices", "payable", "payables", "owe", "due", "unpaid"},
+    "PurchaseOrders": {"po", "pos", "purchase", "purchases", "purchasing", "bought", "spend"},
+    "PurchaseOrderLines": {"po", "pos", "purchase", "bought", "quantity", "spend"},
+    "SalesOrders": {"so", "sales", "sale", "sold", "order", "orders", "revenue"},
+    "SalesOrderLines": {"sales", "sold", "revenue", "quantity"},
+    "AssetTransactions": {"transaction", "transactions", "moved", "move", "moves", "history", "repair", "transfer"},
+}
+
+
+def split_identifier(name: str) -> list:
+    # "PurchaseOrderLines" -> ["purchase", "order", "lines"], "POId" -> ["po", "id"]
+    parts = re.findall(r"[A-Z]+(?=[A-Z][a-z]|\b|$)|[A-Z]?[a-z]+|\d+", name)
+    return [p.lower() for p in parts]
+
+
+def stem(word: str) -> str:
+    if len(word) > 4 and word.endswith("ies"):
+        return word[:-3] + "y"
+    if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+        return word[:-1]
+    return word
+
+
+def question_terms(question: str) -> set:
+    words = re.findall(r"[a-z0-9]+", question.lower())
+    return {stem(w) for w in words if w not in STOP_WORDS}
+
+
+class SchemaIndex:
+    """
+    Table/column/foreign-key index read from a live SQLite database.
+    `digest_for(question)` picks the tables a question needs, adds the tables
+    on the FK join paths between them and renders a compact DDL digest.
+    """
+
+    def __init__(self, conn: sqlite3.Connection, max_tables: int = 6):
+        self.max_tables = max_tables
+        self.tables = {}
+        self.foreign_keys = {}
+        self.primary_keys = {}
+        self.not_null = {}
+        self.graph = {}
+        table_names = [
+            row[0]
+            for row in conn.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' ORDER BY name"
+            ).fetchall()
+            if not row[0].startswith(DERIVED_PREFIXES)
+        ]
+        # (question filter, digest) for each installed family of derived tables
+        self.derived_notes = [
+            (wants, notes)
+            for wants, notes in ((wants_rollups, rollup_digest(conn)), (wants_location_state, location_digest(conn)))
+            if notes
+        ]
+        for table in table_names:
+            info = conn.execute(f'PRAGMA table_info("{table}")').fetchall()
+            self.tables[table] = [col[1] for col in info]
+            self.primary_keys[table] = [col[1] for col in info if col[5]]
+            self.not_null[table] = {col[1] for col in info if col[3]}
+            self.graph.setdefault(table, set())
+            fks = []
+            for fk in conn.execute(f'PRAGMA foreign_key_list("{table}")').fetchall():
+                ref_table, from_col, to_col = fk[2], fk[3], fk[4]
+                fks.append((from_col, ref_table, to_col))
+                if ref_table != table:
+                    self.graph[table].add(ref_table)
+                    self.graph.setdefault(ref_table, set()).add(table)
+            self.foreign_keys[table] = fks
+        self.table_terms = {}
+        for table, columns in self.tables.items():
+            terms = {stem(p) for p in split_identifier(table)}
+            terms.add(stem(table.lower()))
+            terms |= {stem(s) for s in TABLE_SYNONYMS.get(table, set())}
+            self.table_terms[table] = terms
+        self.column_terms = {
+            table: {col: {stem(p) for p in split_identifier(col)} - {"id"} for col in columns}
+            for table, columns in self.tables.items()
+        }
+
+    def score_tables(self, question: str) -> dict:
+        terms = question_terms(question)
+        scores = {}
+        for table in self.tables:
+            score = 2.0 * len(terms & self.table_terms[table])
+            # the full table name in the question ("purchaseorders") is a strong hint
+            if table.lower() in question.lower().replace(" ", ""):
+                score += 3.0
+            if score == 0:
+                continue
+            # column hits only break ties between tables the question already names
+            for col_terms in self.column_terms[table].values():
+                if col_terms and col_terms <= terms:
+                    score += 0.5
+            scores[table] = score
+        return scores
+
+    def join_path(self, start: str, goal: str) -> list:
+        # shortest FK path between two tables, BFS over the undirected FK graph
+        previous = {start: None}
+        queue = deque([start])
+        while queue:
+            node = queue.popleft()
+            if node == goal:
+                path = []
+                while node is not None:
+                    path.append(node)
+                    node = previous[node]
+                return path[::-1]
+            for neighbour in sorted(self.graph.get(node, ())):
+                if neighbour not in previous:
+                    previous[neighbour] = node
+                    queue.append(neighbour)
+        return []
+
+    def select_tables(self, question: str) -> list:
+        scores = self.score_tables(question)
+        if not scores:
+            return sorted(self.tables)
+        ranked = sorted(scores, key=lambda t: (-scores[t], t))[: self.max_tables]
+        selected = [ranked[0]]
+        for table in ranked[1:]:
+            # connect every extra table to the ones already picked
+            best = None
+            for anchor in selected:
+                path = self.join_path(anchor, table)
+                if path and (best is None or len(path) < len(best)):
+                    best = path
+            for step in best or [table]:
+                if step not in selected:
+                    selected.append(step)
+        return selected
+
+    def relevant_columns(self, table: str, question: str, selected: list) -> list:
+        terms = question_terms(question)
+        keep = []
+        fk_columns = {fk[0] for fk in self.foreign_keys[table] if fk[1] in selected}
+        for col in self.tables[table]:
+            col_terms = self.column_terms[table][col]
+            if (
+                col in self.primary_keys[table]
+                or col in fk_columns
+                or col in self.not_null[table] and col not in ("CreatedAt",)
+                or col_terms & terms
+            ):
+                keep.append(col)
+        return keep
+
+    def render(self, tables: list, question: str = None) -> str:
+        lines = []
+        for table in tables:
+            if question is None:
+                columns = self.tables[table]
+            else:
+                columns = self.relevant_columns(table, question, tables)
+            rendered = []
+            for col in columns:
+                rendered.append(f"{col} PK" if col in self.primary_keys[table] else col)
+            lines.append(f"{table}({', '.join(rendered)})")
+        fk_lines = []
+        for table in tables:
+            for from_col, ref_table, to_col in self.foreign_keys[table]:
+                if ref_table in tables:
+                    fk_lines.append(f"{table}.{from_col} -> {ref_table}.{to_col}")
+        if fk_lines:
+            lines.append("Joins: " + "; ".join(fk_lines))
+        return "\n".join(lines)
+
+    def digest_for(self, question: str) -> str:
+        digest = self.render(self.select_tables(question), question)
+        # totals and where/under questions also get the derived tables, when they are installed
+        for wants, notes in self.derived_notes:
+            if wants(question):
+                digest += "\n" + notes
+        return digest
+
+    def full_digest(self) -> str:
+        return self.render(sorted(self.tables))
@@ -0,0 +1,983 @@
+import argparse
+import json
+import os
+import queue
+import re
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+
+from db_pool import DEFAULT_ROW_BUDGET, DEFAULT_TIME_BUDGET, QueryCancelled, ReadOnlyPool
+from sqlite_seed import DB_PATH
+from streaming import FETCH_BATCH_SIZE
+
+
+MANIFEST = "shards.json"
+SHARED_FILE = "shared.db"
+# Locations are global: transfers move assets to other sites' locations, and a transaction
+# lives in its asset's shard, so both ends of a transfer have to resolve from every shard
+GLOBAL_TABLES = ("Customers", "Vendors", "Sites", "Locations", "Items", "Bills")
+# site-owned tables and the rows of the source (attached as src) that belong to one site;
+# lines and transactions follow their header or asset, so joins along those keys stay inside a shard
+SITE_TABLES = {
+    "Assets": "SiteId IS :site",
+    "PurchaseOrders": "SiteId IS :site",
+    "PurchaseOrderLines": "POId IN (SELECT POId FROM src.PurchaseOrders WHERE SiteId IS :site)",
+    "SalesOrders": "SiteId IS :site",
+    "SalesOrderLines": "SOId IN (SELECT SOId FROM src.SalesOrders WHERE SiteId IS :site)",
+    "AssetTransactions": "AssetId IN (SELECT AssetId FROM src.Assets WHERE SiteId IS :site)",
+}
+SITE_COLUMN_TABLES = ("Assets", "PurchaseOrders", "SalesOrders")
+SITE_LOOKUP = {table.lower(): table for table in SITE_TABLES}
+# each shard's AUTOINCREMENT counters start in their own block so ids stay unique across shards
+ID_BLOCK = 1 << 40
+UNSITED = "unsited"
+# SQLITE_MAX_ATTACHED in a stock build; the federated connection attaches every shard
+MAX_ATTACHED = 10
+
+
+# BUILDING THE SHARDS
+
+def _create(conn: sqlite3.Connection, tables: list, table_sql: dict, index_sql: dict):
+    for table in tables:
+        conn.execute(table_sql[table])
+        for sql in index_sql.get(table, []):
+            conn.execute(sql)
+
+
+def build_shards(source: str, directory: str) -> dict:
+    """
+    Splits `source` into `directory`: shared.db holds the global tables (and
+    the empty site tables, so the schema is complete in one file), site_<id>.db
+    holds one site's rows of the site tables, and site_unsited.db the orders
+    without a site, if any. Derived tables and triggers are not copied.
+    Writes shards.json and returns seconds per file.
+    """
+    os.makedirs(directory, exist_ok=True)
+    src = sqlite3.connect(f"file:{source}?mode=ro", uri=True)
+    table_sql = dict(src.execute("SELECT name, sql FROM sqlite_master WHERE type = 'table'").fetchall())
+    index_sql = {}
+    for table, sql in src.execute("SELECT tbl_name, sql FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL"):
+        index_sql.setdefault(table, []).append(sql)
+    sites = [row[0] for row in src.execute("SELECT SiteId FROM Sites ORDER BY SiteId").fetchall()]
+    unsited = any(
+        src.execute(f"SELECT 1 FROM {table} WHERE SiteId IS NULL LIMIT 1").fetchone() for table in SITE_COLUMN_TABLES
+    )
+    src.close()
+
+    manifest = {"source": source, "shared": SHARED_FILE, "shards": {}, "site_tables": list(SITE_TABLES),
+                "global_tables": list(GLOBAL_TABLES)}
+    keys = [str(site) for site in sites] + ([UNSITED] if unsited else [])
+    timings = {}
+    for number, key in enumerate([None] + keys):
+        name = SHARED_FILE if key is None else f"site_{key}.db"
+        path = os.path.join(directory, name)
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+        started = time.perf_counter()
+        conn = sqlite3.connect(path)
+        conn.execute("ATTACH DATABASE ? AS src", (f"file:{source}?mode=ro",))
+        with conn:
+            if key is None:
+                _create(conn, list(GLOBAL_TABLES) + list(SITE_TABLES), table_sql, index_sql)
+                for table in GLOBAL_TABLES:
+                    conn.execute(f"INSERT INTO main.{table} SELECT * FROM src.{table}")
+            else:
+                _create(conn, list(SITE_TABLES), table_sql, index_sql)
+                site = None if key == UNSITED else int(key)
+                for table, condition in SITE_TABLES.items():
+                    conn.execute(f"INSERT INTO main.{table} SELECT * FROM src.{table} WHERE {condition}", {"site": site})
+                for table in SITE_TABLES:
+                    conn.execute("INSERT OR REPLACE INTO sqlite_sequence (name, seq) VALUES (?, MAX(?, IFNULL((SELECT MAX(rowid) FROM "
+                                 f"{table}), 0)))", (table, number * ID_BLOCK))
+                manifest["shards"][key] = name
+        conn.execute("DETACH DATABASE src")
+        conn.execute("ANALYZE")
+        conn.close()
+        timings[name] = round(time.perf_counter() - started, 3)
+    with open(os.path.join(directory, MANIFEST), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    if len(keys) > MAX_ATTACHED:
+        print(f"warning: {len(keys)} shards, SQLite attaches at most {MAX_ATTACHED}; statements that can't be fanned out "
+              "(subqueries, CTEs, window functions, COUNT(DISTINCT), compound selects) will fail", file=sys.stderr)
+    return timings
+
+
+# PARSING JUST ENOUGH OF A SELECT TO SPLIT IT ACROSS SHARDS
+
+AGGREGATES = ("count", "sum", "avg", "min", "max", "total")
+AGGREGATE_PATTERN = re.compile(r"\b(count|sum|avg|min|max|total|group_concat)\s*\(", re.IGNORECASE)
+CLAUSE_PATTERN = re.compile(
+    r"\b(select|from|where|group\s+by|having|order\s+by|limit|union|intersect|except|window)\b", re.IGNORECASE
+)
+LIMIT_PATTERN = re.compile(r"^limit\s+(\d+)(?:\s*(?:offset\s+(\d+)|,\s*(\d+)))?$", re.IGNORECASE)
+ALIAS_TAIL = re.compile(r"^(.*?[\w)\]\"'`])\s+(?:as\s+)?(\"[^\"]+\"|\[[^\]]+\]|`[^`]+`|[A-Za-z_]\w*)$", re.IGNORECASE | re.DOTALL)
+# a name, bare or quoted, with one group per quoting style
+QUOTED_NAME = re.compile(r'"([^"]+)"|\[([^\]]+)\]|`([^`]+)`|([A-Za-z_]\w*)')
+NOT_ALIASES = {"null", "end", "true", "false", "asc", "desc", "and", "or", "not", "is", "in", "like", "glob", "between",
+               "else", "then", "when", "distinct", "current_date", "current_time", "current_timestamp", "collate"}
+
+
+class Unsupported(sqlite3.OperationalError):
+    # the statement can't be split across shards (it runs on the federated connection instead),
+    # or can't be federated either because there are too many shards to attach
+    pass
+
+
+def mask(sql: str, parens: bool = True) -> str:
+    # same length as sql, with string literals, quoted names and (optionally) everything inside parentheses blanked
+    out = []
+    depth = 0
+    quote = None
+    for ch in sql:
+        if quote:
+            out.append(" ")
+            if ch == quote:
+                quote = None
+            continue
+        if ch in "'\"`[":
+            quote = "]" if ch == "[" else ch
+            out.append(" ")
+            continue
+        if ch == "(":
+            depth += 1
+            out.append("(" if depth == 1 or not parens else " ")
+            continue
+        if ch == ")":
+            depth -= 1
+            out.append(")" if depth == 0 or not parens else " ")
+            continue
+        out.append(" " if parens and depth else ch)
+    return "".join(out)
+
+
+def split_top(text: str, pattern: str = ",") -> list:
+    masked = mask(text)
+    parts = []
+    last = 0
+    for m in re.finditer(pattern, masked, re.IGNORECASE):
+        parts.append(text[last:m.start()].strip())
+        last = m.end()
+    parts.append(text[last:].strip())
+    return parts
+
+
+def squash(text: str) -> str:
+    return re.sub(r"\s+", " ", text.strip()).lower()
+
+
+def output_name(expr: str, alias: str) -> str:
+    # the column name SQLite reports: the alias, the bare column name, or the expression as written
+    if alias:
+        return alias.strip('"[]`')
+    m = re.fullmatch(r"(?:\w+\.)?(\w+)", expr.strip())
+    return m.group(1) if m else expr.strip()
+
+
+def split_alias(item: str):
+    # "x AS y", "SUM(x) total" and "CASE ... END Status" have an alias; "a.Name" and "x IS NULL" don't
+    m = ALIAS_TAIL.match(item.strip())
+    if m and m.group(2).lower() not in NOT_ALIASES and not re.fullmatch(r"\w+\.\w+", item.strip()):
+        return m.group(1).strip(), m.group(2)
+    return item.strip(), None
+
+
+def aggregate_calls(expr: str) -> list:
+    """
+    Outermost aggregate calls in expr as (start, end, name, args). MIN/MAX
+    with several arguments are scalar functions and skipped.
+    """
+    masked = mask(expr, parens=False)
+    calls = []
+    position = 0
+    while True:
+        m = AGGREGATE_PATTERN.search(masked, position)
+        if m is None:
+            return calls
+        depth = 0
+        for end in range(m.end() - 1, len(masked)):
+            if masked[end] == "(":
+                depth += 1
+            elif masked[end] == ")":
+                depth -= 1
+                if depth == 0:
+                    break
+        else:
+            raise Unsupported("unbalanced parentheses")
+        name = m.group(1).lower()
+        args = expr[m.end():end].strip()
+        if name in ("min", "max") and len(split_top(args)) > 1:
+            position = m.end()
+            continue
+        if name == "group_concat":
+            raise Unsupported("GROUP_CONCAT order can't be merged")
+        if re.match(r"distinct\b", args, re.IGNORECASE):
+            if name not in ("min", "max"):
+                raise Unsupported(f"{name.upper()}(DISTINCT ...) can't be merged from shards")
+            args = args[8:].strip()
+        if AGGREGATE_PATTERN.search(mask(args, parens=False)):
+            raise Unsupported("nested aggregates")
+        calls.append((m.start(), end + 1, name, args))
+        position = end + 1
+
+
+class FanoutPlan:
+    """
+    How one SELECT runs across shards: `shard_sql` runs on every shard, and
+    when `merge` is set the partial rows are loaded into an in-memory table
+    `partials` (columns c0, c1, ...) and `merge(columns)` gives the final SQL.
+    Without a merge the shard rows are streamed through, `limit` applied.
+    """
+
+    def __init__(self, shard_sql: str, merge=None, limit: int = None, hidden: int = 0, columns: list = None):
+        self.shard_sql = shard_sql
+        self.merge = merge
+        self.limit = limit
+        self.hidden = hidden
+        # names of the partials columns when known up front, so the merge can be checked before any shard runs
+        self.columns = columns
+
+    def check(self):
+        if self.columns is None:
+            return
+        conn = sqlite3.connect(":memory:")
+        try:
+            conn.execute(f"CREATE TABLE partials ({', '.join(self.columns)})")
+            conn.execute("EXPLAIN " + self.merge(self.columns))
+        except sqlite3.OperationalError as e:
+            raise Unsupported(f"partial results can't be merged: {e}") from e
+        finally:
+            conn.close()
+
+
+def parse_select(sql: str) -> dict:
+    text = sql.strip().rstrip(";").strip()
+    string_masked = mask(text, parens=False)
+    if not re.match(r"select\b", text, re.IGNORECASE):
+        raise Unsupported("only a plain SELECT is split across shards")
+    if len(re.findall(r"\bselect\b", string_masked, re.IGNORECASE)) > 1:
+        raise Unsupported("subqueries")
+    if re.search(r"\bover\s*\(|\bover\s+\w+", string_masked, re.IGNORECASE):
+        raise Unsupported("window functions")
+    masked = mask(text)
+    found = [(m.start(), m.end(), squash(m.group(1))) for m in CLAUSE_PATTERN.finditer(masked)]
+    names = [name for _, _, name in found]
+    if any(name in ("union", "intersect", "except", "window") for name in names) or len(set(names)) != len(names):
+        raise Unsupported("compound statements")
+    order = ["select", "from", "where", "group by", "having", "order by", "limit"]
+    if names != sorted(names, key=order.index) or "from" not in names:
+        raise Unsupported("unexpected clause order")
+    parts = {}
+    for i, (start, end, name) in enumerate(found):
+        stop = found[i + 1][0] if i + 1 < len(found) else len(text)
+        parts[name] = text[end:stop].strip() if name != "limit" else text[start:stop].strip()
+    select = parts["select"]
+    parts["distinct"] = bool(re.match(r"distinct\b", select, re.IGNORECASE))
+    if parts["distinct"]:
+        select = select[8:].strip()
+    elif re.match(r"all\b", select, re.IGNORECASE):
+        select = select[3:].strip()
+    parts["items"] = [split_alias(item) for item in split_top(select)]
+    parts["group by"] = split_top(parts["group by"]) if "group by" in parts else []
+    order_terms = []
+    for term in split_top(parts.get("order by", "")) if "order by" in parts else []:
+        m = re.match(r"^(.*?)(\s+(?:asc|desc))?(\s+nulls\s+(?:first|last))?$", term, re.IGNORECASE | re.DOTALL)
+        order_terms.append((m.group(1).strip(), (m.group(2) or "") + (m.group(3) or "")))
+    parts["order by"] = order_terms
+    parts["limit_count"] = parts["offset"] = None
+    if "limit" in parts:
+        m = LIMIT_PATTERN.match(squash(parts["limit"]))
+        if m is None:
+            raise Unsupported("LIMIT must be a number")
+        if m.group(3) is not None:
+            parts["offset"], parts["limit_count"] = int(m.group(1)), int(m.group(3))
+        else:
+            parts["limit_count"], parts["offset"] = int(m.group(1)), int(m.group(2) or 0)
+    return parts
+
+
+def _tail(parts: dict) -> str:
+    sql = f" FROM {parts['from']}"
+    if "where" in parts:
+        sql += f" WHERE {parts['where']}"
+    return sql
+
+
+def _limit_sql(limit: int, offset: int) -> str:
+    if limit is None:
+        return ""
+    return f" LIMIT {limit}" + (f" OFFSET {offset}" if offset else "")
+
+
+def check_joins(from_clause: str):
+    """
+    Every result row has to come from exactly one shard: at least one site
+    table must be inner joined (or first in FROM). Otherwise, as in
+    "Customers LEFT JOIN SalesOrders", each shard would repeat the global rows.
+    """
+    masked = mask(from_clause)
+    if re.search(r"\b(right|full)\b", masked, re.IGNORECASE):
+        raise Unsupported("RIGHT and FULL joins")
+    pieces = re.split(r"(,|\bjoin\b)", masked, flags=re.IGNORECASE)
+    optional = False
+    position = 0
+    for piece in pieces:
+        text = from_clause[position:position + len(piece)]
+        position += len(piece)
+        if piece.lower() in (",", "join"):
+            continue
+        m = re.match(r"\s*(?:" + QUOTED_NAME.pattern + ")", text)
+        if m and next(part for part in m.groups() if part).lower() in SITE_LOOKUP and not optional:
+            return
+        # the keyword ending this piece decides whether the next table is optional
+        optional = re.search(r"\b(left|outer)\s*$", piece, re.IGNORECASE) is not None
+    raise Unsupported("no site table is inner joined")
+
+
+def plan_fanout(sql: str) -> FanoutPlan:
+    parts = parse_select(sql)
+    check_joins(parts["from"])
+    items = parts["items"]
+    has_aggregates = any(aggregate_calls(expr) for expr, _ in items) or any(
+        aggregate_calls(text) for text in [parts.get("having", "")] + [t for t, _ in parts["order by"]]
+    )
+    if has_aggregates or parts["group by"]:
+        return _plan_aggregate(parts)
+    return _plan_rows(parts)
+
+
+def _plan_rows(parts: dict) -> FanoutPlan:
+    items = parts["items"]
+    names = [output_name(expr, alias).lower() for expr, alias in items]
+    limit, offset = parts["limit_count"], parts["offset"] or 0
+    pushed = _limit_sql(limit + offset, 0) if limit is not None else ""
+    select = "SELECT " + ("DISTINCT " if parts["distinct"] else "") + ", ".join(
+        f"{expr} AS {alias}" if alias else expr for expr, alias in items
+    )
+    if not parts["order by"] and not parts["distinct"] and not offset:
+        return FanoutPlan(select + _tail(parts) + pushed, limit=limit)
+    # ORDER BY terms become positions in the partials table, or hidden columns appended to the select
+    hidden = []
+    order = []
+    star = any(expr.strip().endswith("*") for expr, _ in items)
+    for term, direction in parts["order by"]:
+        if term.isdigit():
+            order.append((int(term) - 1, direction))
+        elif not star and squash(term).strip('"[]`') in names:
+            order.append((names.index(squash(term).strip('"[]`')), direction))
+        elif not star and squash(term) in [squash(expr) for expr, _ in items]:
+            order.append(([squash(expr) for expr, _ in items].index(squash(term)), direction))
+        else:
+            hidden.append(term)
+            order.append((("hidden", len(hidden) - 1), direction))
+    if hidden and parts["distinct"]:
+        raise Unsupported("DISTINCT with ORDER BY on a column that isn't selected")
+    shard_sql = select + "".join(f", {term} AS _o{i}" for i, term in enumerate(hidden)) + _tail(parts)
+    if parts["order by"]:
+        shard_sql += " ORDER BY " + ", ".join(f"{t}{d}" for t, d in parts["order by"])
+    shard_sql += pushed
+
+    def merge(columns: list) -> str:
+        visible = len(columns) - len(hidden)
+        positions = [visible + p[1] if isinstance(p, tuple) else p for p, _ in order]
+        sql = "SELECT " + ("DISTINCT " if parts["distinct"] else "") + ", ".join(
+            f'c{i} AS "{columns[i]}"' for i in range(visible)
+        ) + " FROM partials"
+        if order:
+            sql += " ORDER BY " + ", ".join(f"c{p}{d}" for p, (_, d) in zip(positions, order))
+        return sql + _limit_sql(limit, offset)
+
+    return FanoutPlan(shard_sql, merge=merge, hidden=len(hidden))
+
+
+def _plan_aggregate(parts: dict) -> FanoutPlan:
+    items = parts["items"]
+    if any(expr.strip().endswith("*") and not aggregate_calls(expr) for expr, _ in items):
+        raise Unsupported("SELECT * with aggregates")
+    by_alias = {output_name(expr, alias).lower(): expr for expr, alias in items if alias}
+    group_exprs = []
+    for term in parts["group by"]:
+        if term.isdigit():
+            term = items[int(term) - 1][0]
+        group_exprs.append(by_alias.get(squash(term).strip('"[]`'), term))
+    partials = []
+
+    def rewrite(expr: str) -> str:
+        # aggregates -> merges of partial columns, group keys -> their g columns
+        out = []
+        last = 0
+        for start, end, name, args in aggregate_calls(expr):
+            out.append(_group_refs(expr[last:start], group_exprs))
+            if name == "avg":
+                partials.extend([f"SUM({args})", f"COUNT({args})"])
+                out.append(f"(CAST(SUM(p{len(partials) - 2}) AS REAL) / SUM(p{len(partials) - 1}))")
+            else:
+                partials.append(f"{name.upper()}({args})")
+                merged = {"count": "SUM", "sum": "SUM", "total": "TOTAL", "min": "MIN", "max": "MAX"}[name]
+                out.append(f"{merged}(p{len(partials) - 1})")
+            last = end
+        out.append(_group_refs(expr[last:], group_exprs))
+        return "".join(out)
+
+    names = [output_name(expr, alias) for expr, alias in items]
+    select = [f'{rewrite(expr)} AS "{name}"' for (expr, _), name in zip(items, names)]
+    having = rewrite(parts["having"]) if "having" in parts else None
+    order = []
+    for term, direction in parts["order by"]:
+        if term.isdigit() or squash(term).strip('"[]`') in [n.lower() for n in names]:
+            order.append(f"{term}{direction}")
+        else:
+            order.append(f"{rewrite(term)}{direction}")
+    columns = [f"{expr} AS g{i}" for i, expr in enumerate(group_exprs)] + [f"{p} AS p{i}" for i, p in enumerate(partials)]
+    shard_sql = "SELECT " + ", ".join(columns) + _tail(parts)
+    if group_exprs:
+        shard_sql += " GROUP BY " + ", ".join(group_exprs)
+    merge_sql = "SELECT " + ("DISTINCT " if parts["distinct"] else "") + ", ".join(select) + " FROM partials"
+    if group_exprs:
+        merge_sql += " GROUP BY " + ", ".join(f"g{i}" for i in range(len(group_exprs)))
+    if having:
+        merge_sql += f" HAVING {having}"
+    if order:
+        merge_sql += " ORDER BY " + ", ".join(order)
+    merge_sql += _limit_sql(parts["limit_count"], parts["offset"])
+    names = [f"g{i}" for i in range(len(group_exprs))] + [f"p{i}" for i in range(len(partials))]
+    return FanoutPlan(shard_sql, merge=lambda _: merge_sql, columns=names)
+
+
+def _group_refs(text: str, group_exprs: list) -> str:
+    for i, expr in sorted(enumerate(group_exprs), key=lambda e: -len(e[1])):
+        text = re.sub(r"(?<![\w.])" + re.escape(expr.strip()) + r"(?![\w])", f"g{i}", text, flags=re.IGNORECASE)
+    return text
+
+
+def table_refs(sql: str) -> dict:
+    """
+    alias -> table for every table named in a FROM clause, subqueries
+    included; each table also maps to itself.
+    """
+    masked = mask(sql, parens=False)
+    refs = {}
+    for m in re.finditer(r"\bfrom\b", masked, re.IGNORECASE):
+        end = re.search(r"\b(where|group|order|limit|having|union|intersect|except|window|select)\b|\)", masked[m.end():], re.IGNORECASE)
+        stop = m.end() + end.start() if end else len(masked)
+        # split on the masked text, read the names from the original so quoted ones count too
+        cuts = [(c.start(), c.end()) for c in re.finditer(r",|\bjoin\b", masked[m.end():stop], re.IGNORECASE)]
+        bounds = zip([0] + [e for _, e in cuts], [s for s, _ in cuts] + [stop - m.end()])
+        for first, last in bounds:
+            piece = sql[m.end() + first:m.end() + last]
+            on = re.search(r"\b(?:on|using)\b", masked[m.end() + first:m.end() + last], re.IGNORECASE)
+            words = [next(part for part in name if part) for name in QUOTED_NAME.findall(piece[:on.start()] if on else piece)]
+            words = [w for w in words if w.lower() not in ("as", "left", "right", "full", "inner", "outer", "cross", "natural")]
+            if not words or piece.strip().startswith("("):
+                continue
+            refs[words[0]] = words[0]
+            if len(words) > 1:
+                refs[words[1]] = words[0]
+    return refs
+
+
+def site_filter(sql: str, site_ids: dict):
+    """
+    Sites a query is restricted to by its top-level WHERE: "x.SiteId = 3",
+    "SiteId IN (1, 2)" or "s.SiteCode = 'NYC'" on Sites joined by SiteId.
+    Returns a set of SiteIds, or None when the query may touch every site.
+    """
+    string_masked = mask(sql, parens=False)
+    if len(re.findall(r"\bselect\b", string_masked, re.IGNORECASE)) > 1:
+        return None
+    masked = mask(sql)
+    where = re.search(r"\bwhere\b", masked, re.IGNORECASE)
+    if where is None:
+        return None
+    end = re.search(r"\b(group\s+by|having|order\s+by|limit|window|union|intersect|except)\b", masked[where.end():], re.IGNORECASE)
+    where_text = sql[where.end():where.end() + end.start() if end else len(sql)]
+    if re.search(r"\bor\b", mask(where_text), re.IGNORECASE):
+        return None
+    aliases = table_refs(sql)
+    sites = None
+    for conjunct in split_top(where_text, r"\band\b"):
+        found = None
+        m = re.fullmatch(r"(?:(\w+)\.)?SiteId\s*=\s*(\d+)|(\d+)\s*=\s*(?:(\w+)\.)?SiteId", conjunct, re.IGNORECASE)
+        if m:
+            alias = m.group(1) or m.group(4)
+            if alias is None or SITE_LOOKUP.get(aliases.get(alias, alias).lower()) in SITE_COLUMN_TABLES:
+                found = {int(m.group(2) or m.group(3))}
+        m = re.fullmatch(r"(?:(\w+)\.)?SiteId\s+IN\s*\(\s*(\d+(?:\s*,\s*\d+)*)\s*\)", conjunct, re.IGNORECASE)
+        if m and (m.group(1) is None or SITE_LOOKUP.get(aliases.get(m.group(1), m.group(1)).lower()) in SITE_COLUMN_TABLES):
+            found = {int(v) for v in m.group(2).split(",")}
+        m = re.fullmatch(r"(?:(\w+)\.)?(SiteCode|SiteName)\s*=\s*'((?:[^']|'')*)'", conjunct, re.IGNORECASE)
+        if m:
+            alias = m.group(1) or "Sites"
+            joined = re.search(rf"\b{alias}\.SiteId\s*=\s*\w+\.SiteId\b|\b\w+\.SiteId\s*=\s*{alias}\.SiteId\b", sql, re.IGNORECASE)
+            if aliases.get(alias, alias).lower() == "sites" and joined:
+                value = m.group(3).replace("''", "'")
+                found = {site for (column, text), site in site_ids.items() if column == m.group(2).lower() and text == value}
+        if found is not None:
+            sites = found if sites is None else sites & found
+    return sites
+
+
+# RUNNING QUERIES
+
+class ShardPool(ReadOnlyPool):
+    # a shard's read-only connections, each with the shared file attached so global tables resolve
+    def __init__(self, db_path: str, shared_path: str, **kwargs):
+        self.shared_path = shared_path
+        super().__init__(db_path, **kwargs)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True, check_same_thread=False)
+        conn.execute("ATTACH DATABASE ? AS shared", (f"file:{self.shared_path}?mode=ro",))
+        conn.execute("PRAGMA query_only = ON")
+        return conn
+
+
+class FederatedPool(ReadOnlyPool):
+    """
+    Connections on shared.db with every shard attached and a TEMP VIEW per
+    site table (a UNION ALL over the shards) shadowing its empty copy, so any
+    statement runs unchanged, on one core. SQLite attaches at most
+    MAX_ATTACHED files, see ShardedDatabase.federated_pool.
+    """
+
+    def __init__(self, shared_path: str, shard_paths: dict, **kwargs):
+        self.shard_paths = shard_paths
+        super().__init__(shared_path, **kwargs)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True, check_same_thread=False)
+        for key, path in self.shard_paths.items():
+            conn.execute("ATTACH DATABASE ? AS ?", (f"file:{path}?mode=ro", f"shard_{key}"))
+        for table in SITE_TABLES:
+            union = " UNION ALL ".join(f"SELECT * FROM shard_{key}.{table}" for key in self.shard_paths)
+            conn.execute(f"CREATE TEMP VIEW {table} AS {union}")
+        # temp views need a writable temp schema, so query_only comes last
+        conn.execute("PRAGMA query_only = ON")
+        return conn
+
+
+class PooledCursor:
+    # a statement on one pooled connection, the connection goes back when closed
+    def __init__(self, pool: ReadOnlyPool, sql_query: str, params, time_budget, row_budget):
+        self.stack = ExitStack()
+        try:
+            self.guard = self.stack.enter_context(pool.query(time_budget, row_budget))
+            self.guard.execute(sql_query, params)
+        except BaseException:
+            self.stack.close()
+            raise
+        self.description = self.guard.description
+
+    def fetchmany(self, size: int = FETCH_BATCH_SIZE) -> list:
+        return self.guard.fetchmany(size)
+
+    def close(self):
+        self.stack.close()
+
+
+class FanoutCursor:
+    """
+    Runs shard_sql on several shards at once on the database's thread pool.
+    Rows come back through a bounded queue, so a streamed result holds a few
+    batches per shard at most; with a merge, all partial rows are loaded into
+    an in-memory table first and the merge query's rows are returned.
+    """
+
+    def __init__(self, db, plan: FanoutPlan, keys: list, time_budget, row_budget):
+        self.plan = plan
+        self.stop = threading.Event()
+        self.queue = queue.Queue(maxsize=4 * len(keys))
+        self.running = len(keys)
+        self.returned = 0
+        self.merged = None
+        plan.check()
+        for key in keys:
+            db.executor.submit(self._run, db.pools[key], plan.shard_sql, time_budget, row_budget)
+        kind, value = self._next()
+        if kind == "error":
+            self.close()
+            raise value
+        self.description = value
+        self.buffer = []
+        if plan.merge is not None:
+            self._merge()
+
+    def _put(self, item):
+        while not self.stop.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def _run(self, pool, sql_query: str, time_budget, row_budget):
+        try:
+            with pool.query(time_budget, row_budget) as guard:
+                guard.execute(sql_query)
+                self._put(("description", guard.description))
+                while not self.stop.is_set():
+                    batch = guard.fetchmany(FETCH_BATCH_SIZE)
+                    if not batch:
+                        break
+                    self._put(("rows", batch))
+        except BaseException as e:
+            self._put(("error", e))
+        finally:
+            self._put(("done", None))
+
+    def _next(self):
+        # the next description, rows or error message; ("done", None) once every shard finished
+        while self.running:
+            kind, value = self.queue.get()
+            if kind == "done":
+                self.running -= 1
+                continue
+            if kind == "description" and getattr(self, "description", None) is not None:
+                continue
+            return kind, value
+        return "done", None
+
+    def _batches(self):
+        while True:
+            kind, value = self._next()
+            if kind == "error":
+                self.close()
+                raise value
+            if kind == "done":
+                return
+            if kind == "rows":
+                yield value
+
+    def _merge(self):
+        names = [col[0] for col in self.description]
+        columns = self.plan.columns or [f"c{i}" for i in range(len(names))]
+        conn = sqlite3.connect(":memory:", check_same_thread=False)
+        try:
+            conn.execute(f"CREATE TABLE partials ({', '.join(columns)})")
+            insert = f"INSERT INTO partials VALUES ({', '.join('?' * len(columns))})"
+            for batch in self._batches():
+                conn.executemany(insert, batch)
+            self.merged = conn.execute(self.plan.merge(names))
+        except BaseException:
+            conn.close()
+            raise
+        self.description = self.merged.description
+        self.conn = conn
+
+    def fetchmany(self, size: int = FETCH_BATCH_SIZE) -> list:
+        if self.merged is not None:
+            return self.merged.fetchmany(size)
+        limit = self.plan.limit
+        while len(self.buffer) < size and (limit is None or self.returned + len(self.buffer) < limit):
+            batch = next(self._batches(), None)
+            if batch is None:
+                break
+            self.buffer.extend(batch)
+        take = size if limit is None else min(size, limit - self.returned)
+        rows, self.buffer = self.buffer[:take], self.buffer[take:]
+        self.returned += len(rows)
+        if not rows:
+            self.close()
+        return rows
+
+    def close(self):
+        self.stop.set()
+        if self.merged is not None:
+            self.conn.close()
+            self.merged = None
+
+
+class ShardedGuard:
+    """
+    Cursor-like handle for a ShardedDatabase, used like a db_pool.QueryGuard:
+    execute() picks a strategy (shared, single, fanout or federated, see
+    ShardedDatabase.open) and fetchmany() reads its rows. The row budget
+    applies to the merged result.
+    """
+
+    def __init__(self, db, time_budget: float, row_budget: int):
+        self.db = db
+        self.time_budget = time_budget
+        self.row_budget = row_budget
+        self.source = None
+        self.strategy = None
+        self.rows_fetched = 0
+
+    @property
+    def description(self):
+        return self.source.description if self.source is not None else None
+
+    def execute(self, sql_query: str, params=()):
+        self.close()
+        self.rows_fetched = 0
+        self.source, self.strategy = self.db.open(sql_query, params, self.time_budget, self.row_budget)
+        return self
+
+    def fetchmany(self, size: int = FETCH_BATCH_SIZE) -> list:
+        rows = self.source.fetchmany(size)
+        self.rows_fetched += len(rows)
+        if self.row_budget and self.rows_fetched > self.row_budget:
+            self.close()
+            raise QueryCancelled(f"query cancelled after returning more than {self.row_budget} rows")
+        return rows
+
+    def fetchone(self):
+        rows = self.fetchmany(1)
+        return rows[0] if rows else None
+
+    def fetchall(self) -> list:
+        rows = []
+        while True:
+            batch = self.fetchmany(500)
+            if not batch:
+                return rows
+            rows.extend(batch)
+
+    def __iter__(self):
+        while True:
+            batch = self.fetchmany(500)
+            if not batch:
+                return
+            yield from batch
+
+    def close(self):
+        if self.source is not None:
+            self.source.close()
+            self.source = None
+
+
+class ShardedDatabase:
+    """
+    The shards written by build_shards(), with the ReadOnlyPool interface:
+    `with db.query() as cur: cur.execute(sql)`. Each statement is routed:
+
+    - shared: no site table involved, runs on shared.db
+    - single: the WHERE pins one site, runs unchanged on that shard
+    - fanout: runs on every (pinned) shard in parallel; aggregates are split
+      into partials (AVG as SUM and COUNT) and merged, ORDER BY/LIMIT are
+      pushed down and re-applied, DISTINCT re-applied
+    - federated: anything the splitter can't handle (subqueries, CTEs,
+      window functions, COUNT(DISTINCT), compound selects) runs unchanged
+      over UNION ALL views of all shards; with more than MAX_ATTACHED shards
+      these statements fail with Unsupported
+    """
+
+    def __init__(self, directory: str, size: int = 2, workers: int = None,
+                 time_budget: float = DEFAULT_TIME_BUDGET, row_budget: int = DEFAULT_ROW_BUDGET):
+        with open(os.path.join(directory, MANIFEST), "r", encoding="utf-8") as f:
+            self.manifest = json.load(f)
+        if self.manifest["site_tables"] != list(SITE_TABLES):
+            raise ValueError(f"the shards in {directory} were split differently, rebuild them with: sharding.py build --dir {directory}")
+        self.directory = directory
+        self.time_budget = time_budget
+        self.row_budget = row_budget
+        self.shared_path = os.path.join(directory, self.manifest["shared"])
+        self.shard_paths = {key: os.path.join(directory, name) for key, name in self.manifest["shards"].items()}
+        self.site_tables = set(self.manifest["site_tables"])
+        pool_args = {"size": size, "time_budget": time_budget, "row_budget": row_budget}
+        self.shared = ReadOnlyPool(self.shared_path, **pool_args)
+        self.pools = {key: ShardPool(path, self.shared_path, **pool_args) for key, path in self.shard_paths.items()}
+        self.pool_args = pool_args
+        # built on the first federated statement, most questions never need it
+        self.federated = None
+        self.executor = ThreadPoolExecutor(max_workers=workers or len(self.pools) * size, thread_name_prefix="shard")
+        self.lock = threading.Lock()
+        self.counts = {"shared": 0, "single": 0, "fanout": 0, "federated": 0, "shards_queried": 0}
+        with self.shared.query() as cur:
+            self.site_ids = {}
+            for site, code, name in cur.execute("SELECT SiteId, SiteCode, SiteName FROM Sites").fetchall():
+                self.site_ids[("sitecode", code)] = site
+                self.site_ids[("sitename", name)] = site
+
+    @contextmanager
+    def query(self, time_budget: float = None, row_budget: int = None):
+        guard = ShardedGuard(
+            self,
+            self.time_budget if time_budget is None else time_budget,
+            self.row_budget if row_budget is None else row_budget,
+        )
+        try:
+            yield guard
+        finally:
+            guard.close()
+
+    def federated_pool(self) -> FederatedPool:
+        if len(self.shard_paths) > MAX_ATTACHED:
+            raise Unsupported(
+                f"this statement has to run over all {len(self.shard_paths)} shards at once and SQLite attaches at most "
+                f"{MAX_ATTACHED}; rewrite it without subqueries, CTEs, window functions, COUNT(DISTINCT) or compound selects"
+            )
+        with self.lock:
+            if self.federated is None:
+                self.federated = FederatedPool(self.shared_path, self.shard_paths, **self.pool_args)
+        return self.federated
+
+    def _count(self, strategy: str, shards: int):
+        with self.lock:
+            self.counts[strategy] += 1
+            self.counts["shards_queried"] += shards
+
+    def route(self, sql_query: str) -> list:
+        # shard keys a statement has to run on, [] when it only reads global tables
+        if not any(table.lower() in SITE_LOOKUP for table in table_refs(sql_query).values()):
+            return []
+        sites = site_filter(sql_query, self.site_ids)
+        if sites is None:
+            return list(self.pools)
+        keys = [str(site) for site in sorted(sites) if str(site) in self.pools]
+        # a site with no shard has no rows; any one shard gives the (empty) answer
+        return keys or list(self.pools)[:1]
+
+    def open(self, sql_query: str, params, time_budget: float, row_budget: int):
+        """
+        Starts `sql_query` and returns (cursor-like, strategy). EXPLAIN runs on
+        the first shard, which has every table; PRAGMAs on shared.db.
+        """
+        statement = sql_query.strip().rstrip(";").strip()
+        head = statement[:8].lower()
+        if head.startswith("explain"):
+            return PooledCursor(next(iter(self.pools.values())), statement, params, time_budget, row_budget), "explain"
+        if head.startswith("pragma"):
+            return PooledCursor(self.shared, statement, params, time_budget, row_budget), "shared"
+        keys = self.route(statement)
+        if not keys:
+            self._count("shared", 0)
+            return PooledCursor(self.shared, statement, params, time_budget, row_budget), "shared"
+        if len(keys) == 1 and not params:
+            self._count("single", 1)
+            return PooledCursor(self.pools[keys[0]], statement, params, time_budget, row_budget), "single"
+        if not params:
+            try:
+                cursor = FanoutCursor(self, plan_fanout(statement), keys, time_budget, row_budget)
+                self._count("fanout", len(keys))
+                return cursor, "fanout"
+            except (Unsupported, sqlite3.OperationalError) as e:
+                # a bad split shows up as an error on the shards or in the merge; cancellations are real
+                if isinstance(e, QueryCancelled):
+                    raise
+        pool = self.federated_pool()
+        self._count("federated", len(self.pools))
+        return PooledCursor(pool, statement, params, time_budget, row_budget), "federated"
+
+    def cardinalities(self) -> dict:
+        # row counts summed over the shards, for the cost gate
+        counts = {}
+        with self.shared.query() as cur:
+            for table in GLOBAL_TABLES:
+                counts[table] = cur.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+        for pool in self.pools.values():
+            with pool.query() as cur:
+                for table in self.site_tables:
+                    counts[table] = counts.get(table, 0) + cur.execute(f"SELECT COUNT(*) FROM main.{table}").fetchone()[0]
+        return counts
+
+    def warm(self) -> int:
+        pools = [self.shared, *self.pools.values()]
+        if len(self.shard_paths) <= MAX_ATTACHED:
+            pools.append(self.federated_pool())
+        return sum(pool.warm() for pool in pools)
+
+    def stats(self) -> dict:
+        with self.lock:
+            stats = {**self.counts, "shards": len(self.pools)}
+        stats["pools"] = {key: pool.stats() for key, pool in self.pools.items()}
+        return stats
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+
+
+# statements whose rows cross shards along a relation: transfers to other sites' locations
+CHECK_STATEMENTS = (
+    "SELECT COUNT(*) FROM AssetTransactions t JOIN Locations l ON l.LocationId = t.ToLocationId",
+    "SELECT l.SiteId, COUNT(*) FROM AssetTransactions t JOIN Locations l ON l.LocationId = t.ToLocationId GROUP BY l.SiteId",
+    "SELECT COUNT(*) FROM AssetTransactions t JOIN Locations l ON l.LocationId = t.ToLocationId WHERE l.SiteId = 2",
+    "SELECT COUNT(*) FROM AssetTransactions t JOIN Locations l ON l.LocationId = t.FromLocationId",
+    "SELECT a.AssetTag, l.LocationCode FROM Assets a JOIN Locations l ON l.LocationId = a.LocationId ORDER BY a.AssetTag",
+)
+
+
+def compare(db: ShardedDatabase, conn: sqlite3.Connection, sql: str) -> tuple:
+    """
+    Runs `sql` on the shards and on the single file `conn`. Returns
+    (same, strategy, shard rows, single-file rows, shard ms, single-file ms).
+    """
+    started = time.perf_counter()
+    with db.query(row_budget=0) as cur:
+        rows = cur.execute(sql).fetchall()
+        strategy = cur.strategy
+    shard_ms = (time.perf_counter() - started) * 1000
+    started = time.perf_counter()
+    expected = conn.execute(sql).fetchall()
+    single_ms = (time.perf_counter() - started) * 1000
+    # partial sums add up in a different order, so floats only have to agree to 6 places
+    rounded, rounded_expected = ([tuple(round(v, 6) if isinstance(v, float) else v for v in row) for row in result] for result in (rows, expected))
+    ordered = re.search(r"\border\s+by\b", mask(sql), re.IGNORECASE) is not None
+    same = rounded == rounded_expected if ordered else sorted(map(repr, rounded)) == sorted(map(repr, rounded_expected))
+    return same, strategy, rows, expected, shard_ms, single_ms
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Split the ERP database into per-site shards, or query the shards")
+    parser.add_argument("action", choices=["build", "query", "compare", "check"])
+    parser.add_argument("sql", nargs="?", help="statement for query/compare")
+    parser.add_argument("--db", default=DB_PATH, help="single-file database to split or compare against")
+    parser.add_argument("--dir", default="shards", help="directory holding the shard files")
+    parser.add_argument("--golden", default=os.path.join("benchmarks", "golden_questions.json"),
+                        help="golden questions whose SQL check also compares")
+    args = parser.parse_args()
+
+    if args.action == "build":
+        for name, seconds in build_shards(args.db, args.dir).items():
+            print(f"{name:<22} {seconds:.3f}s")
+        return
+    db = ShardedDatabase(args.dir)
+    try:
+        if args.action == "query":
+            started = time.perf_counter()
+            with db.query(row_budget=0) as cur:
+                rows = cur.execute(args.sql).fetchall()
+                strategy = cur.strategy
+            for row in rows:
+                print(row)
+            print(f"{len(rows)} rows via {strategy} in {(time.perf_counter() - started) * 1000:.1f} ms")
+            return
+        with sqlite3.connect(f"file:{args.db}?mode=ro", uri=True) as conn:
+            if args.action == "compare":
+                same, strategy, rows, expected, shard_ms, single_ms = compare(db, conn, args.sql)
+                print(f"{len(rows)} rows via {strategy} in {shard_ms:.1f} ms")
+                print(f"{len(expected)} rows from {args.db} in {single_ms:.1f} ms")
+                print("same result" if same else "results differ")
+                if not same:
+                    raise SystemExit(1)
+                return
+            # check: the golden SQL plus the cross-shard joins, every one has to match the single file
+            statements = list(CHECK_STATEMENTS)
+            if os.path.exists(args.golden):
+                with open(args.golden, "r", encoding="utf-8") as f:
+                    statements = [g["sql"] for g in json.load(f)] + statements
+            failed = skipped = 0
+            for sql in statements:
+                try:
+                    same, strategy, rows, expected, _, _ = compare(db, conn, sql)
+                except Unsupported:
+                    # too many shards to federate, the agent gets the same error and rewrites the query
+                    skipped += 1
+                    print(f"skip {'federated':<9} {'':>15} {squash(sql)[:90]}")
+                    continue
+                failed += not same
+                print(f"{'ok  ' if same else 'DIFF'} {strategy:<9} {len(rows):>6} / {len(expected):<6} {squash(sql)[:90]}")
+            print(f"{len(statements) - failed - skipped} of {len(statements)} statements match {args.db}"
+                  + (f", {skipped} skipped" if skipped else ""))
+            if failed:
+                raise SystemExit(1)
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
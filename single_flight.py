@@ -0,0 +1,79 @@
+import asyncio
+
+
+class FlightTimeout(asyncio.TimeoutError):
+    pass
+
+
+class Flight:
+    # one shared computation and the callers waiting on it
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent identical work: while a computation for `key` is in
+    flight, later callers with the same key wait for it instead of starting
+    their own, and every caller gets the same result or the same exception.
+    Nothing is kept once the computation finishes, so the next caller starts
+    a fresh one; caching is the result cache's and question cache's job.
+
+    `timeout` bounds how long each caller waits, not the computation: a
+    caller that gives up gets FlightTimeout while the others keep waiting.
+    When every caller has given up or been cancelled the computation is
+    cancelled too.
+    """
+
+    def __init__(self, name: str, timeout: float = None):
+        self.name = name
+        self.timeout = timeout
+        self.flights = {}
+        self.stats = {"calls": 0, "computed": 0, "shared": 0, "errors": 0, "timeouts": 0, "abandoned": 0, "max_waiters": 0}
+
+    async def run(self, key, factory) -> tuple:
+        """
+        Returns (result, shared): `shared` is True when this caller joined a
+        computation another caller started. `factory` is a no-argument
+        coroutine function, called only by the first caller.
+        """
+        self.stats["calls"] += 1
+        flight = self.flights.get(key)
+        shared = flight is not None
+        if shared:
+            self.stats["shared"] += 1
+        else:
+            flight = Flight(asyncio.ensure_future(factory()))
+            self.flights[key] = flight
+            self.stats["computed"] += 1
+            flight.task.add_done_callback(lambda task: self._finished(key, flight))
+        flight.waiters += 1
+        self.stats["max_waiters"] = max(self.stats["max_waiters"], flight.waiters)
+        try:
+            # shielded: one caller timing out or being cancelled doesn't cancel the others' result
+            return await asyncio.wait_for(asyncio.shield(flight.task), self.timeout), shared
+        except asyncio.TimeoutError:
+            if flight.task.done():
+                raise
+            self.stats["timeouts"] += 1
+            raise FlightTimeout(f"{self.name} did not finish within {self.timeout:g}s") from None
+        finally:
+            flight.waiters -= 1
+            if not flight.waiters and not flight.task.done():
+                self.stats["abandoned"] += 1
+                flight.task.cancel()
+
+    def _finished(self, key, flight: Flight):
+        if self.flights.get(key) is flight:
+            del self.flights[key]
+        if not flight.task.cancelled() and flight.task.exception() is not None:
+            self.stats["errors"] += 1
+
+    def metrics(self) -> dict:
+        calls = self.stats["calls"]
+        return {
+            **self.stats,
+            "in_flight": len(self.flights),
+            "dedup_ratio": round(self.stats["shared"] / calls, 4) if calls else 0.0,
+        }
@@ -0,0 +1,244 @@
+import argparse
+import os
+import re
+import sqlite3
+import threading
+import time
+from contextlib import closing
+
+from query_cache import CACHE_DB_PATH, normalize_question
+from sqlite_seed import DB_PATH
+
+
+# columns whose values people type into questions, as (table, column)
+ENTITY_COLUMNS = (
+    ("Vendors", "VendorName"),
+    ("Vendors", "VendorCode"),
+    ("Customers", "CustomerName"),
+    ("Customers", "CustomerCode"),
+    ("Sites", "SiteCode"),
+    ("Sites", "SiteName"),
+    ("Locations", "LocationCode"),
+    ("Items", "ItemCode"),
+    ("Items", "ItemName"),
+    ("Assets", "AssetTag"),
+)
+MAX_VALUES_PER_COLUMN = 200000
+MONTHS = ("january", "february", "march", "april", "may", "june", "july", "august", "september", "october", "november", "december")
+MONTH_PATTERN = re.compile(r"\b(" + "|".join(MONTHS) + r")\s+(\d{4})\b")
+DATE_PATTERN = re.compile(r"\b\d{4}-\d{2}(?:-\d{2})?\b")
+LITERAL_PATTERN = re.compile(r"'(?:[^']|'')*'")
+SLOT_PATTERN = re.compile(r":slot(\d+)\b")
+
+
+class EntityDictionary:
+    """
+    Lookup of entity values (vendor names, site codes, asset tags, ...) read
+    once from the database. Keys are the values as normalize_question() sees
+    them, so matching works on the same token stream as the question.
+    """
+
+    def __init__(self, conn: sqlite3.Connection, columns=ENTITY_COLUMNS, max_values: int = MAX_VALUES_PER_COLUMN):
+        self.values = {}
+        self.max_tokens = 1
+        for table, column in columns:
+            try:
+                # no bound parameters, so a sharded database can fan the statement out
+                rows = conn.execute(f'SELECT DISTINCT "{column}" FROM "{table}" LIMIT {int(max_values)}').fetchall()
+            except sqlite3.OperationalError:
+                continue
+            kind = f"{table}.{column}"
+            for (value,) in rows:
+                if value is None:
+                    continue
+                key = normalize_question(str(value))
+                if not key:
+                    continue
+                self.values.setdefault(key, []).append((kind, str(value)))
+                self.max_tokens = max(self.max_tokens, key.count(" ") + 1)
+
+    def find(self, text: str) -> list:
+        """
+        Longest-first, left-to-right scan of a normalized question. Returns
+        the tokens and (start_token, end_token, candidates) spans, candidates a list
+        of (kind, canonical value). Months ("march 2024", "2024-03") and bare
+        integers come back as the MONTH and NUMBER kinds.
+        """
+        text = MONTH_PATTERN.sub(lambda m: f"{m.group(2)}-{MONTHS.index(m.group(1)) + 1:02d}", text)
+        tokens = text.split(" ")
+        spans = []
+        i = 0
+        while i < len(tokens):
+            for n in range(min(self.max_tokens, len(tokens) - i), 0, -1):
+                key = " ".join(tokens[i:i + n])
+                if key in self.values:
+                    spans.append((i, i + n, self.values[key]))
+                    i += n
+                    break
+            else:
+                token = tokens[i]
+                if DATE_PATTERN.fullmatch(token):
+                    spans.append((i, i + 1, [("MONTH" if len(token) == 7 else "DATE", token)]))
+                elif token.isdigit():
+                    spans.append((i, i + 1, [("NUMBER", token)]))
+                i += 1
+        return tokens, spans
+
+
+def quote_value(kind: str, value: str) -> str:
+    # the value lands inside an existing literal, or bare for numbers
+    return value if kind == "NUMBER" else value.replace("'", "''")
+
+
+def templatize_sql(sql_query: str, kind: str, value: str, slot: int):
+    """
+    Replaces `value` in `sql_query` with :slot<N>. Text values are only looked
+    for inside string literals, numbers only outside them, and the value has
+    to occur exactly once so there is no doubt which occurrence it was.
+    """
+    if kind == "NUMBER":
+        parts = LITERAL_PATTERN.split(sql_query)
+        literals = LITERAL_PATTERN.findall(sql_query)
+        hits = [(i, m) for i, part in enumerate(parts) for m in re.finditer(rf"(?<![\w.]){value}(?![\w.])", part)]
+        if len(hits) != 1:
+            return None
+        index, match = hits[0]
+        parts[index] = parts[index][:match.start()] + f":slot{slot}" + parts[index][match.end():]
+        out = [parts[0]]
+        for literal, part in zip(literals, parts[1:]):
+            out.extend([literal, part])
+        return "".join(out)
+    escaped = re.escape(value.replace("'", "''"))
+    hits = [m for m in LITERAL_PATTERN.finditer(sql_query) if re.search(escaped, m.group(0), re.IGNORECASE)]
+    if len(hits) != 1 or len(re.findall(escaped, hits[0].group(0), re.IGNORECASE)) != 1:
+        return None
+    literal = hits[0]
+    replaced = re.sub(escaped, f":slot{slot}", literal.group(0), flags=re.IGNORECASE)
+    return sql_query[:literal.start()] + replaced + sql_query[literal.end():]
+
+
+class TemplateIndex:
+    """
+    Parameterized question -> SQL templates mined from past (question, SQL)
+    pairs. Entity values found in the question and in the SQL become slots,
+    so "open bills for Vendor 1" also answers "open bills for Vendor 7".
+    match() is a dictionary scan plus one hash lookup, no model call.
+    """
+
+    def __init__(self, entities: EntityDictionary, min_support: int = 1):
+        self.entities = entities
+        self.min_support = min_support
+        self.lock = threading.Lock()
+        # question pattern -> {sql template: times seen}
+        self.templates = {}
+        self.hits = 0
+        self.misses = 0
+        self.match_seconds = 0.0
+
+    def _pattern(self, tokens: list, spans: list, kinds: list) -> str:
+        out = []
+        last = 0
+        for (start, end, _), kind in zip(spans, kinds):
+            out.extend(tokens[last:start])
+            out.append("{" + kind + "}")
+            last = end
+        out.extend(tokens[last:])
+        return " ".join(out)
+
+    def learn(self, question: str, sql_query: str) -> bool:
+        # returns True when the pair produced a template with at least one slot
+        tokens, spans = self.entities.find(normalize_question(question))
+        template = sql_query
+        kept = []
+        kinds = []
+        for start, end, candidates in spans:
+            for kind, value in candidates:
+                candidate = templatize_sql(template, kind, value, len(kept))
+                if candidate is not None:
+                    template = candidate
+                    kept.append((start, end, candidates))
+                    kinds.append(kind)
+                    break
+        if not kept:
+            return False
+        pattern = self._pattern(tokens, kept, kinds)
+        with self.lock:
+            seen = self.templates.setdefault(pattern, {})
+            seen[template] = seen.get(template, 0) + 1
+        return True
+
+    def mine(self, pairs) -> int:
+        return sum(1 for question, sql_query in pairs if self.learn(question, sql_query))
+
+    def _lookup(self, tokens: list, spans: list):
+        # spans with several candidate kinds (a code that is both a site and a location) try each
+        choices = [[]]
+        for _, _, candidates in spans:
+            choices = [c + [cand] for c in choices for cand in candidates][:64]
+        for choice in choices:
+            seen = self.templates.get(self._pattern(tokens, spans, [kind for kind, _ in choice]))
+            if seen:
+                template, count = max(seen.items(), key=lambda kv: kv[1])
+                if count >= self.min_support:
+                    return SLOT_PATTERN.sub(lambda m: quote_value(*choice[int(m.group(1))]), template)
+        return None
+
+    def match(self, question: str):
+        started = time.perf_counter()
+        tokens, spans = self.entities.find(normalize_question(question))
+        sql_query = None
+        if spans:
+            with self.lock:
+                sql_query = self._lookup(tokens, spans)
+                if sql_query is None:
+                    # numbers the template kept literal ("top 5") are matched as plain text
+                    text_spans = [s for s in spans if s[2][0][0] != "NUMBER"]
+                    if len(text_spans) != len(spans) and text_spans:
+                        sql_query = self._lookup(tokens, text_spans)
+        self.match_seconds += time.perf_counter() - started
+        if sql_query is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return sql_query
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "templates": len(self.templates),
+            "hits": self.hits,
+            "misses": self.misses,
+            "avg_match_ms": round(self.match_seconds / lookups * 1000, 4) if lookups else 0.0,
+        }
+
+
+def cached_pairs(path: str = CACHE_DB_PATH) -> list:
+    # every question the model answered and the SQL that ran, from the question cache; read-only, so mining never creates it
+    if not os.path.exists(path):
+        return []
+    with closing(sqlite3.connect(f"file:{path}?mode=ro", uri=True)) as conn:
+        try:
+            return conn.execute("SELECT Question, SqlQuery FROM QuestionCache ORDER BY LastUsedAt").fetchall()
+        except sqlite3.OperationalError:
+            return []
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mine question -> SQL templates from past questions")
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--cache", default=CACHE_DB_PATH, help="question cache to mine")
+    parser.add_argument("--ask", action="append", default=[], help="question to try against the mined templates")
+    args = parser.parse_args()
+
+    with sqlite3.connect(f"file:{args.db}?mode=ro", uri=True) as conn:
+        index = TemplateIndex(EntityDictionary(conn))
+    mined = index.mine(cached_pairs(args.cache))
+    print(f"{mined} pairs mined into {len(index.templates)} templates")
+    for pattern, seen in sorted(index.templates.items()):
+        print(f"  {pattern}  ({sum(seen.values())} seen)")
+    for question in args.ask:
+        print(f"{question} -> {index.match(question)}")
+
+
+if __name__ == "__main__":
+    main()
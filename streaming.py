@@ -0,0 +1,49 @@
+import sqlite3
+import sys
+
+
+FETCH_BATCH_SIZE = 500
+EXPLANATION_SAMPLE_ROWS = 50
+
+
+def iter_row_batches(cursor: sqlite3.Cursor, batch_size: int = FETCH_BATCH_SIZE):
+    # pulls rows off the cursor in fetchmany batches, never materializing the full result
+    while True:
+        batch = cursor.fetchmany(batch_size)
+        if not batch:
+            return
+        yield batch
+
+
+def stream_rows(cursor: sqlite3.Cursor, batch_size: int = FETCH_BATCH_SIZE, sample_limit: int = EXPLANATION_SAMPLE_ROWS, out=sys.stdout, on_batch=None):
+    """
+    Prints rows as each batch arrives and returns (row_count, sample) where
+    sample holds at most `sample_limit` leading rows for the explanation prompt.
+    `on_batch`, when given, is called with every batch (e.g. ResultSummary.add_rows).
+    Memory stays at one batch plus the sample, whatever the result size.
+    """
+    row_count = 0
+    sample = []
+    for batch in iter_row_batches(cursor, batch_size):
+        out.write("".join(f"{row}\n" for row in batch))
+        out.flush()
+        if on_batch is not None:
+            on_batch(batch)
+        if len(sample) < sample_limit:
+            sample.extend(batch[: sample_limit - len(sample)])
+        row_count += len(batch)
+    return row_count, sample
+
+
+def stream_explanation(backend, prompt: str, out=sys.stdout) -> str:
+    # prints tokens as the backend (see llm_backends) produces them and returns the whole text
+    parts = []
+    for text in backend.generate_stream(prompt):
+        if not text:
+            continue
+        parts.append(text)
+        out.write(text)
+        out.flush()
+    out.write("\n")
+    out.flush()
+    return "".join(parts).strip()
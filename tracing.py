@@ -0,0 +1,210 @@
+import json
+import os
+import threading
+import time
+import uuid
+
+
+TRACE_FILE = "traces.jsonl"
+METRICS_FILE = "metrics.prom"
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def set(self, **attrs):
+        pass
+
+
+class _NullTurn:
+    def span(self, name: str, **attrs):
+        return NULL_SPAN
+
+    def set(self, **attrs):
+        pass
+
+    def finish(self, error: BaseException = None):
+        pass
+
+
+NULL_SPAN = _NullSpan()
+NULL_TURN = _NullTurn()
+
+
+class NullTracer:
+    # tracing disabled: every call returns a shared no-op object
+    enabled = False
+
+    def start_turn(self, **attrs):
+        return NULL_TURN
+
+    def flush(self):
+        pass
+
+
+class Span:
+    def __init__(self, turn, name: str, attrs: dict):
+        self.turn = turn
+        self.name = name
+        self.attrs = attrs
+        self.started = 0.0
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        record = {
+            "name": self.name,
+            "start": round(self.started - self.turn.started, 6),
+            "seconds": round(time.perf_counter() - self.started, 6),
+            **self.attrs,
+        }
+        if exc_type is not None:
+            record["error"] = exc_type.__name__
+        self.turn.spans.append(record)
+        return False
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+
+class Turn:
+    def __init__(self, tracer, attrs: dict):
+        self.tracer = tracer
+        self.trace_id = uuid.uuid4().hex
+        self.attrs = attrs
+        self.spans = []
+        self.wall_started = time.time()
+        self.started = time.perf_counter()
+
+    def span(self, name: str, **attrs) -> Span:
+        return Span(self, name, attrs)
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def finish(self, error: BaseException = None):
+        record = {
+            "trace_id": self.trace_id,
+            "ts": round(self.wall_started, 3),
+            "seconds": round(time.perf_counter() - self.started, 6),
+            **self.attrs,
+            "spans": self.spans,
+        }
+        if error is not None:
+            record["error"] = type(error).__name__
+        self.tracer.record(record)
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.total += value
+        self.count += 1
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+
+class Tracer:
+    """
+    Per-turn spans written as one JSONL line per turn, plus Prometheus text
+    metrics (span latency histograms, error, token, row and byte counters)
+    rewritten every `metrics_every` turns and on flush().
+    """
+
+    enabled = True
+
+    def __init__(self, directory: str, metrics_every: int = 10):
+        os.makedirs(directory, exist_ok=True)
+        self.trace_path = os.path.join(directory, TRACE_FILE)
+        self.metrics_path = os.path.join(directory, METRICS_FILE)
+        self.metrics_every = metrics_every
+        self.lock = threading.Lock()
+        self.trace_file = open(self.trace_path, "a", encoding="utf-8")
+        self.histograms = {}
+        self.counters = {}
+        self.turns = 0
+
+    @classmethod
+    def from_env(cls):
+        # AGENT_TRACE_DIR turns tracing on, otherwise it costs one no-op call per span
+        directory = os.getenv("AGENT_TRACE_DIR")
+        return cls(directory) if directory else NullTracer()
+
+    def start_turn(self, **attrs) -> Turn:
+        return Turn(self, attrs)
+
+    def _inc(self, name: str, labels: tuple, amount: float):
+        key = (name, labels)
+        self.counters[key] = self.counters.get(key, 0) + amount
+
+    def record(self, record: dict):
+        with self.lock:
+            self.trace_file.write(json.dumps(record, default=str) + "\n")
+            self.trace_file.flush()
+            self.turns += 1
+            self.histograms.setdefault("turn", Histogram()).observe(record["seconds"])
+            if "error" in record:
+                self._inc("agent_turn_errors_total", (("error", record["error"]),), 1)
+            for span in record["spans"]:
+                name = span["name"]
+                self.histograms.setdefault(name, Histogram()).observe(span["seconds"])
+                if "error" in span:
+                    self._inc("agent_span_errors_total", (("span", name), ("error", span["error"])), 1)
+                for attr in ("prompt_tokens", "response_tokens"):
+                    if attr in span:
+                        self._inc("agent_tokens_total", (("span", name), ("kind", attr[:-7])), span[attr])
+                if "rows" in span:
+                    self._inc("agent_rows_total", (("span", name),), span["rows"])
+                if "bytes" in span:
+                    self._inc("agent_bytes_total", (("span", name),), span["bytes"])
+            if self.turns % self.metrics_every == 0:
+                self._write_metrics()
+
+    def render_metrics(self) -> str:
+        lines = [
+            "# HELP agent_span_seconds Latency of each pipeline stage per turn.",
+            "# TYPE agent_span_seconds histogram",
+        ]
+        for name in sorted(self.histograms):
+            hist = self.histograms[name]
+            cumulative = 0
+            for bound, count in zip(hist.buckets, hist.counts):
+                cumulative += count
+                lines.append(f'agent_span_seconds_bucket{{span="{name}",le="{bound}"}} {cumulative}')
+            lines.append(f'agent_span_seconds_bucket{{span="{name}",le="+Inf"}} {hist.count}')
+            lines.append(f'agent_span_seconds_sum{{span="{name}"}} {hist.total:.6f}')
+            lines.append(f'agent_span_seconds_count{{span="{name}"}} {hist.count}')
+        seen = set()
+        for (metric, labels), value in sorted(self.counters.items()):
+            if metric not in seen:
+                lines.append(f"# TYPE {metric} counter")
+                seen.add(metric)
+            label_text = ",".join(f'{k}="{v}"' for k, v in labels)
+            lines.append(f"{metric}{{{label_text}}} {value}")
+        return "\n".join(lines) + "\n"
+
+    def _write_metrics(self):
+        # write-then-rename so a scraper never reads half a file
+        tmp_path = self.metrics_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(self.render_metrics())
+        os.replace(tmp_path, self.metrics_path)
+
+    def flush(self):
+        with self.lock:
+            self._write_metrics()
+            self.trace_file.flush()